@@ -5,9 +5,44 @@ def create_app():
     app.config.from_mapping(
         SECRET_KEY='dev',
         UPLOAD_FOLDER='uploads',
-        TEMPLATES_AUTO_RELOAD=True
+        TEMPLATES_AUTO_RELOAD=True,
+        # Seconds after which encoding a k and gismo are stopped (None for no
+        # limit; their CPU time is limited to the same number of seconds), and
+        # after which the heuristic stops improving its solution
+        ENCODE_TIMEOUT=600,
+        GISMO_TIMEOUT=600,
+        HEURISTIC_TIME_LIMIT=10,
+        # GCNF size (in bytes) above which the exact run for a k is skipped
+        # (if even the low end of its estimate is larger), such that the
+        # answer is the heuristic one
+        MAX_EXACT_GCNF_SIZE=2 ** 27,
+        # Folder on a tmpfs (in memory) through which the GCNF is handed from
+        # the encoder to gismo, without going through the disk (None to write
+        # it to the upload folder). Its copy for download is compressed in the
+        # background ('background'), or generated when it is downloaded
+        # ('on_demand').
+        GCNF_HANDOFF_DIR='/dev/shm',
+        GCNF_COPY='background',
+        # Admission control: jobs are refused if their network has more than
+        # MAX_EDGES edges, or if their predicted CPU time (in seconds, for all
+        # k) or memory exceeds MAX_JOB_COST or the memory cap of the
+        # throttled lane. Jobs with a predicted CPU time of at most
+        # FAST_LANE_MAX_COST run in the fast lane, the others in the throttled
+        # lane. A lane refuses jobs when its queue is full.
+        RUNTIME_MODEL_FILE='identifying-codes/scripts/data-analysis/runtime_model_ijcai.json',
+        MAX_EDGES=2000000,
+        MAX_JOB_COST=24 * 3600,
+        FAST_LANE_MAX_COST=60,
+        FAST_LANE_WORKERS=2,
+        FAST_LANE_MAX_QUEUED=32,
+        THROTTLED_LANE_WORKERS=1,
+        THROTTLED_LANE_MAX_QUEUED=4,
+        THROTTLED_LANE_MEMORY_LIMIT=4 * 2 ** 30
     )
 
+    from .utils.admission import AdmissionControl
+    app.extensions['admission'] = AdmissionControl(app.config)
+
     from . import routes
     app.register_blueprint(routes.bp)
 
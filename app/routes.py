@@ -1,21 +1,39 @@
+import json
 import os
+import shutil
 import subprocess
-from flask import Blueprint, render_template, request, current_app, flash, send_from_directory, send_file, abort
+from flask import Blueprint, render_template, request, current_app, flash, send_from_directory, send_file, abort, jsonify, Response, stream_with_context, url_for
 from werkzeug.utils import secure_filename
 from .forms import InputForm
-from .utils.parse_gismo_output import parse_sensor_set_from_gismo_output
+from .utils.admission import AdmissionError
+from .utils.gcnf_handoff import BACKGROUND, handoff_folder, start_compressing
+from .utils.launcher import run_process
+from .utils.jobs import registry, OPTIMAL, RUNNING, DONE, FAILED, TIMED_OUT, SKIPPED
+from .utils.parse_gismo_output import GROUP_MAP_SUFFIX, parse_sensor_set_from_gismo_output
 import datetime
 
 bp = Blueprint('main', __name__)
 
+# Seconds after which an idle event stream sends a comment, so that proxies
+# do not close it
+EVENT_STREAM_KEEPALIVE = 15
+# Seconds that the heuristic run may take on top of its time limit, for
+# reading the network, the repair (k > 1), the lower bound (whose LP has a time
+# limit of its own) and the verification
+HEURISTIC_TIMEOUT_MARGIN = 60
+
 @bp.route('/', methods=['GET', 'POST'])
 def index():
+    """Anytime mode: a heuristic identifying code is computed first for each
+    k and shown as provisional. The exact gismo runs continue in the
+    background and replace the heuristic answers (as optimal) as they finish;
+    the page follows the job (see job_events), and the exact runs can be cancelled
+    when the heuristic answers are good enough.
+    Submissions are admitted by their predicted cost (see AdmissionControl):
+    the job runs in the fast or the throttled lane, or is refused with 413
+    (too large) or 429 (lane full)."""
     form = InputForm()
-    sensor = ''
-    output=''
-    gismo_output= None
-    download_files = []
-
+    job = None
 
     if form.validate_on_submit():
         network_file = None
@@ -56,58 +74,335 @@ def index():
             return render_template('index.html', form=form)
 
         print(f"Input file path: {network_file}")
-        for k in range(1, k_val + 1):
-            print(f"Processing for k = {k}...")
+        admission = current_app.extensions['admission']
+        try:
+            lane, cost = admission.classify(network_file, k_val)
+            job = registry.create(network_file, list(range(1, k_val + 1)))
+            job.cost = cost
+            print(f"Job {job.job_id} goes to the {lane} lane, predicted cost: {cost}")
+            admission.submit(lane, job, run_job, current_app.config['UPLOAD_FOLDER'],
+                             current_app.config['HEURISTIC_TIME_LIMIT'], current_app.config['ENCODE_TIMEOUT'],
+                             current_app.config['GISMO_TIMEOUT'], current_app.config['MAX_EXACT_GCNF_SIZE'],
+                             current_app.config['GCNF_HANDOFF_DIR'], current_app.config['GCNF_COPY'])
+        except AdmissionError as e:
+            if job is not None:
+                registry.discard(job.job_id)
+            flash(e.reason, 'error')
+            return render_template('index.html', form=form), e.status_code
+        except (OSError, ValueError) as e:
+            flash(f"The network could not be read: {e}", 'error')
+            return render_template('index.html', form=form), 400
+
+    else:
+        print("Form not validated or not submitted yet.")
+        job_id = request.args.get('job')
+        if job_id:
+            job = registry.get(job_id)
+    return render_template('index.html', form=form, job=job.to_dict() if job is not None else None)
+
+
+def estimate_gcnf_sizes(job, k_max, upload_folder, timeout):
+    """Estimate the size (in bytes) of the GCNF for each k up to k_max,
+    without generating it, in at most timeout seconds. Returns a dictionary
+    with the range (low, high) of the estimate by k, which is empty if the
+    estimate failed or timed out, in which case the job goes ahead as
+    usual."""
+    estimate_file = f"estimate_{job.job_id}.json"
+    try:
+        output = run_process(job, ['python3', './identifying-codes/scripts/encoding/encode_network.py', '-n', job.network_file, '--out_dir', upload_folder, '--out_file', estimate_file, '--encoding', 'estimate', '--two_step', '-k'] + [str(k) for k in range(1, k_max + 1)],
+                             timeout=timeout, stage='estimate')
+        if output is None:
+            return dict()
+        estimates = dict()
+        for k in range(1, k_max + 1):
+            with open(os.path.join(upload_folder, f'k{k}', estimate_file), 'r') as f:
+                estimates[k] = tuple(json.load(f)['size_estimate']['gis']['file_size_range'])
+        print(f"Estimated GCNF sizes: {estimates}")
+        return estimates
+    except subprocess.TimeoutExpired as e:
+        print(f"Estimating the encoding sizes timed out after {e.timeout} seconds.")
+        return dict()
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+        print(f"Error estimating the encoding sizes: {e}")
+        return dict()
+
+
+def run_job(job, upload_folder, heuristic_time_limit, encode_timeout, gismo_timeout, max_exact_gcnf_size,
+            handoff_dir, gcnf_copy):
+    """Run a job in its lane: skip the exact runs of the k whose GCNF would
+    be too large (even at the low end of its estimate), find the heuristic
+    answers, and then run gismo."""
+    ks = [result['k'] for result in job.to_dict()['results']]
+    gcnf_sizes = estimate_gcnf_sizes(job, max(ks), upload_folder, encode_timeout)
+    for k, (low, _) in gcnf_sizes.items():
+        if low > max_exact_gcnf_size:
+            job.update(k, exact_status=SKIPPED,
+                       message=f"The encoding would take at least {low / 2 ** 20:.0f} MB, which is too "
+                               f"large for an exact run.")
+    for k in ks:
+        if job.cancelled:
+            break
+        run_heuristic(job, k, upload_folder, heuristic_time_limit)
+    run_exact(job, upload_folder, encode_timeout, gismo_timeout, gcnf_sizes, handoff_dir, gcnf_copy)
+
+
+def run_heuristic(job, k, upload_folder, time_limit):
+    """Find an identifying code for k heuristically, which is an upper bound
+    on the size of the minimal one, and the answer if gismo fails, times out
+    or is cancelled. Its distance from a lower bound tells how far from
+    minimal it can be. The run is stopped HEURISTIC_TIMEOUT_MARGIN seconds
+    after its time limit."""
+    try:
+        heuristic_file = f"heuristic_{job.job_id}.json"
+        output = run_process(job, ['python3', './identifying-codes/scripts/encoding/encode_network.py', '-n', job.network_file, '--out_dir', upload_folder, '--out_file', heuristic_file, '--encoding', 'heuristic', '--two_step', '-k', str(k), '--time_limit', str(time_limit), '--lower_bound', '--verify'],
+                             timeout=time_limit + HEURISTIC_TIMEOUT_MARGIN, stage='heuristic', k=k)
+        if output is None:
+            return
+        with open(os.path.join(upload_folder, f'k{k}', heuristic_file), 'r') as f:
+            heuristic_results = json.load(f)
+        heuristic_S = heuristic_results['solution_info']['solution']
+        bound_info = heuristic_results.get('bound_info') or dict()
+        verification = heuristic_results.get('verification') or dict()
+        print(f"Heuristic sensor set for k={k}: {heuristic_S}")
+        job.update(k, sensor=heuristic_S, n_sensors=len(heuristic_S),
+                   lower_bound=bound_info.get('lower_bound'), gap=bound_info.get('gap'),
+                   verified=verification.get('valid'))
+    except subprocess.TimeoutExpired as e:
+        print(f"The heuristic timed out after {e.timeout} seconds.")
+        job.update(k, message=f"The heuristic timed out after {e.timeout} seconds.")
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError) as e:
+        print(f"Error running the heuristic: {e}")
+        job.update(k, message="The heuristic failed.")
+
+
+def verify_sensor_set(job, k, sensors, upload_folder):
+    """Check independently that the sensors found by gismo (by their labels
+    in the network file) form a k-identifying code. Returns True or False, or
+    None if the check could not be run."""
+    verify_file = os.path.join(upload_folder, f'k{k}', f"verify_{job.job_id}.json")
+    try:
+        output = run_process(job, ['python3', './identifying-codes/scripts/encoding/verifier.py', '-n', job.network_file, '--two_step', '-k', str(k), '--out_file', verify_file, '--sensors'] + [str(sensor) for sensor in sensors],
+                             stage='verify', k=k)
+        if output is None:
+            return None
+        with open(verify_file, 'r') as f:
+            return json.load(f)[0]['valid']
+    except (subprocess.CalledProcessError, OSError, ValueError, KeyError, IndexError) as e:
+        print(f"Error verifying the sensor set: {e}")
+        return None
+
+
+def run_exact(job, upload_folder, encode_timeout, gismo_timeout, gcnf_sizes, handoff_dir, gcnf_copy):
+    """Encode the network and run gismo for each k, replacing the heuristic
+    answers by the optimal ones, until the job is cancelled.
+    If it fits, the GCNF is handed from the encoder to gismo on the tmpfs at
+    handoff_dir rather than through the upload folder. Its copy for download
+    is then compressed in the background while gismo runs for the next k
+    (gcnf_copy BACKGROUND), or generated when it is downloaded (see
+    download_gcnf)."""
+    compressing = []
+    for k in sorted(result['k'] for result in job.to_dict()['results'] if result['exact_status'] != SKIPPED):
+        if job.cancelled:
+            break
+        print(f"Processing for k = {k}...")
+        job.update(k, exact_status=RUNNING)
+        # The GCNF must fit on the tmpfs even at the high end of its estimate
+        folder = handoff_folder(handoff_dir, gcnf_sizes[k][1] if k in gcnf_sizes else None)
+        try:
             # run cnf command
-            try:
-                cnf_file =  f"output_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.cnf"
-                result = subprocess.run(['python3', './identifying-codes/scripts/encoding/encode_network.py', '-n', network_file, '--out_dir', current_app.config['UPLOAD_FOLDER'], '--out_file', cnf_file, '--encoding', 'gis', '--two_step', '-k', str(k)],
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        text=True,
-                                        check=True)
-                output = result.stdout
-
-                # If the encode script created the expected file inside the 'k{n}' subfolder, expose it for download
-                possible_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f'k{k}', cnf_file)
-                if os.path.isfile(possible_path):
-                    download_files.append(possible_path)
-
-            except subprocess.CalledProcessError as e:
-                output = f"Error running encode_network.py:\n{e.stderr}"
-            
+            step = 'The encoding'
+            # (the jobs share the upload folder, so their files are named after the job)
+            cnf_file = f"output_{job.job_id}.cnf"
+            output = run_process(job, ['python3', './identifying-codes/scripts/encoding/encode_network.py', '-n', job.network_file, '--out_dir', folder or upload_folder, '--out_file', cnf_file, '--encoding', 'gis', '--two_step', '-k', str(k)],
+                                 timeout=encode_timeout, stage='encode', k=k)
+            if output is None:
+                break
             print("Output: ", output)
+
+            # If the encode script created the expected file inside the 'k{n}' subfolder, expose it for download
+            input_path = os.path.join(folder or upload_folder, f'k{k}', cnf_file)
+            if folder is None and os.path.isfile(input_path):
+                job.add_download_file(input_path)
+
             # Run ./gismo command
-            try:
-                input_path = os.path.join(current_app.config['UPLOAD_FOLDER'], f"k{k}/{cnf_file}")
-                result = subprocess.run(['./gismo/build/gismo',input_path],
-                                        stdout=subprocess.PIPE,
-                                        stderr=subprocess.PIPE,
-                                        text=True,
-                                        check=True)
-                gismo_output = result.stdout
-
-                # parse gismo output to get sensor set
-            
-                sensor_S = parse_sensor_set_from_gismo_output(gismo_output, input_path)
-                # change sensor_S to string for display
-                print(f"Sensor set for k={k}: {sensor_S}")
-                sensor += f"\nGeneralised identifying code set (k = {k}): {sensor_S}\n"
-            except subprocess.CalledProcessError as e:
-                gismo_output = f"Error running gismo:\n{e.stderr}"
+            step = 'Gismo'
+            # (line buffered, if possible, so that its progress is streamed as it is made)
+            line_buffered = ['stdbuf', '-oL'] if shutil.which('stdbuf') else []
+            gismo_output = run_process(job, line_buffered + ['./gismo/build/gismo', input_path], timeout=gismo_timeout,
+                                       stage='gismo', k=k, keep=lambda line: line.startswith('c ind'))
+            if gismo_output is None:
+                break
             print("GiSMo Output: ", gismo_output)
 
-        # clean TEMP_ files in current folder
-        try:
-            for f in os.listdir('.'):
-                if f.startswith('TEMP_'):
-                    os.remove(f)
-        except Exception as e:
-            print(f"Error cleaning TEMP_ files: {e}")
+            # parse gismo output to get sensor set
+            sensor_S = parse_sensor_set_from_gismo_output(gismo_output, input_path)
+            print(f"Sensor set for k={k}: {sensor_S}")
+            verified = verify_sensor_set(job, k, sensor_S, upload_folder)
+            if verified is False:
+                job.update(k, exact_status=FAILED, message=f"The gismo answer is not a {k}-identifying code.")
+                continue
+            job.update(k, status=OPTIMAL, exact_status=DONE, sensor=sensor_S, n_sensors=len(sensor_S), gap=0.0,
+                       verified=verified, message='')
+        except subprocess.CalledProcessError as e:
+            print(f"{step} failed:\n{e.stderr}")
+            job.update(k, exact_status=FAILED, message=f"The exact run failed with exit code {e.returncode}.")
+        except subprocess.TimeoutExpired as e:
+            print(f"{step} timed out after {e.timeout} seconds.")
+            job.update(k, exact_status=TIMED_OUT, message=f"{step} timed out after {e.timeout} seconds.")
+        except OSError as e:
+            print(f"Error running the exact run: {e}")
+            job.update(k, exact_status=FAILED, message=f"The exact run failed: {e.strerror}.")
+        except (RuntimeError, KeyError) as e:
+            print(f"Error reading the gismo result: {e}")
+            job.update(k, exact_status=FAILED, message="The gismo result could not be read.")
+        finally:
+            # Gismo is done with the GCNF on the tmpfs: keep it for download
+            if folder is not None:
+                input_path = os.path.join(folder, f'k{k}', cnf_file)
+                encoded = os.path.isfile(input_path)
+                if encoded and gcnf_copy == BACKGROUND:
+                    compressing.append(start_compressing(job, input_path, os.path.join(upload_folder, f'k{k}', cnf_file + '.gz'), folder))
+                else:
+                    shutil.rmtree(folder, ignore_errors=True)
+                    if encoded:
+                        job.offer_gcnf(k)
 
-    else:
-        print("Form not validated or not submitted yet.")
-    return render_template('index.html', form=form, output=output, sensor=sensor, download_files=download_files)
+    # clean TEMP_ files in current folder
+    try:
+        for f in os.listdir('.'):
+            if f.startswith('TEMP_'):
+                os.remove(f)
+    except Exception as e:
+        print(f"Error cleaning TEMP_ files: {e}")
+    # The job is done when the copies of its GCNFs can be downloaded
+    for thread in compressing:
+        thread.join()
+    job.finish()
+
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Current results of a job, as JSON."""
+    job = registry.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.to_dict())
+
+
+@bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """Progress of a job as server-sent events: an 'output' event (with the
+    stage, k and line) for each output line of the encoder and gismo as it is
+    written, a 'status' event (the results, as in job_status) whenever the
+    results change, and a 'done' event when the job has finished.
+    A client that reconnects with a Last-Event-ID header continues after that
+    output line; if lines have been dropped in the meantime (the job keeps
+    only the last ones), a 'gap' event tells how many."""
+    job = registry.get(job_id)
+    if job is None:
+        abort(404)
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', request.args.get('since', 0)))
+    except ValueError:
+        last_event_id = 0
+
+    def stream(last_event_id):
+        version = None
+        while True:
+            events, new_version, done = job.wait_for_events(last_event_id, version, EVENT_STREAM_KEEPALIVE)
+            if events and events[0]['id'] > last_event_id + 1:
+                yield f"event: gap\ndata: {json.dumps({'dropped': events[0]['id'] - last_event_id - 1})}\n\n"
+            for event in events:
+                yield f"id: {event['id']}\nevent: output\ndata: {json.dumps(event)}\n\n"
+                last_event_id = event['id']
+            if new_version != version:
+                version = new_version
+                yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+            elif not events and not done:
+                yield ": keep-alive\n\n"
+            if done and not events:
+                yield "event: done\ndata: {}\n\n"
+                return
+
+    return Response(stream_with_context(stream(last_event_id)), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@bp.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    """Accept the current (heuristic) answers of a job: stop its exact runs."""
+    if not registry.cancel(job_id):
+        abort(404)
+    return jsonify(registry.get(job_id).to_dict())
+
+
+@bp.route('/jobs/<job_id>/gcnf/<int:k>', methods=['GET'])
+def download_gcnf(job_id, k):
+    """Serve the GCNF of a job for k, compressed, for jobs whose GCNF was
+    only handed to gismo on the tmpfs (see run_exact). It is generated when it
+    is first downloaded, by a job of its own in the lane of the job (see
+    generate_gcnf), and served from the upload folder after that. Until then,
+    the answer is 202 with the generating job, which the Location header
+    points to."""
+    job = registry.get(job_id)
+    if job is None or k not in job.to_dict()['gcnf_on_demand']:
+        abort(404)
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    gcnf_path = os.path.abspath(os.path.join(upload_folder, f'k{k}', f'gcnf_{job_id}.cnf.gz'))
+    if os.path.isfile(gcnf_path):
+        return send_file(gcnf_path, as_attachment=True, mimetype='application/gzip')
+
+    generating_id = job.to_dict()['gcnf_jobs'].get(k)
+    generating = registry.get(generating_id) if generating_id is not None else None
+    if generating is not None and generating.done:
+        # The last attempt did not produce the GCNF: report it, and try again
+        # on the next download
+        if job.claim_gcnf_job(k, None, replaced=generating_id) is None:
+            abort(500)
+        generating_id, generating = None, None
+    if generating is None:
+        generating = registry.create(job.network_file, [k])
+        if job.claim_gcnf_job(k, generating.job_id, replaced=generating_id) != generating.job_id:
+            # Another download has started it in the meantime
+            registry.discard(generating.job_id)
+            generating = registry.get(job.to_dict()['gcnf_jobs'][k])
+        elif not current_app.extensions['admission'].lanes[job.lane].submit(
+                generating, generate_gcnf, k, upload_folder, gcnf_path, current_app.config['ENCODE_TIMEOUT']):
+            job.claim_gcnf_job(k, None, replaced=generating.job_id)
+            registry.discard(generating.job_id)
+            return jsonify({'message': "Too many networks are waiting to be solved. Please try again later."}), \
+                429, {'Retry-After': '10'}
+    return jsonify(generating.to_dict()), 202, \
+        {'Location': url_for('main.job_status', job_id=generating.job_id), 'Retry-After': '2'}
+
+
+def generate_gcnf(job, k, upload_folder, gcnf_path, encode_timeout):
+    """Encode the network of a job for k into the compressed GCNF at
+    gcnf_path, for download_gcnf. It is encoded to a file of its own first,
+    such that a download never serves a partial file."""
+    partial_file = f'gcnf_{job.job_id}.cnf.gz'
+    partial_path = os.path.join(upload_folder, f'k{k}', partial_file)
+    job.update(k, exact_status=RUNNING)
+    try:
+        output = run_process(job, ['python3', './identifying-codes/scripts/encoding/encode_network.py', '-n', job.network_file, '--out_dir', upload_folder, '--out_file', partial_file, '--encoding', 'gis', '--two_step', '-k', str(k)],
+                             timeout=encode_timeout, stage='encode', k=k)
+        if output is not None:
+            os.replace(partial_path, gcnf_path)
+            job.update(k, exact_status=DONE)
+    except subprocess.CalledProcessError as e:
+        print(f"Generating the GCNF for download failed:\n{e.stderr}")
+        job.update(k, exact_status=FAILED, message=f"The encoding failed with exit code {e.returncode}.")
+    except subprocess.TimeoutExpired as e:
+        print(f"Generating the GCNF for download timed out after {e.timeout} seconds.")
+        job.update(k, exact_status=TIMED_OUT, message=f"The encoding timed out after {e.timeout} seconds.")
+    except OSError as e:
+        print(f"Error generating the GCNF for download: {e}")
+        job.update(k, exact_status=FAILED, message=f"The encoding failed: {e.strerror}.")
+    finally:
+        for path in (partial_path, partial_path + GROUP_MAP_SUFFIX):
+            if os.path.exists(path):
+                os.remove(path)
+        job.finish()
 
 
 @bp.route('/download_cnf/<path:filepath>', methods=['GET'])
@@ -137,4 +432,5 @@ def download_cnf(filepath):
         abort(404)
 
     # Use send_file with as_attachment to serve the exact file path
-    return send_file(file_path, as_attachment=True, mimetype='text/plain')
\ No newline at end of file
+    return send_file(file_path, as_attachment=True,
+                     mimetype='application/gzip' if file_path.endswith('.gz') else 'text/plain')
\ No newline at end of file
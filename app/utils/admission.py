@@ -0,0 +1,177 @@
+import os
+import queue
+import sys
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                                'identifying-codes', 'scripts', 'data-analysis'))
+from runtime_predictor import RuntimePredictor
+
+# Lanes in which the jobs run
+FAST = 'fast'
+THROTTLED = 'throttled'
+
+
+class AdmissionError(Exception):
+    """A submission that is not admitted, with the HTTP status code to answer
+    it with (413 if it is too large, 429 if its lane is full) and the reason
+    to show the user."""
+
+    def __init__(self, status_code: int, reason: str):
+        Exception.__init__(self, reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+def network_size(network_file: str) -> Tuple[int, int]:
+    """Count the nodes and edges of a network without building the graph,
+    like the encoder counts them: duplicate edges once, and self-loops as
+    edges. A Matrix Market file with a symmetric pattern lists each edge once
+    (the lower triangle and the diagonal), so its size line has the number of
+    edges; a general one can list an edge twice (both triangles), so its
+    entries are counted. An edge list takes a pass over its lines."""
+    with open(network_file, 'r', encoding='utf-8', errors='replace') as f:
+        if network_file.endswith('.mtx'):
+            symmetry = 'general'
+            n_nodes = None
+            edges = set()
+            for line in f:
+                if line.startswith('%%MatrixMarket'):
+                    symmetry = line.split()[-1].lower()
+                    continue
+                if line.startswith('%') or not line.strip():
+                    continue
+                if n_nodes is None:
+                    n_rows, n_cols, n_entries = (int(value) for value in line.split()[:3])
+                    n_nodes = max(n_rows, n_cols)
+                    if symmetry != 'general':
+                        return n_nodes, n_entries
+                    continue
+                u, w = line.split()[:2]
+                edges.add((u, w) if int(u) <= int(w) else (w, u))
+            return (n_nodes, len(edges)) if n_nodes is not None else (0, 0)
+        nodes = set()
+        edges = set()
+        for line in f:
+            if line.startswith('#') or line.startswith('%'):
+                continue
+            endpoints = line.split()[:2]
+            if len(endpoints) < 2:
+                continue
+            u, w = endpoints
+            nodes.update(endpoints)
+            edges.add((u, w) if u < w else (w, u))
+        return len(nodes), len(edges)
+
+
+def expected_cost(predictor: Optional[RuntimePredictor], n_nodes: int, n_edges: int,
+                  k_max: int) -> Dict[str, Optional[float]]:
+    """Predicted cost of a job that solves the network for k = 1..k_max: the
+    total CPU time (seconds) of encoding and solving, and the peak memory
+    (bytes) of a run. Both are None if there is no predictor."""
+    if predictor is None:
+        return {'cpu_time': None, 'peak_memory': None}
+    cpu_time, peak_memory = 0.0, 0.0
+    for k in range(1, k_max + 1):
+        prediction = predictor.predict(n_nodes, n_edges, k, encoding='gis')
+        cpu_time += (prediction['encode_time'] or 0.0) + (prediction['solve_time'] or 0.0)
+        peak_memory = max(peak_memory, 1024 * (prediction['peak_memory'] or 0.0))
+    return {'cpu_time': cpu_time, 'peak_memory': peak_memory}
+
+
+def load_predictor(model_file: str) -> Optional[RuntimePredictor]:
+    """The runtime predictor, or None if its models cannot be read, in which
+    case all jobs go to the throttled lane."""
+    try:
+        return RuntimePredictor.load(model_file)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"Error loading the runtime models: {e}")
+        return None
+
+
+class Lane:
+    """A queue of jobs with its own worker threads. Jobs wait in the queue
+    until a worker is free; when max_queued jobs are waiting, new jobs are
+    refused. The processes of the jobs in the lane are limited to
+    memory_limit bytes of address space (None for no limit)."""
+
+    def __init__(self, name: str, n_workers: int, max_queued: int, memory_limit: Optional[int] = None):
+        self.name = name
+        self.memory_limit = memory_limit
+        self._queue = queue.Queue(maxsize=max_queued)
+        for _ in range(n_workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, job, run: Callable, *args) -> bool:
+        """Queue run(job, *args). Returns False if the lane is full."""
+        job.lane = self.name
+        job.memory_limit = self.memory_limit
+        try:
+            self._queue.put_nowait((job, run, args))
+            return True
+        except queue.Full:
+            return False
+
+    def n_queued(self) -> int:
+        return self._queue.qsize()
+
+    def _work(self) -> None:
+        while True:
+            job, run, args = self._queue.get()
+            try:
+                if not job.cancelled:
+                    run(job, *args)
+            except Exception as e:
+                print(f"Error running job {job.job_id} in the {self.name} lane: {e}")
+            finally:
+                if not job.done:
+                    job.finish()
+                self._queue.task_done()
+
+
+class AdmissionControl:
+    """Classifies submissions by their predicted cost. Cheap jobs go to the
+    fast lane, whose workers are reserved for them, so that they do not wait
+    behind large ones; the others go to the throttled lane, which has fewer
+    workers and a memory cap per job. Jobs that are predicted to cost more
+    than the limits are refused."""
+
+    def __init__(self, config):
+        self._predictor = load_predictor(config['RUNTIME_MODEL_FILE'])
+        self._fast_lane_max_cost = config['FAST_LANE_MAX_COST']
+        self._max_job_cost = config['MAX_JOB_COST']
+        self._max_edges = config['MAX_EDGES']
+        self.lanes = {
+            FAST: Lane(FAST, config['FAST_LANE_WORKERS'], config['FAST_LANE_MAX_QUEUED']),
+            THROTTLED: Lane(THROTTLED, config['THROTTLED_LANE_WORKERS'], config['THROTTLED_LANE_MAX_QUEUED'],
+                            memory_limit=config['THROTTLED_LANE_MEMORY_LIMIT']),
+        }
+
+    def classify(self, network_file: str, k_max: int) -> Tuple[str, Dict]:
+        """Choose the lane of a submission. Returns the lane and the cost, or
+        raises AdmissionError (413) if the job is too large."""
+        n_nodes, n_edges = network_size(network_file)
+        cost = expected_cost(self._predictor, n_nodes, n_edges, k_max)
+        cost.update(n_nodes=n_nodes, n_edges=n_edges)
+        if n_edges > self._max_edges:
+            raise AdmissionError(413, f"The network has {n_edges} edges, and at most {self._max_edges} are "
+                                      f"allowed.")
+        if cost['cpu_time'] is not None and cost['cpu_time'] > self._max_job_cost:
+            raise AdmissionError(413, f"Solving this network for k up to {k_max} would take about "
+                                      f"{cost['cpu_time'] / 3600:.1f} CPU hours, and at most "
+                                      f"{self._max_job_cost / 3600:.1f} are allowed. Try a smaller k.")
+        memory_limit = self.lanes[THROTTLED].memory_limit
+        if cost['peak_memory'] is not None and memory_limit is not None and cost['peak_memory'] > memory_limit:
+            raise AdmissionError(413, f"Solving this network would take about {cost['peak_memory'] / 2 ** 30:.1f} "
+                                      f"GB of memory, and a job may use at most {memory_limit / 2 ** 30:.1f} GB.")
+        if cost['cpu_time'] is not None and cost['cpu_time'] <= self._fast_lane_max_cost:
+            return FAST, cost
+        return THROTTLED, cost
+
+    def submit(self, lane: str, job, run: Callable, *args) -> None:
+        """Queue a job in its lane, or raise AdmissionError (429) if the lane
+        is full."""
+        if not self.lanes[lane].submit(job, run, *args):
+            raise AdmissionError(429, f"Too many {'small' if lane == FAST else 'large'} networks are waiting to "
+                                      f"be solved. Please try again later.")
@@ -0,0 +1,53 @@
+import gzip
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+# Fraction of the free space of the tmpfs that a GCNF may take
+MAX_HANDOFF_FRACTION = 0.5
+GCNF_COMPRESSLEVEL = 6
+# Ways to make the copy of a GCNF for download: compressed in the background
+# after gismo has read it, or generated (compressed) when it is downloaded
+BACKGROUND = 'background'
+ON_DEMAND = 'on_demand'
+
+
+def handoff_folder(handoff_dir: Optional[str], gcnf_size: Optional[float]) -> Optional[str]:
+    """A new folder on the tmpfs at handoff_dir, to which the encoder writes
+    the GCNF that gismo reads, such that it does not go through the disk.
+    Returns None (and the GCNF goes to the upload folder) if there is no
+    tmpfs, or if the GCNF, of the estimated size, might not fit on it."""
+    if handoff_dir is None or gcnf_size is None or not os.path.isdir(handoff_dir):
+        return None
+    if gcnf_size > MAX_HANDOFF_FRACTION * shutil.disk_usage(handoff_dir).free:
+        return None
+    return tempfile.mkdtemp(prefix='gismo_', dir=handoff_dir)
+
+
+def compress_gcnf(job, gcnf_path: str, copy_path: str, folder: str) -> None:
+    """Write the compressed copy of a GCNF for download, and offer it as a
+    download file of the job once it is complete. Removes the folder of the
+    GCNF on the tmpfs afterwards."""
+    partial_path = copy_path + '.part'
+    try:
+        os.makedirs(os.path.dirname(copy_path), exist_ok=True)
+        with open(gcnf_path, 'rb') as f_in, \
+                gzip.open(partial_path, 'wb', compresslevel=GCNF_COMPRESSLEVEL) as f_out:
+            shutil.copyfileobj(f_in, f_out, 2 ** 20)
+        os.replace(partial_path, copy_path)
+        job.add_download_file(copy_path)
+    except OSError as e:
+        print(f"Error compressing the GCNF: {e}")
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def start_compressing(job, gcnf_path: str, copy_path: str, folder: str) -> threading.Thread:
+    """Compress the copy of a GCNF in the background (see compress_gcnf)."""
+    thread = threading.Thread(target=compress_gcnf, args=(job, gcnf_path, copy_path, folder), daemon=True)
+    thread.start()
+    return thread
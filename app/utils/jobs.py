@@ -0,0 +1,198 @@
+import threading
+import uuid
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from .launcher import kill_process_group
+
+# Status of a result: the heuristic answer until the exact run has finished
+PROVISIONAL = 'provisional'
+OPTIMAL = 'optimal'
+
+# Status of the exact (gismo) run for a k
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+CANCELLED = 'cancelled'
+FAILED = 'failed'
+TIMED_OUT = 'timed out'
+SKIPPED = 'skipped'
+
+# Number of output lines that a job keeps for its event stream. Older lines
+# are dropped, such that a long run does not fill the memory.
+MAX_EVENTS = 2000
+
+
+class Job:
+    """A submitted network with a result per k. The results start as the
+    heuristic answers and are replaced by the exact ones as the exact runs
+    finish in the background. The running subprocesses are registered on the
+    job, so that cancelling the job can stop them (with their process groups,
+    see launcher.run_process), and their resource usage is recorded as runs.
+    The job runs in a lane (see admission.Lane), which may cap the memory of
+    its subprocesses.
+    The output lines of the subprocesses are kept as numbered events, and
+    every change of the results increases the version of the job, such that
+    an event stream can wait for either."""
+
+    def __init__(self, job_id: str, network_file: str, ks: List[int]):
+        self.job_id = job_id
+        self.network_file = network_file
+        self.cancelled = False
+        self.download_files = []
+        self.gcnf_on_demand = []
+        # Jobs that generate the GCNFs on demand, by k (see routes.generate_gcnf)
+        self.gcnf_jobs = dict()
+        self.lane = None
+        self.memory_limit = None
+        self.cost = None
+        self._results = {k: {'k': k, 'status': PROVISIONAL, 'exact_status': PENDING,
+                             'sensor': None, 'n_sensors': None, 'lower_bound': None, 'gap': None,
+                             'verified': None, 'message': ''}
+                         for k in ks}
+        self.runs = []
+        self._processes = set()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._events = deque(maxlen=MAX_EVENTS)
+        self._n_events = 0
+        self._version = 0
+        self.done = False
+
+    def _notify(self) -> None:
+        # Call with the lock held
+        self._version += 1
+        self._changed.notify_all()
+
+    def update(self, k: int, **fields) -> None:
+        with self._lock:
+            self._results[k].update(fields)
+            self._notify()
+
+    def add_download_file(self, path: str) -> None:
+        with self._lock:
+            self.download_files.append(path)
+            self._notify()
+
+    def offer_gcnf(self, k: int) -> None:
+        """Offer the GCNF for k for download, to be generated when it is
+        downloaded."""
+        with self._lock:
+            self.gcnf_on_demand.append(k)
+            self._notify()
+
+    def claim_gcnf_job(self, k: int, job_id: Optional[str], replaced: Optional[str] = None) -> Optional[str]:
+        """Register job_id as the job that generates the GCNF for k on demand,
+        unless another job than replaced is registered already. Returns the
+        registered job id, such that only one job is started for a GCNF."""
+        with self._lock:
+            if self.gcnf_jobs.get(k) == replaced:
+                self.gcnf_jobs[k] = job_id
+            return self.gcnf_jobs[k]
+
+    def add_event(self, stage: str, k: Optional[int], line: str) -> None:
+        """Record an output line of the subprocess that runs stage for k
+        (None if it is not for a single k)."""
+        with self._lock:
+            self._n_events += 1
+            self._events.append({'id': self._n_events, 'stage': stage, 'k': k, 'line': line})
+            self._changed.notify_all()
+
+    def wait_for_events(self, last_event_id: int, last_version: Optional[int],
+                        timeout: float) -> Tuple[List[Dict], int, bool]:
+        """Wait (at most timeout seconds) until there are events after
+        last_event_id, the version is no longer last_version, or the job is
+        done. Returns the (kept) events after last_event_id, the version, and
+        whether the job is done."""
+        with self._lock:
+            self._changed.wait_for(lambda: self._n_events > last_event_id or self._version != last_version
+                                   or self.done, timeout=timeout)
+            events = [event for event in self._events if event['id'] > last_event_id]
+            return events, self._version, self.done
+
+    def add_process(self, process) -> bool:
+        """Register a running subprocess. Returns False (and kills the
+        process) if the job has been cancelled in the meantime."""
+        with self._lock:
+            if self.cancelled:
+                kill_process_group(process)
+                return False
+            self._processes.add(process)
+            return True
+
+    def remove_process(self, process) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+    def add_run(self, run: Dict) -> None:
+        """Record the resource usage of a finished subprocess."""
+        with self._lock:
+            self.runs.append(run)
+            self._notify()
+
+    def cancel(self) -> None:
+        """Stop the exact runs. The results of the k for which the exact run
+        has not finished keep their heuristic answers."""
+        with self._lock:
+            self.cancelled = True
+            for process in self._processes:
+                kill_process_group(process)
+            self._processes.clear()
+            for result in self._results.values():
+                if result['exact_status'] in (PENDING, RUNNING):
+                    result['exact_status'] = CANCELLED
+            self._notify()
+
+    def finish(self) -> None:
+        with self._lock:
+            self.done = True
+            for result in self._results.values():
+                if result['exact_status'] in (PENDING, RUNNING):
+                    result['exact_status'] = CANCELLED if self.cancelled else FAILED
+            self._notify()
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'done': self.done,
+                'cancelled': self.cancelled,
+                'lane': self.lane,
+                'results': [dict(self._results[k]) for k in sorted(self._results)],
+                'download_files': list(self.download_files),
+                'gcnf_on_demand': list(self.gcnf_on_demand),
+                'gcnf_jobs': dict(self.gcnf_jobs),
+                'runs': [dict(run) for run in self.runs],
+            }
+
+
+class JobRegistry:
+    """Thread-safe registry of the jobs of the web app, by job id."""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, network_file: str, ks: List[int]) -> Job:
+        job = Job(uuid.uuid4().hex, network_file, ks)
+        with self._lock:
+            self._jobs[job.job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def discard(self, job_id: str) -> None:
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+
+registry = JobRegistry()
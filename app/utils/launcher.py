@@ -0,0 +1,146 @@
+import math
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+# Number of lines of the output of a subprocess that are kept for its result
+# and error message (the event stream of the job shows all of them)
+OUTPUT_TAIL_LINES = 200
+# Output lines are cut to this length in the event stream
+MAX_EVENT_LINE_LENGTH = 2000
+# Seconds of CPU time that a process may use after it has reached its CPU
+# limit (and got SIGXCPU), before it is killed
+CPU_LIMIT_GRACE = 5
+
+
+def kill_process_group(process) -> None:
+    """Kill a process started by run_process, and the processes it started."""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def _forward_output(job, pipe, stage, k, tail, keep=None, kept=None):
+    """Read the lines of a pipe of a subprocess as they are written, and
+    record them as events of the job. Keeps the lines for which keep is true
+    in kept, and the last other lines in tail."""
+    for line in pipe:
+        line = line.rstrip('\n')
+        job.add_event(stage, k, line[:MAX_EVENT_LINE_LENGTH])
+        if keep is not None and keep(line):
+            kept.append(line)
+        else:
+            tail.append(line)
+    pipe.close()
+
+
+def run_process(job, command: List[str], timeout: Optional[float] = None, cpu_limit: Optional[float] = None,
+                stage: Optional[str] = None, k: Optional[int] = None,
+                keep: Optional[Callable[[str], bool]] = None) -> Optional[str]:
+    """Run a command as a subprocess of the job, such that cancelling the job
+    stops it. The process runs in a process group of its own, which is
+    killed as a whole when the process exits, times out or is cancelled, such
+    that nothing it started is left behind. It is limited to the memory cap
+    of the lane of the job (RLIMIT_AS) and to cpu_limit seconds of CPU time
+    (RLIMIT_CPU; by default the timeout, such that the process also stops if
+    the app that started it no longer runs), which prlimit sets before the
+    command runs, if it is installed. Its wall-clock and CPU time and
+    its peak memory are recorded as a run of the job.
+    Its output is read as it is written and recorded as events of the job,
+    tagged with the stage and k, for the event stream of the job; only the
+    lines for which keep is true and the last OUTPUT_TAIL_LINES lines are
+    kept in memory.
+    Returns the kept lines of its stdout, or None if the job was cancelled.
+    Raises subprocess.CalledProcessError if it fails, and
+    subprocess.TimeoutExpired if it exceeds the timeout or the CPU limit."""
+    if cpu_limit is None:
+        cpu_limit = timeout
+    limits = []
+    if job.memory_limit is not None:
+        limits.append((resource.RLIMIT_AS, (job.memory_limit, job.memory_limit)))
+    if cpu_limit is not None:
+        soft, hard = math.ceil(cpu_limit), math.ceil(cpu_limit) + CPU_LIMIT_GRACE
+        _, max_hard = resource.getrlimit(resource.RLIMIT_CPU)
+        if max_hard != resource.RLIM_INFINITY:
+            soft, hard = min(soft, max_hard), min(hard, max_hard)
+        limits.append((resource.RLIMIT_CPU, (soft, hard)))
+    # The limits are set by prlimit, which execs the command with them, since
+    # a preexec_fn is not safe in a threaded app. Without prlimit, they are set
+    # right after the process has started.
+    use_prlimit = bool(limits) and shutil.which('prlimit') is not None
+    launched = command
+    if use_prlimit:
+        options = {resource.RLIMIT_AS: '--as', resource.RLIMIT_CPU: '--cpu'}
+        launched = ['prlimit'] + [f"{options[limit]}={soft}:{hard}" for limit, (soft, hard) in limits] + \
+                   ['--'] + command
+
+    started = time.monotonic()
+    # Python scripts would buffer their output when it goes to a pipe
+    process = subprocess.Popen(launched, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, bufsize=1,
+                               errors='replace', env=dict(os.environ, PYTHONUNBUFFERED='1'),
+                               start_new_session=True)
+    if not use_prlimit:
+        for limit, values in limits:
+            try:
+                resource.prlimit(process.pid, limit, values)
+            except ProcessLookupError:
+                pass
+    stdout_kept, stdout_tail = [], deque(maxlen=OUTPUT_TAIL_LINES)
+    stderr_tail = deque(maxlen=OUTPUT_TAIL_LINES)
+    readers = [threading.Thread(target=_forward_output, daemon=True,
+                                args=(job, process.stdout, stage, k, stdout_tail, keep, stdout_kept)),
+               threading.Thread(target=_forward_output, daemon=True,
+                                args=(job, process.stderr, stage, k, stderr_tail))]
+    for reader in readers:
+        reader.start()
+
+    # Wait for the process to exit without reaping it, such that its process
+    # group can still be killed until it is no longer registered with the job
+    exited = threading.Event()
+
+    def wait_for_exit():
+        os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOWAIT)
+        exited.set()
+
+    threading.Thread(target=wait_for_exit, daemon=True).start()
+    exceeded_limit = None
+    if job.add_process(process):
+        if not exited.wait(timeout):
+            exceeded_limit = timeout
+            kill_process_group(process)
+            exited.wait()
+    else:
+        exited.wait()
+    kill_process_group(process)
+    job.remove_process(process)
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    for reader in readers:
+        reader.join()
+
+    # ru_maxrss is in kilobytes
+    run = {'stage': stage, 'k': k, 'exit_code': process.returncode, 'wall_time': time.monotonic() - started,
+           'user_time': usage.ru_utime, 'system_time': usage.ru_stime, 'max_rss': usage.ru_maxrss * 1024}
+    job.add_run(run)
+    print(f"Run of {stage} for k={k}: exit code {run['exit_code']}, {run['wall_time']:.2f} s wall-clock, "
+          f"{run['user_time']:.2f} s user, {run['system_time']:.2f} s system, {usage.ru_maxrss / 1024:.1f} MB")
+    # (the kernel counts the CPU time a little differently from the rusage)
+    if cpu_limit is not None and (process.returncode == -signal.SIGXCPU
+                                  or usage.ru_utime + usage.ru_stime >= cpu_limit):
+        exceeded_limit = cpu_limit
+    if exceeded_limit is not None and not job.cancelled:
+        raise subprocess.TimeoutExpired(command, exceeded_limit)
+    if job.cancelled:
+        return None
+    stdout = '\n'.join(stdout_kept + list(stdout_tail))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command, output=stdout,
+                                            stderr='\n'.join(stderr_tail))
+    return stdout
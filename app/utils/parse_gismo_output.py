@@ -1,4 +1,12 @@
-from typing import List, Dict
+import gzip
+import json
+import os
+from typing import Dict, List, Optional
+
+# Suffix of the group-map sidecar that the encoder writes next to a GCNF (see
+# GISEncoding._write_group_map)
+GROUP_MAP_SUFFIX = '.map.json'
+
 
 def parse_gismo_ind_from_text(text: str) -> List[int]:
     for line in text.splitlines():
@@ -16,27 +24,112 @@ def parse_gismo_ind_from_text(text: str) -> List[int]:
             return out
     raise RuntimeError("No 'c ind' line found in GiSMo output.")
 
+
+class GroupMap:
+    """Decodes the independent support that gismo finds for a GCNF into the
+    original labels of the sensor nodes. The groups are the nodes of the
+    preprocessed graph: node i has fire variable i and detector variable
+    n + i (see GISEncoding.encode), and labels[i - 1] is its original label.
+    In the one-step setting, twins were removed, and twins[label] are the
+    nodes that the node with that label replaced. The labels are strings,
+    whether they come from the sidecar (where the labels of a .mtx file are
+    ints) or from the header of the GCNF."""
+
+    def __init__(self, n_nodes: int, two_step: bool, labels: List, twins: Optional[Dict[str, List]] = None,
+                 var_2_group: Optional[Dict[int, int]] = None):
+        self.n_nodes = n_nodes
+        self.two_step = two_step
+        self.labels = labels
+        self.twins = twins or dict()
+        # The groups as listed in the GCNF, if it was read
+        self._var_2_group = var_2_group
+
+    @classmethod
+    def load(cls, gcnf_path: str) -> 'GroupMap':
+        """The group map of a GCNF, from its sidecar if it has one, or else
+        from the header of the GCNF."""
+        if os.path.isfile(gcnf_path + GROUP_MAP_SUFFIX):
+            return cls.from_sidecar(gcnf_path + GROUP_MAP_SUFFIX)
+        return cls.from_gcnf(gcnf_path)
+
+    @classmethod
+    def from_sidecar(cls, map_path: str) -> 'GroupMap':
+        with open(map_path, 'r', encoding='utf-8') as f:
+            group_map = json.load(f)
+        twins = {str(label): [str(twin) for twin in twins]
+                 for label, twins in (group_map.get('twins') or dict()).items()}
+        return cls(group_map['n_nodes'], group_map['two_step'], [str(label) for label in group_map['labels']],
+                   twins)
+
+    @classmethod
+    def from_gcnf(cls, gcnf_path: str) -> 'GroupMap':
+        """Read the group map from the comments of a GCNF (possibly gzipped):
+        the 'c grp' lines, and the variable and twin maps of the header. Stops
+        at the first clause, so the clauses are never read. The labels are
+        strings, as in the header."""
+        n_nodes, two_step = None, True
+        labels, twins, var_2_group = dict(), dict(), dict()
+        group_id = 0
+        section = None
+        opener = gzip.open if gcnf_path.endswith('.gz') else open
+        with opener(gcnf_path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                if not line.startswith('c'):
+                    if line.startswith('p'):
+                        section = None
+                        continue
+                    break
+                toks = line.split()[1:]
+                if line.startswith('c grp '):
+                    group_id += 1
+                    for t in toks[1:]:
+                        if t != '0':
+                            var_2_group[int(t)] = group_id
+                elif line.startswith('c Number of nodes (after preprocess):'):
+                    n_nodes = int(toks[-1])
+                elif line.startswith('c Approach:'):
+                    two_step = toks[-1] == 'two-step'
+                elif line.strip() in ('c VARIABLE MAP', 'c TWIN MAP'):
+                    section = line.strip()[2:]
+                elif section == 'VARIABLE MAP' and len(toks) == 2 and toks[0].isdigit():
+                    labels[int(toks[0])] = toks[1]
+                elif section == 'TWIN MAP' and len(toks) == 2:
+                    twins.setdefault(toks[1], []).append(toks[0])
+        if n_nodes is None:
+            n_nodes = len(labels)
+        return cls(n_nodes, two_step, [labels.get(node, str(node)) for node in range(1, n_nodes + 1)], twins,
+                   var_2_group or None)
+
+    def node(self, var: int) -> int:
+        """The node (group id) of a variable of the independent support."""
+        if self._var_2_group is not None:
+            return self._var_2_group[var]
+        if not 1 <= var <= 2 * self.n_nodes:
+            raise KeyError(var)
+        # In the one-step setting, the support is drawn from the detector variables
+        return var if var <= self.n_nodes else var - self.n_nodes
+
+    def decode(self, ind_vars: List[int], expand_twins: bool = False) -> List:
+        """The original labels of the sensors of an independent support, by
+        node. With expand_twins, each sensor is a list of its label and the
+        labels of the twins it replaced."""
+        nodes = sorted({self.node(var) for var in ind_vars})
+        if expand_twins:
+            return [[self.labels[node - 1]] + self.twins.get(self.labels[node - 1], []) for node in nodes]
+        return [self.labels[node - 1] for node in nodes]
+
+
 def parse_groups_from_gcnf(gcnf_path: str) -> Dict[int, int]:
-    var2grp = {}
-    group_id = 0
-    with open(gcnf_path, "r", encoding="utf-8") as f:
-        for line in f:
-            if line.startswith("c grp "):
-                group_id += 1
-                toks = line.split()[2:]
-                for t in toks:
-                    try:
-                        v = int(t)
-                        if v != 0:
-                            var2grp[v] = group_id
-                    except:
-                        pass
+    """The group id of each variable in the 'c grp' lines of a GCNF, which
+    are read up to the first clause."""
+    var2grp = GroupMap.from_gcnf(gcnf_path)._var_2_group
     if not var2grp:
         raise RuntimeError("No 'c grp' lines found. Encode with two_step=True.")
     return var2grp
 
-def parse_sensor_set_from_gismo_output(gismo_text: str, gcnf_path: str) -> List[int]:
+
+def parse_sensor_set_from_gismo_output(gismo_text: str, gcnf_path: str) -> List:
+    """The original labels of the sensors that gismo found for a GCNF (see
+    GroupMap)."""
     ind_vars = parse_gismo_ind_from_text(gismo_text)
-    var2grp = parse_groups_from_gcnf(gcnf_path)
-    sensor_S = sorted({ var2grp[v] for v in ind_vars })
-    return sensor_S
+    return GroupMap.load(gcnf_path).decode(ind_vars)
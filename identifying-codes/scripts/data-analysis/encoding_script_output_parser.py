@@ -55,6 +55,9 @@ class EncodingScriptOutputParser:
             't_process_encoding': re.compile(r'\d{4}-\d{2}-\d{2}, \d{2}h\d{2}m\d{2}s: Encoding took (?P<t_process_encoding>\d+\.\d+) CPU seconds for k = \d+\.', re.DOTALL),
             't_limit': re.compile(r'c Time limit:\s+(?P<t_limit>\d+) s', re.DOTALL),
             'm_limit': re.compile(r'c Memory limit:\s+(?P<m_limit>\d+)', re.DOTALL),
+            'lower_bound': re.compile(r'\d{4}-\d{2}-\d{2}, \d{2}h\d{2}m\d{2}s: Lower bound: (?P<lower_bound>\d+) for k = \d+\.', re.DOTALL),
+            'optimality_gap': re.compile(r'\d{4}-\d{2}-\d{2}, \d{2}h\d{2}m\d{2}s: Optimality gap: (?P<optimality_gap>-?\d+\.\d+) for k = \d+\.', re.DOTALL),
+            'verified': re.compile(r'\d{4}-\d{2}-\d{2}, \d{2}h\d{2}m\d{2}s: Verified: (?P<verified>(yes|no)) for k = \d+\.', re.DOTALL),
         }
 
         self._data.update({field: None for field in self._pat_encoding.keys()})
@@ -63,9 +66,10 @@ class EncodingScriptOutputParser:
         self._detection_pat = re.compile(r' d(?P<idx>\d+):\s*- x\d+ .+', re.DOTALL)
         self._uniqueness_pat = re.compile(r' u(?P<idx>\d+):\s*x\d+ .+', re.DOTALL)
 
-        self._ints = ['t_limit', 'm_limit']
+        self._ints = ['t_limit', 'm_limit', 'lower_bound']
         self._floats = ['t_wallclock_building', 't_process_building',
-                        't_wallclock_encoding', 't_process_encoding']
+                        't_wallclock_encoding', 't_process_encoding', 'optimality_gap']
+        self._bools = ['verified']
 
     def get_encoding_script_output_data(self):
         return self._data
@@ -76,6 +80,8 @@ class EncodingScriptOutputParser:
                 self._data[field] = int(self._data[field])
             elif field in self._floats and self._data[field] is not None:
                 self._data[field] = float(self._data[field])
+            elif field in self._bools and self._data[field] is not None:
+                self._data[field] = self._data[field] in (True, 'yes')
 
     def _parse_line(self, line, patterns):
         for field, pat in patterns.items():
@@ -32,11 +32,17 @@ import json
 import lzma
 import os
 import re
+import sys
 from cnf_parser import CNFparser
 from ilp_parser import ILPparser
 from cplex_output_parser import CPLEXOutputParser
 from encoding_script_output_parser import EncodingScriptOutputParser
 
+PROJECT_DIR = os.getenv('PROJECT_DIR')
+
+sys.path.insert(1, '{PROJECT_DIR}/scripts/encoding'.format(PROJECT_DIR=PROJECT_DIR))
+from verifier import CodeVerifier
+
 class OutputParser:
 
     def __init__(self, output_file, timeout_file):
@@ -118,6 +124,37 @@ class OutputParser:
                 for line in infile.readlines():
                     self._parse_line(line, [('timeout_info', self._pat_timeout)])
 
+    def verify_solution(self, network_file, two_step=True):
+        """
+        Check that the parsed solution is a k-identifying code of the network
+        (after preprocessing, as in the encoding), and add the result to the
+        solution info.
+        :param network_file:    Network file from which the encoding was
+                                generated.
+        :param two_step:        True if the encoding was two-step.
+        :return: None
+        """
+        solution_info = self._data['solution_info']
+        solution_info['verified'] = None
+        if solution_info.get('solution') is None or solution_info.get('k') is None:
+            return
+        verifier = CodeVerifier()
+        verifier.build_from_file(network_file, two_step=two_step)
+        sensors = self._solution_nodes(verifier._G.number_of_nodes())
+        if sensors is None:
+            return
+        verification = verifier.verify(sensors, int(solution_info['k']))
+        solution_info['verified'] = verification['valid']
+        solution_info['verification'] = verification
+
+    def _solution_nodes(self, n_nodes):
+        """
+        :param n_nodes: Number of nodes of the preprocessed graph.
+        :return:        List of the sensor nodes (1..n_nodes) in the parsed
+                        solution, or None if the solver output does not tell.
+        """
+        return None
+
     def save_results(self, results_file):
         json_str = json.dumps(self._data, indent=4) + "\n"
         json_bytes = json_str.encode('utf-8')
@@ -334,6 +371,10 @@ class ILPOutputParser(OutputParser):
         self._convert_data_types()
         print(self._data)
 
+    def _solution_nodes(self, n_nodes):
+        # The x variables of the LP file are the nodes
+        return [int(var[1:]) for var in self._data['solution_info']['solution']]
+
 
 class ISOutputParser(OutputParser):
 
@@ -382,5 +423,11 @@ class ISOutputParser(OutputParser):
                         if m is not None:
                             self._data['solution_info']['optimised_value'] = m.group('opt_val')
 
+    def _solution_nodes(self, n_nodes):
+        # The independent support consists of variables of the groups
+        # (v, n + v) of the GCNF encoding, one group per node v
+        return sorted({var - n_nodes if var > n_nodes else var
+                       for var in map(int, self._data['solution_info']['solution'].split())})
+
 
 
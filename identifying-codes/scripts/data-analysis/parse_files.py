@@ -51,6 +51,13 @@ optional_args.add_argument("--enctype", type=str, required=False,
 optional_args.add_argument("--skip_parsed_files", required=False,
                            action="store_true",
                            help="Skip files if they have already been parsed.")
+optional_args.add_argument("--verify", required=False,
+                           action="store_true",
+                           help="For exptype ilp or gis only: check that the solutions are k-identifying codes of "
+                                "their networks.")
+optional_args.add_argument("--one_step", required=False,
+                           action="store_true",
+                           help="With --verify: the encodings are one-step (default: two-step).")
 
 args = parser.parse_args()
 
@@ -68,6 +75,17 @@ def makedir(thedir):
 
 missing_timeout_files = set()
 
+
+def network_file_of(networktype, basefile):
+    """
+    The network file from which an encoding was generated, assuming that the
+    encoding is named after it.
+    """
+    for extension in ['.gz', '.lp', '.mps', '.gcnf', '.wcnf', '.cnf']:
+        basefile = basefile.removesuffix(extension)
+    return f'{DATA_DIR}/instances/networks/{networktype}/{basefile}'
+
+
 if args.exptype == 'encoding':
     if args.enctype == 'gis':
         if os.path.isdir(f'{RESULTS_DIR}/{args.enctype}'):
@@ -191,6 +209,9 @@ elif args.exptype in ['ilp', 'gis']:
                                 continue
                             output_parser = ILPOutputParser(f'{subdir}/{out_file}',
                                                             f'{subdir}/{timeout_file}')
+                            if args.verify:
+                                output_parser.verify_solution(network_file_of(networktype, basefile),
+                                                              two_step=not args.one_step)
                             output_parser.save_results(json_file)
                         elif args.exptype == 'gis':
                             json_file = f'{json_subdir}/{basefile}.json.gz'
@@ -198,6 +219,9 @@ elif args.exptype in ['ilp', 'gis']:
                                 continue
                             output_parser = ISOutputParser(f'{subdir}/{out_file}',
                                                            f'{subdir}/{timeout_file}')
+                            if args.verify:
+                                output_parser.verify_solution(network_file_of(networktype, basefile),
+                                                              two_step=not args.one_step)
                             output_parser.save_results(json_file)
 
 print(missing_timeout_files)
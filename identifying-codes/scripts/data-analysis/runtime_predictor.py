@@ -0,0 +1,285 @@
+# encoding: utf-8
+"""
+@file: runtime_predictor.py
+@desc: Predicts the encoding time, solving time and peak memory of a run on a
+       network, from the numbers of nodes and edges and k, with models that
+       are trained on the experimental data that DataAggregator collects.
+"""
+
+import argparse
+import json
+import numpy as np
+try:
+    import pandas as pd
+except ImportError:
+    # Only needed for reading the data (main), such that the models can be
+    # used where pandas is not installed
+    pd = None
+
+# Quantities that are predicted: the column with the measurement in the
+# (merged) data of DataAggregator, and the columns that flag runs that did not
+# finish. The measurements of those runs are not used for training, since they
+# are only lower bounds. Times are CPU seconds, memory is the maximum resident
+# set size in kB, as in the data.
+TARGETS = {
+    'encode_time': ('utime_enc', ['encoding_t/o', 'encoding_m/o']),
+    'solve_time': ('utime_solve', ['solving_t/o', 'solving_m/o', 'other_error']),
+    'encode_memory': ('max_res_set_size_enc', ['encoding_t/o', 'encoding_m/o']),
+    'solve_memory': ('max_res_set_size_solve', ['solving_t/o', 'solving_m/o', 'other_error']),
+}
+
+# Measurements are rounded up to this value before taking logarithms (the
+# resolution of the times in the data)
+MIN_VALUE = 0.01
+
+# Minimum number of runs needed to train a model for a quantity
+MIN_SAMPLES = 10
+
+
+def model_key(encoding, configuration=None):
+    """
+    :param encoding:        'gis' or 'ilp'.
+    :param configuration:   For ILP only: the ILP configuration (e.g.
+                            'config1'), since the configurations give models of
+                            very different sizes.
+    :return:                Key of the model of the encoding.
+    """
+    return encoding if configuration is None else '{e}-{c}'.format(e=encoding, c=configuration)
+
+
+def fill_network_sizes(data, network_stats):
+    """
+    Fill in the numbers of nodes and edges of the runs in which the encoder
+    did not get as far as reporting them, from the network statistics.
+    :param data:            DataFrame of DataAggregator.
+    :param network_stats:   DataFrame with columns 'network', 'n_nodes' and
+                            'n_edges' (see collect_network_stats.py).
+    :return:                DataFrame with the sizes filled in.
+    """
+    sizes = network_stats.set_index('network')[['n_nodes', 'n_edges']]
+    data = data.copy()
+    for column in ['n_nodes', 'n_edges']:
+        data[column] = data[column].fillna(data['benchmark'].map(sizes[column]))
+    return data
+
+
+class RuntimePredictor:
+    """
+    Log-linear models of the time and memory use of the encoder and the solver
+    (see TARGETS), one per encoding. A quantity y is modelled as
+        log(y - baseline) = b_0 + b_1 log(n) + b_2 log(m) + b_3 log(k),
+    with n and m the numbers of nodes and edges of the network, where the
+    baseline (90% of the smallest value in the data) is the cost of starting
+    the process. The coefficients are fitted by least squares. The models
+    only need the size of the network, so they can be used before the network
+    is even encoded, and they are stored as JSON, such that schedulers and the
+    web app can use them without pandas.
+    """
+
+    def __init__(self, models=None):
+        """
+        :param models:  Dictionary of models, by model key and quantity, as
+                        returned by fit or loaded from a file.
+        """
+        self._models = dict() if models is None else models
+
+    @staticmethod
+    def _features(n_nodes, n_edges, k):
+        n_nodes, n_edges, k = [np.atleast_1d(np.asarray(values, dtype=float)) for values in (n_nodes, n_edges, k)]
+        return np.column_stack([np.ones(len(k)), np.log(np.maximum(n_nodes, 1)), np.log(np.maximum(n_edges, 1)),
+                                np.log(k)])
+
+    @staticmethod
+    def _training_data(data, target):
+        """
+        :return:    (rows of data with a measurement of target from a run that
+                    finished, measurements, number of runs that did not finish)
+        """
+        column, failure_columns = TARGETS[target]
+        if column not in data.columns:
+            return data.iloc[:0], np.zeros(0), 0
+        failed = np.zeros(len(data), dtype=bool)
+        for failure_column in failure_columns:
+            if failure_column in data.columns:
+                failed |= data[failure_column].fillna(False).astype(bool).values
+        usable = ~failed & data[[column, 'n_nodes', 'n_edges', 'k']].notna().all(axis=1).values
+        return data[usable], data[column].values[usable].astype(float), int(failed.sum())
+
+    @classmethod
+    def _fit_target(cls, rows, values):
+        baseline = 0.9 * float(values.min())
+        X = cls._features(rows['n_nodes'].values, rows['n_edges'].values, rows['k'].values)
+        y = np.log(np.maximum(values - baseline, MIN_VALUE))
+        coefficients = np.linalg.lstsq(X, y, rcond=None)[0]
+        return {
+            'coefficients': coefficients.tolist(),
+            'baseline': baseline,
+            'n_samples': len(values),
+            'residual_std': float(np.std(y - X @ coefficients)),
+        }
+
+    @classmethod
+    def _evaluate_target(cls, model, rows, values):
+        X = cls._features(rows['n_nodes'].values, rows['n_edges'].values, rows['k'].values)
+        predictions = np.exp(X @ np.array(model['coefficients'])) + model['baseline']
+        return np.abs(np.log(np.maximum(predictions, MIN_VALUE)) - np.log(np.maximum(values, MIN_VALUE)))
+
+    def fit(self, data, encoding, configuration=None):
+        """
+        Train the models of an encoding.
+        :param data:            DataFrame of DataAggregator with the merged
+                                encoding and solving results of the encoding
+                                (as in the IC22-IC25 analyses), with columns
+                                'benchmark', 'k', 'n_nodes' and 'n_edges'.
+        :param encoding:        See model_key.
+        :param configuration:   See model_key. If not None, only the rows of
+                                this ILP configuration are used.
+        :return:                self
+        """
+        if configuration is not None:
+            data = data[data['ilp_configuration'] == configuration]
+        models = dict()
+        for target in TARGETS:
+            rows, values, _ = self._training_data(data, target)
+            if len(values) >= MIN_SAMPLES:
+                models[target] = self._fit_target(rows, values)
+        self._models[model_key(encoding, configuration)] = models
+        return self
+
+    def cross_validate(self, data, encoding, configuration=None, n_folds=5, seed=0):
+        """
+        Report the accuracy of the models of an encoding on held-out networks:
+        the networks are split into n_folds groups, and the runs on each group
+        are predicted by models trained on the runs on the other networks.
+        This does not change the models of the predictor.
+        :param data:            See fit.
+        :param encoding:        See model_key.
+        :param configuration:   See model_key.
+        :param n_folds:         Number of groups of networks.
+        :param seed:            Seed for splitting the networks into groups.
+        :return:    Dictionary with, per quantity, the number of runs used, the
+                    number of runs that did not finish, the median factor
+                    between prediction and measurement, and the fractions of
+                    the predictions within a factor 2 and 10.
+        """
+        if configuration is not None:
+            data = data[data['ilp_configuration'] == configuration]
+        rng = np.random.default_rng(seed)
+        networks = np.array(sorted(data['benchmark'].unique()))
+        rng.shuffle(networks)
+        folds = np.array_split(networks, min(n_folds, len(networks)))
+        report = dict()
+        for target in TARGETS:
+            rows, values, n_failed = self._training_data(data, target)
+            errors = []
+            for fold in folds:
+                held_out = rows['benchmark'].isin(fold).values
+                if held_out.all() or not held_out.any() or (~held_out).sum() < MIN_SAMPLES:
+                    continue
+                model = self._fit_target(rows[~held_out], values[~held_out])
+                errors.append(self._evaluate_target(model, rows[held_out], values[held_out]))
+            errors = np.concatenate(errors) if errors else np.zeros(0)
+            report[target] = {
+                'n_samples': len(values),
+                'n_failed_runs': n_failed,
+                'median_factor': float(np.exp(np.median(errors))) if len(errors) > 0 else None,
+                'within_factor_2': float(np.mean(errors < np.log(2))) if len(errors) > 0 else None,
+                'within_factor_10': float(np.mean(errors < np.log(10))) if len(errors) > 0 else None,
+            }
+        return report
+
+    def predict(self, n_nodes, n_edges, k, encoding='gis', configuration=None):
+        """
+        Predict the cost of a run.
+        :param n_nodes:         Number of nodes of the network.
+        :param n_edges:         Number of edges of the network.
+        :param k:               Maximum identifiable set size.
+        :param encoding:        See model_key.
+        :param configuration:   See model_key.
+        :return:    Dictionary with the predicted encoding and solving times
+                    (CPU seconds), the memory of the encoder and the solver and
+                    the peak memory of the run (kB). A quantity for which there
+                    is no model is None. Solving times are those of runs that
+                    finished, so they are optimistic for hard instances.
+        """
+        key = model_key(encoding, configuration)
+        assert key in self._models, "No model for encoding {key}".format(key=key)
+        X = self._features(n_nodes, n_edges, k)
+        prediction = dict()
+        for target in TARGETS:
+            model = self._models[key].get(target)
+            if model is None:
+                prediction[target] = None
+            else:
+                prediction[target] = float(np.exp(X @ np.array(model['coefficients']))[0] + model['baseline'])
+        memories = [prediction[target] for target in ['encode_memory', 'solve_memory']
+                    if prediction[target] is not None]
+        prediction['peak_memory'] = max(memories) if memories else None
+        return prediction
+
+    def save(self, model_file, report=None):
+        """
+        :param model_file:  JSON file to write the models to.
+        :param report:      Optional accuracy report (see cross_validate), by
+                            model key, to store with the models.
+        :return:            None
+        """
+        with open(model_file, 'w') as mfile:
+            mfile.write(json.dumps({'models': self._models, 'accuracy': report or dict()}, indent=4) + "\n")
+
+    @classmethod
+    def load(cls, model_file):
+        """
+        :param model_file:  JSON file written by save.
+        :return:            RuntimePredictor with the models in the file.
+        """
+        with open(model_file, 'r') as mfile:
+            return cls(json.load(mfile)['models'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    required_args = parser.add_argument_group("Required arguments")
+    required_args.add_argument("--out_file", type=str, required=True,
+                               help="JSON file to write the models and their accuracy to.")
+    optional_args = parser.add_argument_group("Optional arguments")
+    optional_args.add_argument("--gis_data", type=str, required=False, default=None,
+                               help="CSV file with the merged GIS encoding and solving data of DataAggregator.")
+    optional_args.add_argument("--ilp_data", type=str, required=False, default=None,
+                               help="CSV file with the merged ILP encoding and solving data of DataAggregator. "
+                                    "A model is trained per ILP configuration.")
+    optional_args.add_argument("--network_stats", type=str, required=False, default=None,
+                               help="CSV file with the numbers of nodes and edges of the networks, to fill in the "
+                                    "sizes of runs that did not report them.")
+    optional_args.add_argument("--n_folds", type=int, required=False, default=5,
+                               help="Number of groups of networks for reporting the accuracy on held-out networks.")
+    args = parser.parse_args()
+
+    network_stats = None if args.network_stats is None else pd.read_csv(args.network_stats)
+    predictor = RuntimePredictor()
+    report = dict()
+    for encoding, data_file in [('gis', args.gis_data), ('ilp', args.ilp_data)]:
+        if data_file is None:
+            continue
+        data = pd.read_csv(data_file)
+        if network_stats is not None:
+            data = fill_network_sizes(data, network_stats)
+        configurations = sorted(data['ilp_configuration'].dropna().unique()) if encoding == 'ilp' else [None]
+        for configuration in configurations:
+            key = model_key(encoding, configuration)
+            predictor.fit(data, encoding, configuration)
+            report[key] = predictor.cross_validate(data, encoding, configuration, n_folds=args.n_folds)
+            for target, accuracy in report[key].items():
+                if accuracy['median_factor'] is None:
+                    print("{key:>12} {t:<14} not enough runs ({n})".format(key=key, t=target, n=accuracy['n_samples']))
+                else:
+                    print("{key:>12} {t:<14} runs: {n:>4}, median factor: {f:.2f}, within 2x: {w2:.0%}, "
+                          "within 10x: {w10:.0%}".format(key=key, t=target, n=accuracy['n_samples'],
+                                                         f=accuracy['median_factor'],
+                                                         w2=accuracy['within_factor_2'],
+                                                         w10=accuracy['within_factor_10']))
+    predictor.save(args.out_file, report)
+
+
+if __name__ == '__main__':
+    main()
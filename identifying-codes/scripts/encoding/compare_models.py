@@ -0,0 +1,369 @@
+# encoding: utf-8
+"""
+@file: compare_models.py
+@desc: Parse two ILP model files (LP or MPS, optionally gzipped), e.g. the
+       one written by lp_writer and the one written by CPLEX for the same
+       encoding, and report how they differ.
+"""
+
+import argparse
+import gzip
+import math
+import re
+import sys
+
+# Maximum number of differences that are reported
+MAX_REPORTED_DIFFERENCES = 20
+
+# Relative tolerance when comparing coefficients, right-hand sides and bounds
+TOLERANCE = 1e-9
+
+_LP_SECTIONS = {
+    'minimize': 'objective', 'minimum': 'objective', 'min': 'objective',
+    'subject to': 'constraints', 'such that': 'constraints', 'st': 'constraints', 's.t.': 'constraints',
+    'bounds': 'bounds', 'bound': 'bounds',
+    'binaries': 'binaries', 'binary': 'binaries', 'bin': 'binaries',
+    'generals': 'generals', 'general': 'generals', 'gen': 'generals',
+    'semi-continuous': 'semi-continuous', 'semis': 'semi-continuous', 'semi': 'semi-continuous',
+    'end': 'end',
+}
+_LP_SENSES = {'>=': 'G', '=>': 'G', '>': 'G', '<=': 'L', '=<': 'L', '<': 'L', '=': 'E'}
+_LP_TOKEN = re.compile(r'(?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)|(?P<sense>[<>=]+)|(?P<sign>[+-])|'
+                       r'(?P<name>[^\s+\-<>=:]+)(?P<colon>:)?')
+
+
+class Model:
+    """
+    A parsed model, in a form in which two files of the same model compare
+    equal, whatever wrote them: the objective and the rows map variable
+    names to their nonzero coefficients, and each variable has a type
+    (integer or continuous) and bounds. Binary variables are integer
+    variables with bounds [0, 1].
+    """
+
+    def __init__(self):
+        self.objective = dict()
+        # Row name -> (coefficients, sense, rhs)
+        self.rows = dict()
+        self.integers = set()
+        self.lbs = dict()
+        self.ubs = dict()
+        self.binaries = set()
+
+    def variables(self):
+        names = set(self.objective) | self.integers | set(self.lbs) | set(self.ubs)
+        for coeffs, _, _ in self.rows.values():
+            names.update(coeffs)
+        return names
+
+    def bounds(self, name):
+        lb, ub = self.lbs.get(name, 0.0), self.ubs.get(name, math.inf)
+        if name in self.binaries:
+            return max(lb, 0.0), min(ub, 1.0)
+        return lb, ub
+
+
+def _open(model_file):
+    if model_file.endswith('.gz'):
+        return gzip.open(model_file, 'rt')
+    return open(model_file, 'r')
+
+
+def _add_term(coeffs, name, coeff):
+    coeff = coeffs.get(name, 0.0) + coeff
+    if coeff == 0:
+        coeffs.pop(name, None)
+    else:
+        coeffs[name] = coeff
+
+
+def _parse_expression(tokens):
+    """
+    Parse the terms of a linear expression, up to the end of the tokens or a
+    sense. Returns (coefficients, index of the first token after the terms).
+    """
+    coeffs = dict()
+    sign, coeff = 1.0, None
+    idx = 0
+    while idx < len(tokens):
+        kind, value = tokens[idx]
+        if kind == 'sense':
+            break
+        if kind == 'sign':
+            sign = -sign if value == '-' else sign
+        elif kind == 'number':
+            coeff = float(value)
+        else:
+            _add_term(coeffs, value, sign * (1.0 if coeff is None else coeff))
+            sign, coeff = 1.0, None
+        idx += 1
+    return coeffs, idx
+
+
+def _tokenize(text):
+    """
+    Split the text of LP expressions into (kind, value) tokens, where kind is
+    'number', 'sense', 'sign', 'name' or 'label' (a name followed by a colon).
+    """
+    tokens = []
+    for match in _LP_TOKEN.finditer(text):
+        if match.group('colon'):
+            tokens.append(('label', match.group('name')))
+        else:
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+    return tokens
+
+
+def _parse_lp_constraints(model, tokens):
+    idx = 0
+    n_unnamed = 0
+    while idx < len(tokens):
+        name = None
+        if tokens[idx][0] == 'label':
+            name = tokens[idx][1]
+            idx += 1
+        coeffs, length = _parse_expression(tokens[idx:])
+        idx += length
+        assert idx < len(tokens) and tokens[idx][0] == 'sense', "Constraint {name} has no sense.".format(name=name)
+        sense = _LP_SENSES[tokens[idx][1]]
+        idx += 1
+        sign = 1.0
+        if tokens[idx][0] == 'sign':
+            sign = -1.0 if tokens[idx][1] == '-' else 1.0
+            idx += 1
+        rhs = sign * float(tokens[idx][1])
+        idx += 1
+        if name is None:
+            name = 'R' + str(n_unnamed)
+            n_unnamed += 1
+        model.rows[name] = (coeffs, sense, rhs)
+
+
+def _parse_lp_bound(model, line):
+    """
+    Parse a line of the Bounds section: 'x free', or the variable with a
+    bound on either side ('lb <= x <= ub', 'x >= lb', 'x = v', ...).
+    """
+    tokens = line.split()
+    if len(tokens) == 2 and tokens[1].lower() == 'free':
+        model.lbs[tokens[0]], model.ubs[tokens[0]] = -math.inf, math.inf
+        return
+    if len(tokens) not in (3, 5):
+        raise ValueError("Cannot parse bound: {line}".format(line=line))
+    # The position of the variable
+    position = 2 if _is_number(tokens[0]) else 0
+    name = tokens[position]
+    for value_idx, sense_idx, before in [(position - 2, position - 1, True), (position + 2, position + 1, False)]:
+        if value_idx < 0 or value_idx >= len(tokens):
+            continue
+        value = float(tokens[value_idx])
+        sense = _LP_SENSES[tokens[sense_idx]]
+        if sense == 'E':
+            model.lbs[name] = model.ubs[name] = value
+        elif (sense == 'L') == before:
+            # 'lb <= x' or 'x >= lb'
+            model.lbs[name] = value
+        else:
+            model.ubs[name] = value
+
+
+def _is_number(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def read_lp(model_file):
+    """
+    Parse a model in the CPLEX LP format (minimisation, linear rows, bounds,
+    binaries and generals).
+    :param model_file:  Path to the .lp or .lp.gz file.
+    :return:            Model
+    """
+    model = Model()
+    section = None
+    section_lines = {'objective': [], 'constraints': []}
+    with _open(model_file) as mfile:
+        for line in mfile:
+            line = line.split('\\', 1)[0].strip()
+            if not line:
+                continue
+            if line.lower() in _LP_SECTIONS:
+                section = _LP_SECTIONS[line.lower()]
+                continue
+            if section in section_lines:
+                section_lines[section].append(line)
+            elif section == 'bounds':
+                _parse_lp_bound(model, line)
+            elif section == 'semi-continuous':
+                raise ValueError("Semi-continuous variables are not supported.")
+            elif section in ('binaries', 'generals'):
+                model.integers.update(line.split())
+                if section == 'binaries':
+                    model.binaries.update(line.split())
+            else:
+                raise ValueError("Unsupported line in {f}: {line}".format(f=model_file, line=line))
+    tokens = _tokenize(' '.join(section_lines['objective']))
+    if tokens and tokens[0][0] == 'label':
+        tokens = tokens[1:]
+    model.objective, _ = _parse_expression(tokens)
+    _parse_lp_constraints(model, _tokenize(' '.join(section_lines['constraints'])))
+    return model
+
+
+def read_mps(model_file):
+    """
+    Parse a model in the (fixed or free) MPS format, without RANGES and with
+    names without spaces.
+    :param model_file:  Path to the .mps or .mps.gz file.
+    :return:            Model
+    """
+    model = Model()
+    section = None
+    objective_row = None
+    senses = dict()
+    integer = False
+    with _open(model_file) as mfile:
+        for line in mfile:
+            if not line.strip() or line.startswith('*'):
+                continue
+            fields = line.split()
+            if not line[0].isspace():
+                section = fields[0].upper()
+                if section == 'RANGES':
+                    raise ValueError("RANGES are not supported.")
+                continue
+            if section == 'ROWS':
+                sense, name = fields[0].upper(), fields[1]
+                if sense == 'N':
+                    if objective_row is None:
+                        objective_row = name
+                    continue
+                senses[name] = sense
+                model.rows[name] = (dict(), sense, 0.0)
+            elif section == 'COLUMNS':
+                if len(fields) >= 3 and fields[1].strip("'").upper() == 'MARKER':
+                    integer = fields[2].strip("'").upper() == 'INTORG'
+                    continue
+                name = fields[0]
+                if integer:
+                    model.integers.add(name)
+                for row, value in zip(fields[1::2], fields[2::2]):
+                    if row == objective_row:
+                        _add_term(model.objective, name, float(value))
+                    elif row in model.rows:
+                        _add_term(model.rows[row][0], name, float(value))
+                model.lbs.setdefault(name, 0.0)
+            elif section == 'RHS':
+                # The name of the right-hand side vector is optional
+                pairs = fields[1:] if len(fields) % 2 == 1 else fields
+                for row, value in zip(pairs[0::2], pairs[1::2]):
+                    if row in model.rows:
+                        coeffs, sense, _ = model.rows[row]
+                        model.rows[row] = (coeffs, sense, float(value))
+            elif section == 'BOUNDS':
+                bound_type = fields[0].upper()
+                has_value = bound_type in ('UP', 'LO', 'FX', 'LI', 'UI') or (bound_type == 'BV' and len(fields) == 4)
+                # The name of the bound vector is optional
+                name = fields[-2] if has_value else fields[-1]
+                value = float(fields[-1]) if has_value else None
+                if bound_type in ('UP', 'UI'):
+                    model.ubs[name] = value
+                elif bound_type in ('LO', 'LI'):
+                    model.lbs[name] = value
+                elif bound_type == 'FX':
+                    model.lbs[name] = model.ubs[name] = value
+                elif bound_type == 'FR':
+                    model.lbs[name], model.ubs[name] = -math.inf, math.inf
+                elif bound_type == 'MI':
+                    model.lbs[name] = -math.inf
+                elif bound_type == 'PL':
+                    model.ubs[name] = math.inf
+                elif bound_type == 'BV':
+                    model.integers.add(name)
+                    model.binaries.add(name)
+                if bound_type in ('LI', 'UI'):
+                    model.integers.add(name)
+    return model
+
+
+def read_model(model_file):
+    """
+    Parse a model file, in the format given by its extension (.lp, .mps,
+    .lp.gz or .mps.gz).
+    :param model_file:  Path to the model file.
+    :return:            Model
+    """
+    base_file = model_file[:-3] if model_file.endswith('.gz') else model_file
+    if base_file.endswith('.mps'):
+        return read_mps(model_file)
+    if base_file.endswith('.lp'):
+        return read_lp(model_file)
+    raise ValueError("Unknown model file format: {f}".format(f=model_file))
+
+
+def _close(a, b):
+    return a == b or abs(a - b) <= TOLERANCE * max(abs(a), abs(b))
+
+
+def _coefficient_differences(a, b):
+    return sorted(name for name in set(a) | set(b) if not _close(a.get(name, 0.0), b.get(name, 0.0)))
+
+
+def compare_models(model_a, model_b):
+    """
+    Compare two parsed models.
+    :param model_a: Model
+    :param model_b: Model
+    :return:        List of descriptions of the differences (empty if the
+                    models are the same).
+    """
+    differences = []
+    names = _coefficient_differences(model_a.objective, model_b.objective)
+    if names:
+        differences.append("Objective coefficients differ for {names}".format(names=names[:10]))
+    for row in sorted(set(model_a.rows) | set(model_b.rows)):
+        if row not in model_a.rows or row not in model_b.rows:
+            differences.append("Row {row} is only in the {which} model".format(
+                row=row, which='first' if row in model_a.rows else 'second'))
+            continue
+        coeffs_a, sense_a, rhs_a = model_a.rows[row]
+        coeffs_b, sense_b, rhs_b = model_b.rows[row]
+        names = _coefficient_differences(coeffs_a, coeffs_b)
+        if names or sense_a != sense_b or not _close(rhs_a, rhs_b):
+            differences.append("Row {row} differs: {a} {sa} {ra} vs. {b} {sb} {rb}".format(
+                row=row, a=sorted(coeffs_a.items()), sa=sense_a, ra=rhs_a,
+                b=sorted(coeffs_b.items()), sb=sense_b, rb=rhs_b))
+    for name in sorted(model_a.variables() | model_b.variables()):
+        integer_a, integer_b = name in model_a.integers, name in model_b.integers
+        bounds_a, bounds_b = model_a.bounds(name), model_b.bounds(name)
+        if integer_a != integer_b or not all(_close(a, b) for a, b in zip(bounds_a, bounds_b)):
+            differences.append("Variable {name} differs: {ta} {ba} vs. {tb} {bb}".format(
+                name=name, ta='integer' if integer_a else 'continuous', ba=bounds_a,
+                tb='integer' if integer_b else 'continuous', bb=bounds_b))
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    required_args = parser.add_argument_group("Required arguments")
+    required_args.add_argument("model_files", type=str, nargs=2,
+                               help="Paths to the two model files (.lp or .mps, optionally .gz).")
+    args = parser.parse_args()
+
+    models = [read_model(model_file) for model_file in args.model_files]
+    differences = compare_models(*models)
+    for difference in differences[:MAX_REPORTED_DIFFERENCES]:
+        print(difference)
+    if len(differences) > MAX_REPORTED_DIFFERENCES:
+        print("... and {n} more differences".format(n=len(differences) - MAX_REPORTED_DIFFERENCES))
+    if differences:
+        sys.exit(1)
+    print("The models are the same: {n_rows} rows, {n_vars} variables.".format(
+        n_rows=len(models[0].rows), n_vars=len(models[0].variables())))
+
+
+if __name__ == '__main__':
+    main()
@@ -30,12 +30,18 @@ THE SOFTWARE.
 
 import argparse
 from datetime import datetime
+import gzip
+import json
 import os
 import pathlib
 import signal
 import sys
 from ilp_encoding import ILPEncoding
 from gis_encoding import GISEncoding
+from heuristic_solver import HeuristicSolver
+from identifying_codes import CARDINALITY_ENCODINGS, DEFAULT_CARDINALITY_ENCODING, IdentifyingCodesInstance
+from lower_bounds import LowerBounds, optimality_gap
+from verifier import CodeVerifier
 
 PROJECT_DIR = os.getenv('PROJECT_DIR')
 
@@ -52,12 +58,15 @@ required_args.add_argument("--out_dir", type=str, required=True,
 required_args.add_argument("--out_file", type=str, required=True,
                            help="Basename of output file.")
 required_args.add_argument("--encoding", type=str, required=True,
-                           choices=['maxsat', 'gis', 'ilp', 'sat', 'pb'],
-                           help='Specify the encoding')
+                           choices=['maxsat', 'gis', 'ilp', 'sat', 'pb', 'heuristic', 'estimate'],
+                           help='Specify the encoding. With heuristic, no encoding is written: an identifying code '
+                                'is found greedily and improved by local search, and written (as JSON) to the '
+                                'output file.')
 optional_args.add_argument("-b", type=int, required=False, default=-1,
                            help="Budget (number of smoke detectors / injected colors).")
-optional_args.add_argument("-k", type=int, default=1,
-                           help="Max number of simultaneous events.")
+optional_args.add_argument("-k", type=int, nargs='+', default=[1],
+                           help="Max number of simultaneous events. For the ILP encoding, multiple values "
+                                "are encoded in increasing order, reusing the uniqueness constraints.")
 optional_args.add_argument("--two_step", required=False,
                            default=False, action="store_true",
                            help="Request two_step approach.")
@@ -67,6 +76,66 @@ optional_args.add_argument("--remove_supersets", required=False,
 optional_args.add_argument("--check_2_neighbourhood", required=False,
                            default=False, action="store_true",
                            help="For ILP encoding only: avoid adding unnecessary constraints.")
+optional_args.add_argument("--n_workers", type=int, required=False, default=1,
+                           help="For ILP encoding only: number of processes that generate uniqueness constraints.")
+optional_args.add_argument("--checkpoint_interval", type=int, required=False, default=0,
+                           help="For ILP encoding only: minimum number of seconds between checkpoints, which are "
+                                "written next to the model file (default 0: no checkpoints).")
+optional_args.add_argument("--resume", required=False,
+                           default=False, action="store_true",
+                           help="For ILP encoding only: resume from the last checkpoint, if there is one.")
+optional_args.add_argument("--ilp_writer", type=str, required=False, default='native',
+                           choices=['native', 'cplex'],
+                           help="For ILP encoding only: stream the model to the (.lp/.mps, optionally .gz) file "
+                                "directly, or build a CPLEX model and let CPLEX write it.")
+optional_args.add_argument("--presolve", required=False,
+                           default=False, action="store_true",
+                           help="For ILP encoding only: fix forced sensors and remove redundant constraints "
+                                "before writing (or solving) the model.")
+optional_args.add_argument("--solve", required=False,
+                           default=False, action="store_true",
+                           help="For ILP encoding only: solve the encoding with HiGHS and write the solution "
+                                "(as JSON) to the output file, instead of writing the model.")
+optional_args.add_argument("--lazy", required=False,
+                           default=False, action="store_true",
+                           help="For two-step ILP encoding with --solve only: add the uniqueness constraints "
+                                "lazily, as they are violated.")
+optional_args.add_argument("--time_limit", type=float, required=False, default=None,
+                           help="For ILP encoding with --solve only: time limit (in seconds) for HiGHS. For the "
+                                "heuristic: time limit (in seconds) for the local search.")
+optional_args.add_argument("--ilp_config", type=str, required=False, default='manual',
+                           choices=['manual', 'auto'],
+                           help="For two-step ILP encoding only: take --remove_supersets and "
+                                "--check_2_neighbourhood as given (manual), or choose them per k from an estimate "
+                                "of the size and cost of the uniqueness constraints (auto).")
+optional_args.add_argument("--memory_limit", type=float, required=False, default=None,
+                           help="For --ilp_config auto only: available memory in GB (default: physical memory).")
+optional_args.add_argument("--warm_start", required=False,
+                           default=False, action="store_true",
+                           help="For ILP encoding only: carry solutions and bounds along the sweep over k. The "
+                                "optimum for a smaller k bounds the objective, and a solution for another k "
+                                "(repaired if needed) is used as starting solution, written to a .mst file next "
+                                "to the model.")
+optional_args.add_argument("--constraint_store", type=str, required=False, default=None,
+                           help="For ILP encoding only: file in which the uniqueness constraints are kept, "
+                                "such that a later run with a larger k only generates the new ones.")
+optional_args.add_argument("--lower_bound", required=False,
+                           default=False, action="store_true",
+                           help="Compute a lower bound on the number of sensors for each k, from counting, "
+                                "degree and LP-relaxation arguments. For ILP encoding with --solve and for the "
+                                "heuristic, the bounds and the optimality gap of the solution are added to the "
+                                "JSON output.")
+optional_args.add_argument("--verify", required=False,
+                           default=False, action="store_true",
+                           help="For ILP encoding with --solve and for the heuristic only: check that the solution "
+                                "is a k-identifying code, and add the result to the JSON output.")
+optional_args.add_argument("--timeout", type=int, required=False, default=None,
+                           help="Time limit (in seconds) for each k. A k for which building the encoding (or "
+                                "solving it) takes longer fails, without output, and the next k is processed.")
+optional_args.add_argument("--cardinality_encoding", type=str, required=False,
+                           default=DEFAULT_CARDINALITY_ENCODING, choices=CARDINALITY_ENCODINGS,
+                           help="For the size estimate only: CNF encoding of the cardinality constraint for which "
+                                "the number of auxiliary variables and clauses of the GIS encoding is estimated.")
 
 args = parser.parse_args()
 
@@ -74,12 +143,26 @@ encoding_settings = dict()
 if args.encoding == 'ilp':
     encoding_settings['remove_supersets'] = args.remove_supersets
     encoding_settings['check_2_neighbourhood'] = args.check_2_neighbourhood
+    encoding_settings['n_workers'] = args.n_workers
+    encoding_settings['checkpoint_interval'] = args.checkpoint_interval
+    encoding_settings['resume'] = args.resume
+    encoding_settings['constraint_store'] = args.constraint_store
+    encoding_settings['ilp_writer'] = args.ilp_writer
+    encoding_settings['presolve'] = args.presolve
+    encoding_settings['warm_start'] = args.warm_start
 
 def handler(signum, frame):
     print("Timed out!")
     raise Exception("Timed out!")
 
 
+# Fail the current k when it exceeds the time limit, or when the process
+# exceeds its CPU time limit (RLIMIT_CPU, as set by the web app)
+signal.signal(signal.SIGALRM, handler)
+if hasattr(signal, 'SIGXCPU'):
+    signal.signal(signal.SIGXCPU, handler)
+
+
 def log_message(message):
     print('{date}: {message}'.format(
         date=datetime.now().strftime("%Y-%m-%d, %Hh%Mm%Ss"), message=message))
@@ -94,6 +177,10 @@ if args.encoding == 'gis':
     ic_instance = GISEncoding()
 elif args.encoding == 'ilp':
     ic_instance = ILPEncoding()
+elif args.encoding == 'heuristic':
+    ic_instance = HeuristicSolver()
+elif args.encoding == 'estimate':
+    ic_instance = IdentifyingCodesInstance()
 
 log_message("Building {encoding} instance.".format(encoding=args.encoding))
 build_successful = True
@@ -122,24 +209,90 @@ sys.stdout.flush()
 
 if build_successful:
     log_message("Encoding {encoding} instance.".format(encoding=args.encoding))
-    k = args.k
-    log_message("Encoding k = {k}".format(k=k))
-    t_wallclock = WallclockTimer(text="Encoding took {0:.4f} wallclock seconds for k = " + str(k) + ".")
-    t_process = ProcessTimer(text="Encoding took {0:.4f} CPU seconds for k = " + str(k) + ".")
-    out_dir = '{out_dir}/k{k}/'.format(out_dir=args.out_dir, k=k)
-    pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
-    try:
-        t_wallclock.start()
-        t_process.start()
-        ic_instance.encode(out_dir + args.out_file, k, **encoding_settings)
-        log_message(t_wallclock.stop())
-        log_message(t_process.stop())
-        log_message("Encoding completed!")
-    except Exception as exc:
-        log_message("Encoding FAILED!")
-        log_message(exc)
-        log_message(t_wallclock.stop())
-        log_message(t_process.stop())
+    for k in sorted(args.k):
+        log_message("Encoding k = {k}".format(k=k))
+        t_wallclock = WallclockTimer(text="Encoding took {0:.4f} wallclock seconds for k = " + str(k) + ".")
+        t_process = ProcessTimer(text="Encoding took {0:.4f} CPU seconds for k = " + str(k) + ".")
+        out_dir = '{out_dir}/k{k}/'.format(out_dir=args.out_dir, k=k)
+        pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
+        bound_info = None
+        if args.lower_bound:
+            # The one-step ILP encoding only distinguishes single nodes, so
+            # its optimum is bounded by the bounds for k = 1
+            bound_k = 1 if args.encoding == 'ilp' and not args.two_step else k
+            try:
+                bound_info = LowerBounds.from_instance(ic_instance).compute(bound_k)
+                log_message("Lower bound: {lb} for k = {k}.".format(lb=bound_info['lower_bound'], k=k))
+            except Exception as exc:
+                log_message("Lower bound FAILED!")
+                log_message(exc)
+        try:
+            if args.timeout is not None:
+                signal.alarm(args.timeout)
+            t_wallclock.start()
+            t_process.start()
+            if args.encoding == 'ilp' and args.ilp_config == 'auto' and args.two_step:
+                memory_limit = None if args.memory_limit is None else args.memory_limit * 2 ** 30
+                remove_supersets, check_2_neighbourhood = ic_instance.choose_ilp_configuration(
+                    k, memory_limit=memory_limit)
+                encoding_settings['remove_supersets'] = remove_supersets
+                encoding_settings['check_2_neighbourhood'] = check_2_neighbourhood
+            results = None
+            if args.solve and args.encoding == 'ilp':
+                solve_settings = {setting: encoding_settings[setting]
+                                  for setting in ['remove_supersets', 'check_2_neighbourhood', 'n_workers',
+                                                  'presolve', 'warm_start']}
+                if args.lazy:
+                    results = ic_instance.solve_lazy(k, time_limit=args.time_limit,
+                                                     warm_start=args.warm_start)
+                else:
+                    results = ic_instance.solve(k, time_limit=args.time_limit, **solve_settings)
+            elif args.encoding == 'heuristic':
+                results = ic_instance.solve(k, time_limit=args.time_limit)
+            elif args.encoding == 'estimate':
+                results = {'size_estimate': ic_instance.estimate_encoding_sizes(
+                    k, cardinality_encoding=args.cardinality_encoding)}
+            else:
+                ic_instance.encode(out_dir + args.out_file, k, **encoding_settings)
+            if results is not None:
+                if 'solution_info' in results:
+                    log_message("Solution: {solution}".format(solution=results['solution_info']['solution']))
+                if bound_info is not None and 'solution_info' in results:
+                    results['bound_info'] = dict(bound_info)
+                    results['bound_info']['gap'] = optimality_gap(bound_info['lower_bound'],
+                                                                  results['solution_info']['optimised_value'])
+                    if results['bound_info']['gap'] is not None:
+                        log_message("Optimality gap: {gap:.4f} for k = {k}.".format(
+                            gap=results['bound_info']['gap'], k=k))
+                if args.verify and 'solution_info' in results and results['solution_info']['solution'] is not None:
+                    try:
+                        verifier = CodeVerifier.from_instance(ic_instance)
+                        sensors = verifier.nodes_from_labels(results['solution_info']['solution'])
+                        results['verification'] = verifier.verify(sensors, k)
+                        log_message("Verified: {valid} for k = {k}.".format(
+                            valid='yes' if results['verification']['valid'] else 'no', k=k))
+                    except Exception as exc:
+                        log_message("Verification FAILED!")
+                        log_message(exc)
+                json_str = json.dumps(results, indent=4) + "\n"
+                if args.out_file.endswith('.gz'):
+                    with gzip.open(out_dir + args.out_file, 'wt', encoding='utf-8') as rfile:
+                        rfile.write(json_str)
+                else:
+                    with open(out_dir + args.out_file, 'w') as rfile:
+                        rfile.write(json_str)
+            signal.alarm(0)
+            log_message(t_wallclock.stop())
+            log_message(t_process.stop())
+            log_message("Encoding completed!")
+        except Exception as exc:
+            signal.alarm(0)
+            log_message("Encoding FAILED!")
+            log_message(exc)
+            log_message(t_wallclock.stop())
+            log_message(t_process.stop())
+            # Do not leave a partial output file behind
+            pathlib.Path(out_dir + args.out_file).unlink(missing_ok=True)
 else:
     log_message("Building failed. Aborting rest of the process")
 
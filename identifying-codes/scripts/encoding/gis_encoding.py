@@ -30,9 +30,14 @@ THE SOFTWARE.
 
 from identifying_codes import IdentifyingCodesInstance, cardinality_constraint
 import gzip
+import json
 import networkx as nx
 import os
 
+# Suffix of the group-map sidecar that is written next to each GCNF (see
+# _write_group_map)
+GROUP_MAP_SUFFIX = '.map.json'
+
 class GISEncoding(IdentifyingCodesInstance):
 
     def __init__(self, two_step=False):
@@ -104,6 +109,7 @@ class GISEncoding(IdentifyingCodesInstance):
             dimacs_file,
             clauses=cardinality_clauses + self._detection_clauses,
             ind=ind, defined=defined, groups=groups, header=header)
+        self._write_group_map(dimacs_file + GROUP_MAP_SUFFIX)
 
     def _detection_constraints(self):
         """
@@ -139,7 +145,8 @@ class GISEncoding(IdentifyingCodesInstance):
                         ind=None, defined=None, groups=None):
         """
         Write CNF for independent support encoding to DIMACS format.
-        :param dimacs_file: .cnf file to write the CNF formula to
+        :param dimacs_file: .cnf file to write the CNF formula to (compressed
+                            with gzip if its name ends with .gz)
         :param header:      header with basic info about the file
         :param clauses:     list of strings, each string a clause
         :param ind:         list of variables from which to draw independent support
@@ -164,9 +171,30 @@ class GISEncoding(IdentifyingCodesInstance):
         for group in groups:
             dimacs.append('c grp ' + ' '.join([str(var) for var in group]) + ' 0\n')
         dimacs.extend(['{cls} 0\n'.format(cls=cls) for cls in clauses])
-        with open(dimacs_file, 'w') as d_file:
-        # with gzip.open(dimacs_file, 'wb') as d_file:
+        if dimacs_file.endswith('.gz'):
+            d_file = gzip.open(dimacs_file, 'wt', encoding='utf-8')
+        else:
+            d_file = open(dimacs_file, 'w')
+        with d_file:
             print("Writing dimacs to", dimacs_file)
             d_file.write(''.join(dimacs))
 
-
+    def _write_group_map(self, map_file):
+        """
+        Write the sidecar with which the independent support that gismo finds
+        is decoded into sensors, without reading the GCNF: the groups are
+        (fire_vars[i], detector_vars[i]), so the variables of node i are i and
+        n + i, and the nodes map to their original labels (and the twins they
+        replaced) as in the variable and twin maps of the header.
+        :param map_file:    .json file to write the group map to
+        :return:            None
+        """
+        group_map = {
+            'two_step': self._two_step,
+            'n_nodes': len(self._fire_vars),
+            'labels': [self._node_2_label[node] for node in self._fire_vars],
+            'twins': {str(node): sorted(str(twin) for twin in twins if twin != node)
+                      for node, twins in self._twins.items()},
+        }
+        with open(map_file, 'w') as m_file:
+            json.dump(group_map, m_file, default=str)
@@ -0,0 +1,652 @@
+# encoding: utf-8
+"""
+@file: heuristic_solver.py
+@desc: Greedy and local-search heuristic that quickly finds a (not necessarily
+       minimal) identifying code, for use on its own, as a fallback when an
+       exact solver runs out of time, or as an upper bound.
+"""
+
+import heapq
+from identifying_codes import IdentifyingCodesInstance, log_message, nodes_2_bitset, bitset_2_nodes
+import networkx as nx
+import numpy as np
+import random
+from scipy.sparse import identity
+import time
+
+# Number of bits of the random keys from which the signatures are hashed
+# during local search
+SIGNATURE_BITS = 64
+
+# Relative tolerance of the lazy greedy: a sensor is placed if its gain is at
+# least (1 - GREEDY_TOLERANCE) times the (stale) gain at the top of the heap.
+# While many nodes are undetected, each sensor lowers the gains of all other
+# sensors a little, so exact lazy evaluation would re-evaluate nearly all of
+# them in each step.
+GREEDY_TOLERANCE = 0.1
+
+# Maximum number of violated sets that a repair round (k > 1) collects. The
+# sets that are left are found again in the next round, if the sensors that
+# were added do not resolve them.
+MAX_REPAIR_SETS = 100000
+
+# Number of sets between two checks of the deadline while the sets of at most
+# k nodes are enumerated (k > 1)
+DEADLINE_CHECK_INTERVAL = 1024
+
+
+class HeuristicSolver(IdentifyingCodesInstance):
+    """
+    Finds a small identifying code in three phases:
+    1. Greedy: repeatedly place the sensor that distinguishes the most pairs
+       of sets that are not distinguished yet (counting the empty set, such
+       that each node is also detected). This is greedy set cover over the
+       distinguishing sets of the pairs, but the pairs are never enumerated:
+       the sets are kept in classes of equal signatures, and a sensor
+       distinguishes the pairs of which it splits the class. Since the gain of
+       a sensor can only decrease, the gains are evaluated lazily from a heap
+       (see GREEDY_TOLERANCE).
+    2. Pruning: remove the sensors that are not needed.
+    3. Swaps: replace two nearby sensors by one, as long as possible.
+    The greedy phase distinguishes the single nodes. For k = 1, the pruning
+    and swaps keep hashed signatures of the nodes, such that each move is
+    checked in time linear in the degrees of the sensors involved. For k > 1,
+    the solution is repaired, pruned and swapped with exact (bitset)
+    signatures of the sets of at most k nodes. As in CodeVerifier, only the
+    sets that are connected in H^2 need to be checked, where H links the
+    nodes that share a sensor in their signatures.
+    """
+
+    def __init__(self):
+        IdentifyingCodesInstance.__init__(self)
+        self._neighbours = None
+        # For each node, the nodes in the part of the signature that it
+        # shares as a sensor: its closed (one-step) or open (two-step)
+        # 1-neighbourhood
+        self._parts = None
+        self._rng = None
+
+        # Local search state (k = 1): hashed signature and number of
+        # sensors in the closed 1-neighbourhood of each node
+        self._placed = None
+        self._keys = None
+        self._signatures = None
+        self._signature_nodes = None
+        self._cover = None
+        self._n_conflicts = 0
+        self._n_uncovered = 0
+
+        # Exact signatures (k > 1)
+        self._neighbourhood_bitsets = None
+
+    def solve(self, k, time_limit=None, seed=0):
+        """
+        Find an identifying code for k.
+        :param k:           Maximum identifiable set size.
+        :param time_limit:  Number of seconds after which the swaps (and for
+                            k > 1, the pruning) stop, or None to run them until
+                            no move improves the solution. The greedy phase and
+                            the pruning (k = 1) always complete, since they take
+                            time linear in the size of the graph. The repair
+                            (k > 1) is needed for a valid solution, so if it
+                            does not complete in time, solve raises a
+                            TimeoutError.
+        :param seed:        Seed for the random keys of the signatures.
+        :return:    Dictionary with 'heuristic_info' and 'solution_info'
+                    groups, laid out like the results of ILPEncoding.solve.
+                    The solution is the list of sensor nodes, by their
+                    original labels.
+        """
+        log_message("{classname}: Start heuristic search".format(classname=self.__class__.__name__))
+        start_time = time.perf_counter()
+        deadline = None if time_limit is None else start_time + time_limit
+        self._k = k
+        self._rng = random.Random(seed)
+        n_nodes = self._G.number_of_nodes()
+        self._neighbours = [[]] + [list(self._G.neighbors(node)) for node in range(1, n_nodes + 1)]
+        if self._two_step:
+            self._parts = self._neighbours
+        else:
+            self._parts = [[node] + neighbours for node, neighbours in enumerate(self._neighbours)]
+
+        sensors = self._greedy()
+        n_greedy = len(sensors)
+        log_message("{classname}: Greedy placed {n} sensors.".format(
+            classname=self.__class__.__name__, n=n_greedy))
+        n_repaired = n_swaps = 0
+        if k == 1:
+            self._init_signatures(sensors)
+            # The sensors are pruned in the order in which they were placed,
+            # since the early (high-gain) sensors are the most likely to have
+            # become redundant. In practice, the order makes little difference.
+            n_pruned = self._prune(sensors)
+            n_swaps = self._swap(deadline)
+            if n_swaps > 0:
+                n_pruned += self._prune(self._sensors())
+            sensors = self._sensors()
+        else:
+            self._build_neighbourhood_bitsets()
+            sensors = self._repair(nodes_2_bitset(sensors), k, deadline)
+            n_repaired = bin(sensors).count('1') - n_greedy
+            sensors, n_pruned = self._prune_exact(sensors, k, deadline)
+            sensors, n_swaps = self._swap_exact(sensors, k, deadline)
+            if n_swaps > 0:
+                sensors, n_swaps_pruned = self._prune_exact(sensors, k, deadline)
+                n_pruned += n_swaps_pruned
+            sensors = bitset_2_nodes(sensors)
+        solution_time = time.perf_counter() - start_time
+        log_message("{classname}: Found an identifying code with {n} sensors in {t:.2f} seconds.".format(
+            classname=self.__class__.__name__, n=len(sensors), t=solution_time))
+
+        return {
+            'heuristic_info': {
+                'solution_time': solution_time,
+                'n_greedy': n_greedy,
+                'n_repaired': n_repaired,
+                'n_pruned': n_pruned,
+                'n_swaps': n_swaps,
+                'time_limit': time_limit,
+            },
+            'solution_info': {
+                'optimised_value': float(len(sensors)),
+                'k': k,
+                'solution': [self._node_2_label[node] for node in sorted(sensors)],
+            },
+        }
+
+    def _coordinates(self, sensor):
+        """
+        The nodes whose (single-node) signature contains the sensor, each with
+        the part of the signature that it is in. In the one-step setting, the
+        signature of a node is the set of sensors in its closed
+        1-neighbourhood. In the two-step setting, it is (the node, if it is a
+        sensor; the sensors in its open 1-neighbourhood).
+        :param sensor:  Node.
+        :return:        Generator of (node, part) pairs, with part 0 or 1.
+        """
+        if self._two_step:
+            yield sensor, 0
+            for node in self._neighbours[sensor]:
+                yield node, 1
+        else:
+            yield sensor, 0
+            for node in self._neighbours[sensor]:
+                yield node, 0
+
+    def _split_gain(self, sensor, classes, class_sizes):
+        """
+        :return:    The number of pairs of items in the same class that the
+                    sensor distinguishes, i.e., that it puts in different
+                    parts of the signature (see _coordinates).
+        """
+        counts = dict()
+        for node in self._parts[sensor]:
+            cls = classes[node]
+            counts[cls] = counts.get(cls, 0) + 1
+        gain = 0
+        for cls, count in counts.items():
+            gain += count * (class_sizes[cls] - count)
+        if self._two_step:
+            # The sensor itself is in a part of its own, so it is also
+            # distinguished from the items in its class that are not in its
+            # neighbourhood.
+            own_class = classes[sensor]
+            gain += class_sizes[own_class] - 1 - counts.get(own_class, 0)
+        return gain
+
+    def _split(self, sensor, classes, class_sizes):
+        """
+        Place the sensor: move the items of each class that are in a part of
+        the sensor's signature to a new class.
+        :return:    None
+        """
+        counts = dict()
+        for node, part in self._coordinates(sensor):
+            cls = classes[node]
+            count = counts.get((cls, part))
+            counts[cls, part] = 1 if count is None else count + 1
+        new_classes = dict()
+        for (cls, part), part_size in counts.items():
+            if part_size < class_sizes[cls]:
+                new_classes[cls, part] = len(class_sizes)
+                class_sizes.append(part_size)
+                class_sizes[cls] -= part_size
+        for node, part in self._coordinates(sensor):
+            new_class = new_classes.get((classes[node], part))
+            if new_class is not None:
+                classes[node] = new_class
+
+    def _greedy(self):
+        """
+        Greedily place sensors until all nodes have distinct, non-empty
+        signatures (see the class docstring).
+        :return:    List of sensor nodes, in the order in which they were
+                    placed.
+        """
+        n_nodes = self._G.number_of_nodes()
+        # Item 0 is the empty set, which has the empty signature. Items 1, ...,
+        # n_nodes are the nodes.
+        classes = [0] * (n_nodes + 1)
+        class_sizes = [n_nodes + 1]
+        n_pairs = n_nodes * (n_nodes + 1) // 2
+        # The heap holds -gain * base + node, which orders the nodes by
+        # decreasing gain and then by increasing label, and is cheaper to
+        # compare than tuples.
+        base = n_nodes + 1
+        heap = [-self._split_gain(node, classes, class_sizes) * base + node for node in range(1, n_nodes + 1)]
+        heapq.heapify(heap)
+        sensors = []
+        while n_pairs > 0 and heap:
+            node = heapq.heappop(heap) % base
+            gain = self._split_gain(node, classes, class_sizes)
+            if gain == 0:
+                continue
+            if heap and gain < (1 - GREEDY_TOLERANCE) * (-heap[0] // base):
+                heapq.heappush(heap, -gain * base + node)
+                continue
+            sensors.append(node)
+            n_pairs -= gain
+            self._split(node, classes, class_sizes)
+        if n_pairs > 0:
+            raise ValueError("The graph has no identifying code, since some nodes are twins.")
+        return sensors
+
+    def _init_signatures(self, sensors):
+        """
+        Initialise the local search state for the given sensors. Each sensor
+        has a random key per part of the signature, and the hashed signature
+        of a node is the XOR of the keys of the sensors in its signature.
+        Nodes with equal signatures have equal hashes, so a placement in which
+        all hashes are distinct is valid. A hash collision can only make the
+        search reject a valid placement.
+        :param sensors: List of sensor nodes.
+        :return:        None
+        """
+        n_nodes = self._G.number_of_nodes()
+        self._placed = [False] * (n_nodes + 1)
+        self._keys = [(self._rng.getrandbits(SIGNATURE_BITS), self._rng.getrandbits(SIGNATURE_BITS))
+                      for _ in range(n_nodes + 1)]
+        self._signatures = [0] * (n_nodes + 1)
+        self._signature_nodes = {0: set(range(1, n_nodes + 1))}
+        self._cover = [0] * (n_nodes + 1)
+        self._n_conflicts = n_nodes - 1
+        self._n_uncovered = n_nodes
+        for sensor in sensors:
+            self._toggle(sensor)
+
+    def _sensors(self):
+        return [node for node in range(1, self._G.number_of_nodes() + 1) if self._placed[node]]
+
+    def _is_valid(self):
+        return self._n_conflicts == 0 and self._n_uncovered == 0
+
+    def _move_signature(self, node, signature):
+        nodes = self._signature_nodes[self._signatures[node]]
+        nodes.discard(node)
+        if nodes:
+            self._n_conflicts -= 1
+        else:
+            del self._signature_nodes[self._signatures[node]]
+        nodes = self._signature_nodes.get(signature)
+        if nodes is None:
+            self._signature_nodes[signature] = {node}
+        else:
+            nodes.add(node)
+            self._n_conflicts += 1
+        self._signatures[node] = signature
+
+    def _toggle(self, sensor):
+        """
+        Place the sensor if it is not placed, remove it otherwise.
+        :return:    None
+        """
+        self._placed[sensor] = not self._placed[sensor]
+        keys = self._keys[sensor]
+        for node, part in self._coordinates(sensor):
+            self._move_signature(node, self._signatures[node] ^ keys[part])
+        if self._placed[sensor]:
+            for node in [sensor] + self._neighbours[sensor]:
+                self._cover[node] += 1
+                if self._cover[node] == 1:
+                    self._n_uncovered -= 1
+        else:
+            for node in [sensor] + self._neighbours[sensor]:
+                self._cover[node] -= 1
+                if self._cover[node] == 0:
+                    self._n_uncovered += 1
+
+    def _prune(self, sensors):
+        """
+        Remove each sensor (in the given order) that the placement does not
+        need.
+        :return:    Number of removed sensors.
+        """
+        n_pruned = 0
+        for sensor in sensors:
+            self._toggle(sensor)
+            if self._is_valid():
+                n_pruned += 1
+            else:
+                self._toggle(sensor)
+        return n_pruned
+
+    def _repair_candidates(self, nodes):
+        """
+        Find a violation among the given nodes (whose signatures changed), and
+        the nodes that could resolve it: the closed 1-neighbourhood of an
+        undetected node, or the closed 1-neighbourhoods of a group of nodes
+        with equal signatures.
+        :return:    List of candidate sensor nodes (empty if there is no
+                    violation among the nodes).
+        """
+        for node in nodes:
+            if self._cover[node] == 0:
+                return [node] + self._neighbours[node]
+        for node in nodes:
+            group = self._signature_nodes[self._signatures[node]]
+            if len(group) > 1:
+                return list({candidate for member in group
+                             for candidate in [member] + self._neighbours[member]})
+        return []
+
+    def _swap(self, deadline):
+        """
+        Replace two sensors (at distance at most 2 from each other) by one
+        other sensor, until no such swap is possible. After removing two
+        sensors, the new sensor must resolve the first violation that it
+        caused, so it is only searched among the candidates for that
+        violation (see _repair_candidates).
+        :return:    Number of swaps.
+        """
+        n_swaps = 0
+        improved = True
+        while improved:
+            improved = False
+            for first in self._sensors():
+                if not self._placed[first]:
+                    continue
+                nearby = {node for neighbour in self._neighbours[first]
+                          for node in [neighbour] + self._neighbours[neighbour]}
+                for second in sorted(nearby):
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return n_swaps
+                    if second == first or not self._placed[second]:
+                        continue
+                    self._toggle(first)
+                    self._toggle(second)
+                    changed = [first, second] + self._neighbours[first] + self._neighbours[second]
+                    replacement = None
+                    for candidate in self._repair_candidates(changed):
+                        if self._placed[candidate] or candidate in (first, second):
+                            continue
+                        self._toggle(candidate)
+                        if self._is_valid():
+                            replacement = candidate
+                            break
+                        self._toggle(candidate)
+                    if replacement is None and not self._is_valid():
+                        self._toggle(second)
+                        self._toggle(first)
+                        continue
+                    n_swaps += 1
+                    improved = True
+                    break
+        return n_swaps
+
+    def _build_neighbourhood_bitsets(self):
+        """
+        Precompute the (open) 1-neighbourhood of each node as a bitset, for
+        the exact signatures (k > 1).
+        """
+        self._neighbourhood_bitsets = [0] + [nodes_2_bitset(self._neighbours[node])
+                                             for node in range(1, self._G.number_of_nodes() + 1)]
+
+    def _sharing_neighbours(self, sensors):
+        """
+        The graph H^2 of CodeVerifier, in which two nodes are adjacent if they
+        are at distance at most 2 in the graph H that links the nodes that
+        share a sensor in their parts of the signatures. Removing sensors only
+        removes edges from H, so the graph of a placement also serves for all
+        of its subsets.
+        :param sensors: Bitset of the sensor nodes.
+        :return:        List of the sorted neighbours of each node in H^2
+                        (index 0 is empty).
+        """
+        n_nodes = self._G.number_of_nodes()
+        A = nx.to_scipy_sparse_array(self._G, nodelist=range(1, n_nodes + 1), dtype=np.int32, format='csc')
+        if not self._two_step:
+            A = (A + identity(n_nodes, dtype=np.int32, format='csc')).tocsc()
+        # The sensor on a node itself (two-step) is not shared with any other
+        # node, so it adds no edges to H
+        P = A[:, np.array(bitset_2_nodes(sensors), dtype=np.int64) - 1].tocsr()
+        H = (P @ P.T).tocsr()
+        H.data[:] = 1
+        H2 = (H + H @ H).tocsr()
+        H2.setdiag(0)
+        H2.eliminate_zeros()
+        H2.sort_indices()
+        indptr, indices = H2.indptr.tolist(), (H2.indices + 1).tolist()
+        return [[]] + [indices[indptr[idx]:indptr[idx + 1]] for idx in range(n_nodes)]
+
+    def _set_bitsets(self, nodes):
+        """
+        :param nodes:   Iterable of nodes.
+        :return:        (bitset of the nodes U, bitset of N[U] (one-step) or
+                        N(U) (two-step))
+        """
+        N1 = self._neighbourhood_bitsets
+        U_bits = N_U = 0
+        for node in nodes:
+            U_bits |= 1 << node
+            N_U |= N1[node]
+        if not self._two_step:
+            N_U |= U_bits
+        return U_bits, N_U
+
+    def _signature(self, nodes, sensors):
+        """
+        :param nodes:   Iterable of nodes U.
+        :param sensors: Bitset of the sensor nodes S.
+        :return:        Signature of U, as in _violated_sets.
+        """
+        U_bits, N_U = self._set_bitsets(nodes)
+        return (U_bits & sensors, N_U & sensors) if self._two_step else (0, N_U & sensors)
+
+    def _violated_sets(self, sensors, k, limit=None, deadline=None, neighbours=None):
+        """
+        Find the pairs of sets of at most k nodes (including the empty set)
+        that have the same signature under the sensors, and return their
+        distinguishing sets: the nodes on which a sensor would distinguish
+        them. Only the sets that are connected in H^2 are enumerated (see
+        _sharing_neighbours): if any two sets have the same signature, then so
+        do two of those. They are enumerated with the ESU algorithm (Wernicke,
+        2006), which generates each connected set once, and their signatures
+        are hashed. Each set is paired with all earlier sets with the same
+        signature, such that hitting all distinguishing sets resolves all
+        collisions between the enumerated sets.
+        :param sensors:     Bitset of the sensor nodes.
+        :param k:           Maximum identifiable set size.
+        :param limit:       Number of distinguishing sets after which the
+                            search stops, or None to find all of them.
+        :param deadline:    perf_counter time after which the search stops, or
+                            None for no limit.
+        :param neighbours:  Neighbours in H^2 of a superset of the sensors, or
+                            None to compute them for the sensors.
+        :return:            List of distinguishing sets (as bitsets), or None
+                            if the deadline passed first.
+        """
+        n_nodes = self._G.number_of_nodes()
+        N1 = self._neighbourhood_bitsets
+        if neighbours is None:
+            neighbours = self._sharing_neighbours(sensors)
+        two_step = self._two_step
+
+        # In the one-step setting, a set U has signature N[U] & S, and in the
+        # two-step setting (U & S, N(U) & S). The empty set has the empty
+        # signature. The signatures are keyed by their hash, and by the
+        # signature itself if the hash is taken by another signature. The
+        # first set with a signature is kept in signatures, the others in
+        # groups.
+        signatures = {hash((0, 0)): ()}
+        groups = dict()
+        violated = []
+        n_sets = 0
+        for root in range(1, n_nodes + 1):
+            # Each entry holds a connected set (with its bitsets), the nodes
+            # that may still extend it, and the nodes in or adjacent to it.
+            # Extending the empty set by the root gives all connected sets of
+            # which the root is the smallest node.
+            stack = [((), 0, 0, [root], {root})]
+            while stack:
+                nodes, U_bits, N_U, extension, reached = stack[-1]
+                if not extension:
+                    stack.pop()
+                    continue
+                node = extension.pop()
+                nodes = nodes + (node,)
+                U_bits |= 1 << node
+                N_U |= N1[node]
+                if two_step:
+                    signature = (U_bits & sensors, N_U & sensors)
+                else:
+                    N_U |= 1 << node
+                    signature = (0, N_U & sensors)
+                key = hash(signature)
+                first = signatures.get(key)
+                if first is not None and self._signature(first, sensors) != signature:
+                    key = signature
+                    first = signatures.get(key)
+                if first is None:
+                    signatures[key] = nodes
+                else:
+                    for other in [first] + groups.get(key, []):
+                        other_U_bits, other_N_U = self._set_bitsets(other)
+                        if two_step:
+                            violated.append((U_bits ^ other_U_bits) | (N_U ^ other_N_U))
+                        else:
+                            violated.append(N_U ^ other_N_U)
+                    if limit is not None and len(violated) >= limit:
+                        return violated
+                    groups.setdefault(key, []).append(nodes)
+                n_sets += 1
+                if deadline is not None and n_sets % DEADLINE_CHECK_INTERVAL == 0 \
+                        and time.perf_counter() > deadline:
+                    return None
+                if len(nodes) < k:
+                    stack.append((nodes, U_bits, N_U,
+                                  extension + [other for other in neighbours[node]
+                                               if other > root and other not in reached],
+                                  reached | set(neighbours[node])))
+        return violated
+
+    def _repair(self, sensors, k, deadline):
+        """
+        Add sensors until no two sets of at most k nodes have the same
+        signature. Each round hits the violated distinguishing sets (at most
+        MAX_REPAIR_SETS) greedily, with lazily evaluated gains.
+        :param sensors:     Bitset of the sensor nodes.
+        :param k:           Maximum identifiable set size.
+        :param deadline:    perf_counter time after which the repair raises a
+                            TimeoutError, or None for no limit.
+        :return:            Bitset of the sensor nodes.
+        """
+        while True:
+            violated = self._violated_sets(sensors, k, limit=MAX_REPAIR_SETS, deadline=deadline)
+            if violated is None or deadline is not None and time.perf_counter() > deadline:
+                raise TimeoutError("The repair did not find a valid placement for k = {k} within the time "
+                                   "limit.".format(k=k))
+            if not violated:
+                return sensors
+            # In the one-step setting, two different sets can have the same
+            # closed neighbourhood (for k > 1, even if there are no twins),
+            # and then no sensor distinguishes them
+            if not all(violated):
+                raise ValueError("The graph has no identifying code for k = {k}, since some sets of at most {k} "
+                                 "nodes have the same closed neighbourhood.".format(k=k))
+            containing = dict()
+            for idx, ds in enumerate(violated):
+                for node in bitset_2_nodes(ds):
+                    containing.setdefault(node, []).append(idx)
+            is_hit = [False] * len(violated)
+            n_left = len(violated)
+            heap = [(-len(idxs), node) for node, idxs in containing.items()]
+            heapq.heapify(heap)
+            while n_left > 0:
+                _, node = heapq.heappop(heap)
+                gain = sum(1 for idx in containing[node] if not is_hit[idx])
+                if gain == 0:
+                    continue
+                if heap and gain < -heap[0][0]:
+                    heapq.heappush(heap, (-gain, node))
+                    continue
+                sensors |= 1 << node
+                for idx in containing[node]:
+                    if not is_hit[idx]:
+                        is_hit[idx] = True
+                        n_left -= 1
+
+    def _prune_exact(self, sensors, k, deadline):
+        """
+        Remove each sensor that the placement does not need, checking the
+        exact signatures of the sets of at most k nodes (see _violated_sets).
+        :return:    (bitset of the sensor nodes, number of removed sensors)
+        """
+        n_pruned = 0
+        neighbours = self._sharing_neighbours(sensors)
+        for sensor in bitset_2_nodes(sensors):
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            violated = self._violated_sets(sensors & ~(1 << sensor), k, limit=1, deadline=deadline,
+                                           neighbours=neighbours)
+            if violated is None:
+                break
+            if not violated:
+                sensors &= ~(1 << sensor)
+                n_pruned += 1
+        return sensors, n_pruned
+
+    def _swap_exact(self, sensors, k, deadline):
+        """
+        Replace two sensors (at distance at most 2 from each other) by at most
+        one other sensor, like _swap, but checking the exact signatures of all
+        sets of at most k nodes. The new sensor must resolve the first
+        violation that removing the two sensors caused, so it is only searched
+        among the nodes of its distinguishing set.
+        :return:    (bitset of the sensor nodes, number of swaps)
+        """
+        n_swaps = 0
+        improved = True
+        while improved:
+            improved = False
+            neighbours = self._sharing_neighbours(sensors)
+            for first in bitset_2_nodes(sensors):
+                nearby = {node for neighbour in self._neighbours[first]
+                          for node in [neighbour] + self._neighbours[neighbour]}
+                for second in sorted(nearby):
+                    if deadline is not None and time.perf_counter() > deadline:
+                        return sensors, n_swaps
+                    if second == first or not sensors >> second & 1:
+                        continue
+                    reduced = sensors & ~(1 << first) & ~(1 << second)
+                    violated = self._violated_sets(reduced, k, limit=1, deadline=deadline, neighbours=neighbours)
+                    if violated:
+                        for candidate in bitset_2_nodes(violated[0]):
+                            if candidate in (first, second):
+                                continue
+                            candidate_violated = self._violated_sets(reduced | (1 << candidate), k, limit=1,
+                                                                     deadline=deadline)
+                            if candidate_violated is None:
+                                return sensors, n_swaps
+                            if not candidate_violated:
+                                reduced |= 1 << candidate
+                                violated = []
+                                break
+                    if violated is None:
+                        return sensors, n_swaps
+                    if violated:
+                        continue
+                    sensors = reduced
+                    n_swaps += 1
+                    improved = True
+                    break
+        return sensors, n_swaps
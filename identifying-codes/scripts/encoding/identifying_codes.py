@@ -31,17 +31,64 @@ import sys
 from contextlib import suppress
 from datetime import datetime
 from itertools import combinations
+from lp_writer import LP_LINE_LENGTH
+import math
 import networkx as nx
+import numpy as np
 import os
 from scipy.io import mmread
+from scipy.sparse import diags, identity
 import socket
 import subprocess
 from subprocess import PIPE
+import time
 
 PBLIB_DIR = os.getenv('PBLIB_DIR')
 VERITAS_PBLIB_DIR = os.getenv('VERITAS_PBLIB_DIR')
 PROJECT_DIR = os.getenv('PROJECT_DIR')
 
+# Encodings of the cardinality constraint of the GIS encoding for which
+# cardinality_encoding_size can count the variables and clauses
+CARDINALITY_ENCODINGS = ['pblib', 'sequential', 'totalizer', 'cardinality_networks']
+DEFAULT_CARDINALITY_ENCODING = 'pblib'
+
+# Number of min-hash values per node with which the sizes of the closed
+# 4-neighbourhoods are estimated (see _neighbourhood_statistics). The relative
+# error of the estimate of a single size is about 1/sqrt(SKETCH_SIZE - 2), but
+# the errors average out over the nodes.
+SKETCH_SIZE = 64
+
+# Fractions of the two-step uniqueness rows of the pairs of nodes that remain
+# after removing supersets (k = 1), as (estimate, lowest, highest), for the
+# adjacent pairs and the pairs at distance 2 with a reducible node, and for
+# the pairs of irreducible nodes (see _estimate_two_step_pair_uniqueness).
+# The rows were counted exactly on 20 generated networks of 300 to 1000 nodes:
+# G(n, m) with mean degree 4, 8 and 16, Barabasi-Albert (m = 2 and 4),
+# Watts-Strogatz (k = 6, p = 0.1), random geometric, grid, power-law cluster
+# (m = 3, p = 0.5) and random tree graphs, each at two sizes. The estimate is
+# the fraction over the pairs of all networks, and the range is that of the
+# single networks (with such pairs). The rows of the pairs at distance 3 or
+# more with a reducible node never remain.
+REDUCIBLE_ADJACENT_KEPT = (0.49, 0.03, 0.82)
+REDUCIBLE_DISTANCE_2_KEPT = (0.29, 0.09, 0.99)
+IRREDUCIBLE_ADJACENT_KEPT = (0.99, 0.94, 1.0)
+IRREDUCIBLE_DISTANCE_2_KEPT = (0.99, 0.66, 1.0)
+IRREDUCIBLE_FAR_KEPT = (0.99, 0.96, 1.0)
+
+# Ranges (lowest, highest) of the ratio of the actual to the estimated numbers
+# of two-step uniqueness rows and nonzeros, by check_2_neighbourhood for k = 1
+# (where only the sizes of the 4-neighbourhoods are estimated), and by
+# (remove_supersets, check_2_neighbourhood) for k > 1 (see
+# _estimate_two_step_uniqueness). They were measured on nine of the kinds of
+# networks above, with 200 nodes for k = 1, and with 40 nodes for k = 2, since
+# the pairs of larger networks are too many to count for k = 2. The ratio by
+# check_2_neighbourhood was 0.85 to 1.07 without remove_supersets, and down to
+# 0.77 (Watts-Strogatz) with it, where it widens the range of the kept
+# fractions. For k > 1 with remove_supersets, the estimate is coarse indeed.
+PAIR_UNIQUENESS_RATIO = {False: (1.0, 1.0), True: (0.75, 1.07)}
+SET_UNIQUENESS_RATIO = {(False, False): (0.38, 0.97), (False, True): (0.38, 0.97),
+                        (True, False): (0.2, 64.0), (True, True): (0.2, 64.0)}
+
 def log_message(message):
     print('{date}: {message}'.format(
         date=datetime.now().strftime("%Y-%m-%d, %Hh%Mm%Ss"), message=message))
@@ -134,6 +181,112 @@ def cardinality_constraint(variables: list,
     return reindexed_clauses, max(start_idx-1, max(var_2_pblib_index))
 
 
+def cardinality_encoding_size(n_vars, k, encoding=DEFAULT_CARDINALITY_ENCODING):
+    """
+    Size of the CNF encoding of the cardinality constraint
+        sum_i x_i <= k
+    on n_vars variables, without generating it.
+    - 'sequential': the sequential counter of Sinz (2005).
+    - 'totalizer': the totalizer of Bailleux and Boufkhad (2003), with the
+      counts cut off at k + 1 (Buettner and Rintanen, 2005).
+    - 'cardinality_networks': the cardinality networks of Asin et al. (2011),
+      built from half mergers and sorters of (padded) size 2^ceil(log2(k+1)).
+    - 'pblib': the encoding that cardinality_constraint gets from pblib with
+      its default configuration, approximated by the sequential counter for
+      k = 1 (at-most-one) and the cardinality networks for k > 1.
+    :param n_vars:      Number of variables in the constraint.
+    :param k:           Upper bound.
+    :param encoding:    One of CARDINALITY_ENCODINGS.
+    :return:            (number of auxiliary variables, number of clauses,
+                        number of literals in the clauses)
+    """
+    assert encoding in CARDINALITY_ENCODINGS, "Unknown cardinality encoding: {e}".format(e=encoding)
+    if n_vars <= k:
+        return 0, 0, 0
+    if encoding == 'pblib':
+        encoding = 'sequential' if k == 1 else 'cardinality_networks'
+
+    if encoding == 'sequential':
+        # Clauses (-x_1 | s_1,1), (-s_1,j) for j > 1, (-x_n | -s_n-1,k), and
+        # for 1 < i < n: (-x_i | s_i,1), (-s_i-1,1 | s_i,1), (-x_i | -s_i-1,k),
+        # and for j > 1: (-x_i | -s_i-1,j-1 | s_i,j), (-s_i-1,j | s_i,j).
+        n_aux = (n_vars - 1) * k
+        n_clauses = 2 * n_vars * k + n_vars - 3 * k - 1
+        n_literals = 2 + (k - 1) + (n_vars - 2) * (6 + 5 * (k - 1)) + 2
+        return n_aux, n_clauses, n_literals
+
+    if encoding == 'totalizer':
+        sizes = dict()
+
+        def totalizer(n_inputs):
+            # (number of outputs, auxiliary variables, clauses, literals) of
+            # the subtree that counts n_inputs inputs
+            if n_inputs == 1:
+                return 1, 0, 0, 0
+            if n_inputs not in sizes:
+                left, right = totalizer(n_inputs // 2), totalizer(n_inputs - n_inputs // 2)
+                n_outputs = min(left[0] + right[0], k + 1)
+                n_clauses, n_literals = 0, 0
+                # Clauses a_i & b_j -> r_i+j, with a_0 and b_0 left out
+                for i in range(left[0] + 1):
+                    for j in range(right[0] + 1):
+                        if 1 <= i + j <= n_outputs:
+                            n_clauses += 1
+                            n_literals += (i > 0) + (j > 0) + 1
+                sizes[n_inputs] = (n_outputs, left[1] + right[1] + n_outputs,
+                                   left[2] + right[2] + n_clauses, left[3] + right[3] + n_literals)
+            return sizes[n_inputs]
+
+        _, n_aux, n_clauses, n_literals = totalizer(n_vars)
+        # Unit clause that forbids output k + 1 of the root
+        return n_aux, n_clauses + 1, n_literals + 1
+
+    # Cardinality networks. A comparator (two outputs, three clauses, seven
+    # literals in the half encoding) is the building block of the mergers.
+    def half_merge(size):
+        if size == 1:
+            return 2, 3, 7
+        n_aux, n_clauses, n_literals = half_merge(size // 2)
+        return 2 * n_aux + 2 * (size - 1), 2 * n_clauses + 3 * (size - 1), 2 * n_literals + 7 * (size - 1)
+
+    def half_sort(size):
+        if size == 2:
+            return half_merge(1)
+        sort_aux, sort_clauses, sort_literals = half_sort(size // 2)
+        merge_aux, merge_clauses, merge_literals = half_merge(size // 2)
+        return 2 * sort_aux + merge_aux, 2 * sort_clauses + merge_clauses, 2 * sort_literals + merge_literals
+
+    def simplified_merge(size):
+        if size == 1:
+            return 2, 3, 7
+        n_aux, n_clauses, n_literals = simplified_merge(size // 2)
+        return 2 * n_aux + size, 2 * n_clauses + 3 * size // 2, 2 * n_literals + 7 * size // 2
+
+    block_size = 2 ** math.ceil(math.log2(k + 1))
+    n_blocks = math.ceil(n_vars / block_size)
+    sort_size, merge_size = half_sort(block_size), simplified_merge(block_size)
+    n_aux, n_clauses, n_literals = [n_blocks * sort + (n_blocks - 1) * merge
+                                    for sort, merge in zip(sort_size, merge_size)]
+    return n_aux, n_clauses + 1, n_literals + 1
+
+
+def _n_digits(values):
+    """Number of decimal digits of each of an array of positive ints."""
+    return np.floor(np.log10(np.maximum(values, 1))).astype(np.int64) + 1
+
+
+def _total_digits(start, stop):
+    """Total number of decimal digits of the ints in range(start, stop), with
+    0 <= start. Works for ranges that are too large to enumerate."""
+    total = 0
+    low, n_digits = 0, 1
+    while low < stop:
+        high = 10 ** n_digits
+        total += n_digits * max(0, min(stop, high) - max(start, low))
+        low, n_digits = high, n_digits + 1
+    return total
+
+
 def check_datatype(network_file):
     with open(network_file, 'r') as infile:
     # with gzip.open(network_file, 'rt', encoding='utf-8') as infile:
@@ -188,6 +341,31 @@ def twin_removal(G):
     return G, twins
 
 
+def nodes_2_bitset(nodes):
+    """Represent a set of nodes as a bitset, i.e., an int in which bit i is set
+    iff node i is in the set.
+    :param nodes: iterable of (int) nodes
+    :return:      int
+    """
+    bitset = 0
+    for node in nodes:
+        bitset |= 1 << node
+    return bitset
+
+
+def bitset_2_nodes(bitset):
+    """Decode a bitset into the sorted list of nodes that it represents.
+    :param bitset: int in which bit i is set iff node i is in the set
+    :return:       list of (int) nodes, sorted in increasing order
+    """
+    nodes = []
+    while bitset:
+        lowest_bit = bitset & -bitset
+        nodes.append(lowest_bit.bit_length() - 1)
+        bitset ^= lowest_bit
+    return nodes
+
+
 def prepend_multiple_lines(file_name, list_of_lines):
     """Insert given list of strings as a new lines at the beginning of a file.
     Code from https://thispointer.com/python-how-to-insert-lines-at-the-top-of-a-file/
@@ -221,6 +399,27 @@ class IdentifyingCodesInstance:
         self._label_2_node = dict()
 
         self._n_vars = None
+        self._neighbourhood_stats = None
+
+    @classmethod
+    def from_instance(cls, instance):
+        """
+        Create an instance of this class for the (preprocessed) graph of
+        another instance, e.g., to find a starting solution or lower bound for
+        an encoding without building the graph again.
+        :param instance:    IdentifyingCodesInstance that has been built.
+        :return:            Instance of cls
+        """
+        new_instance = cls()
+        new_instance._network_file = instance._network_file
+        new_instance._budget = instance._budget
+        new_instance._two_step = instance._two_step
+        new_instance._G = instance._G
+        new_instance._twins = instance._twins
+        new_instance._node_2_label = instance._node_2_label
+        new_instance._label_2_node = instance._label_2_node
+        new_instance._n_vars = instance._n_vars
+        return new_instance
 
     def build_from_file(self,
                         network_file,
@@ -275,12 +474,15 @@ class IdentifyingCodesInstance:
         self._node_2_label = {idx: label for label, idx in self._label_2_node.items()}
         self._G = nx.relabel_nodes(self._G, self._label_2_node)
 
-    def _get_header(self, encoding=None, k=1, remove_supersets=False, check_2_neighbourhood=False):
+    def _get_header(self, encoding=None, k=1, remove_supersets=False, check_2_neighbourhood=False,
+                    presolve_info=None):
         """
         Generates a list of strings that form the header of the dimacs file,
         documenting some basic info about the input graph and its encoding into
         CNF/dimacs.
         :param encoding: Specifies if it's ILP, MaxSAT, SAT or Independent Support
+        :param presolve_info: For ILP only: list of lines describing the
+                         presolve reductions, or None if there was no presolve.
         :return:         List of strings, each string a line in the header
         """
         header = [
@@ -302,8 +504,16 @@ class IdentifyingCodesInstance:
         if encoding.lower() == 'ilp':
             header += [
             'Remove supersets:  {r}'.format(r=remove_supersets),
-                'Check 2 neighbourhood: {c}'.format(c=check_2_neighbourhood)
+                'Check 2 neighbourhood: {c}'.format(c=check_2_neighbourhood),
+                'Presolve:          {p}'.format(p=presolve_info is not None)
                 ]
+            if presolve_info is not None:
+                header += [
+                    '',
+                    '',
+                    'PRESOLVE',
+                    '--------',
+                ] + presolve_info
         elif encoding.lower() == 'pb':
             if VERITAS_PBLIB_DIR is not None:
                 res = subprocess.check_output('git --git-dir {VERITAS_PBLIB_DIR}/.git config --get remote.origin.url'.format(
@@ -385,6 +595,526 @@ class IdentifyingCodesInstance:
             twin_map.append('')
         return label_map + twin_map
 
+    def estimate_encoding_sizes(self, k, cardinality_encoding=DEFAULT_CARDINALITY_ENCODING, seed=0):
+        """
+        Estimate the sizes of the encodings of the instance for k before they
+        are generated, from the degrees of the nodes, the sizes of their 2-hop
+        neighbourhoods and the twins (see _neighbourhood_statistics), rather
+        than reading them off the files afterwards, like CNFparser and
+        ILPparser do.
+        - GIS: the variables and the detection clauses follow from the degrees
+          exactly, the cardinality constraint is counted with
+          cardinality_encoding_size.
+        - ILP: the detection and alo rows follow from the degrees exactly, and
+          so do the one-step uniqueness rows, of the pairs of nodes at distance
+          1 or 2. The two-step uniqueness rows are estimated for each
+          combination of remove_supersets and check_2_neighbourhood, see
+          _estimate_two_step_uniqueness.
+        - File sizes: of the GCNF and of the (uncompressed) LP file that the
+          native writer writes, from the number of digits of the variables.
+          Each comes with the range in which the actual size is expected
+          ('file_size_range'), which follows from the parts that are not
+          counted exactly (see _estimate_gis_size and _estimate_ilp_sizes).
+        :param k:                       Maximum identifiable set size.
+        :param cardinality_encoding:    See cardinality_encoding_size.
+        :param seed:                    Seed for the sketches of the
+                                        4-neighbourhoods.
+        :return:    Dictionary with the size of the graph, the GIS estimate
+                    ('gis') and the ILP estimates ('ilp', a list with one entry
+                    per configuration; the one-step encoding has only one).
+        """
+        log_message("{classname}: Start estimating encoding sizes".format(classname=self.__class__.__name__))
+        start_time = time.perf_counter()
+        stats = self._neighbourhood_statistics(seed=seed)
+        estimate = {
+            'k': k,
+            'two_step': bool(self._two_step),
+            'n_nodes': stats['n_nodes'],
+            'n_edges': stats['n_edges'],
+            'n_twins': sum(len(twins) - 1 for twins in self._twins.values()),
+            'gis': self._estimate_gis_size(k, stats, cardinality_encoding),
+            'ilp': self._estimate_ilp_sizes(k, stats),
+            'estimate_time': None,
+        }
+        estimate['estimate_time'] = time.perf_counter() - start_time
+        log_message("{classname}: Estimated GCNF for k = {k}: {v} variables, {c} clauses, {s} bytes.".format(
+            classname=self.__class__.__name__, k=k, v=estimate['gis']['n_vars'],
+            c=estimate['gis']['n_clauses'], s=estimate['gis']['file_size']))
+        return estimate
+
+    def _neighbourhood_statistics(self, seed=0):
+        """
+        Statistics of the neighbourhoods of the nodes, from which
+        estimate_encoding_sizes works out the sizes of the encodings. They are
+        computed once per instance.
+        With C = A + I the closed-neighbourhood incidence matrix, the nodes at
+        distance 1 or 2 from node v are the nonzeros of row v of C^2 (other
+        than v), and for distinct nodes, A^2[u, w] is the number of common
+        neighbours of u and w. The numbers of nodes at distance 1 to 4 are
+        estimated with min-hash sketches: each node draws SKETCH_SIZE
+        exponentially distributed values, and after four rounds of taking the
+        minimum over the closed neighbourhoods, each value of node v is the
+        minimum over N_4[v], and (SKETCH_SIZE - 1) / (sum of the values) is an
+        unbiased estimate of |N_4[v]|.
+        The statistics of the pairs of nodes are computed for three sets of
+        nodes: all nodes, the representatives of the classes of closed twins
+        (N[u] = N[w]), and the irreducible nodes. Node u is reducible if two
+        nodes in N[u] have the same neighbours outside N[u] (e.g., if u has a
+        closed twin, or a neighbour x with N[x] in N[u]). This is tested with
+        random hashes of the neighbourhoods.
+        :param seed:    Seed for the sketches and the hashes.
+        :return:    Dictionary with the numbers of nodes and edges, the number
+                    of pairs of nodes that have a common neighbour
+                    ('n_sharing'), arrays, indexed by node - 1, of the degrees
+                    ('degrees') and the largest number of common neighbours
+                    with another node ('max_common'), and the statistics of the
+                    pairs of nodes in each set (see below).
+        """
+        if self._neighbourhood_stats is not None:
+            return self._neighbourhood_stats
+        n_nodes = self._G.number_of_nodes()
+        rng = np.random.default_rng(seed)
+        A = nx.to_scipy_sparse_array(self._G, nodelist=range(1, n_nodes + 1), dtype=np.int64, format='csr')
+        I = identity(n_nodes, dtype=np.int64, format='csr')
+        C = (A + I).tocsr()
+        C.sort_indices()
+        C2 = (C @ C).tocsr()
+        degrees = np.diff(A.indptr)
+
+        # Numbers of common neighbours of the pairs of distinct nodes
+        common = (C2 - 2 * A - C2.multiply(I)).tocsr()
+        common.eliminate_zeros()
+        max_common = common.max(axis=1).toarray().ravel() if n_nodes > 0 else np.zeros(0, dtype=np.int64)
+        C2.data[:] = 1
+
+        # Closed twins have the same row in C. We keep the first node of each
+        # class as its representative.
+        is_representative = np.ones(n_nodes, dtype=bool)
+        first_of_class = dict()
+        for node in range(n_nodes):
+            closed_neighbourhood = C.indices[C.indptr[node]:C.indptr[node + 1]].tobytes()
+            if closed_neighbourhood in first_of_class:
+                is_representative[node] = False
+            else:
+                first_of_class[closed_neighbourhood] = node
+
+        # With random weights h, the neighbours of x outside N[u] have hash
+        # sum_{N(x)} h - sum_{N(x) & N[u]} h. Q[u, x] is the second sum plus
+        # 1, for the nodes x in N[u].
+        hashes = rng.integers(1, 2 ** 40, size=n_nodes)
+        Q = (C @ diags(hashes, dtype=np.int64, format='csr') @ A + C).multiply(C).tocoo()
+        outside = (A @ hashes)[Q.col] - (Q.data - 1)
+        order = np.lexsort((outside, Q.row))
+        repeated = (Q.row[order][1:] == Q.row[order][:-1]) & (outside[order][1:] == outside[order][:-1])
+        is_irreducible = np.ones(n_nodes, dtype=bool)
+        is_irreducible[Q.row[order][1:][repeated]] = False
+
+        # Sketches of the 4-neighbourhoods, of all nodes and of the nodes in
+        # each set
+        masks = [np.ones(n_nodes, dtype=bool), is_representative, is_irreducible]
+        sums = np.zeros((n_nodes, len(masks)))
+        if n_nodes > 0:
+            for _ in range(SKETCH_SIZE):
+                minima = rng.exponential(size=(n_nodes, len(masks)))
+                for column, mask in enumerate(masks):
+                    minima[~mask, column] = np.inf
+                for _ in range(4):
+                    minima = np.minimum.reduceat(minima[C.indices], C.indptr[:-1], axis=0)
+                sums += minima
+
+        def pair_statistics(column, mask):
+            # Statistics of the pairs of nodes in the set: the number of
+            # nodes, and of edges, the sum of deg(u) + deg(w) and of the
+            # common neighbours over the edges {u, w}, the sum of the common
+            # neighbours over all pairs, and arrays, indexed by node - 1, of
+            # the numbers of nodes in the set at distance 1 or 2 ('sizes_2'),
+            # and (estimated) 1 to 4 ('sizes_4').
+            M = diags(mask.astype(np.int64), dtype=np.int64, format='csr')
+            A_M = (M @ A @ M).tocsr()
+            mask_degrees = A @ mask.astype(np.int64)
+            sizes_2 = C2 @ mask.astype(np.int64) - mask
+            n_mask = int(mask.sum())
+            sizes_4 = np.clip((SKETCH_SIZE - 1) / np.maximum(sums[:, column], 1e-300) - mask,
+                              sizes_2, max(n_mask - 1, 0))
+            return {
+                'mask': mask,
+                'n_nodes': n_mask,
+                'n_edges': A_M.nnz // 2,
+                'edge_degrees': int((A_M @ degrees).sum()),
+                'edge_common': int(common.multiply(A_M).sum()) // 2,
+                'common': int((mask_degrees * (mask_degrees - 1)).sum()) // 2,
+                'sizes_2': sizes_2,
+                'sizes_4': sizes_4,
+            }
+
+        all_pairs, representative_pairs, irreducible_pairs = [pair_statistics(column, mask)
+                                                               for column, mask in enumerate(masks)]
+        self._neighbourhood_stats = {
+            'n_nodes': n_nodes,
+            'n_edges': self._G.number_of_edges(),
+            'n_sharing': common.nnz // 2,
+            'degrees': degrees,
+            'max_common': max_common,
+            'sizes_2': all_pairs['sizes_2'],
+            'sizes_4': all_pairs['sizes_4'],
+            'all_pairs': all_pairs,
+            'representative_pairs': representative_pairs,
+            'irreducible_pairs': irreducible_pairs,
+        }
+        return self._neighbourhood_stats
+
+    def _estimate_gis_size(self, k, stats, cardinality_encoding):
+        """
+        Count the variables and clauses of the GIS encoding (see GISEncoding),
+        and the bytes of the GCNF file. Node v has fire variable v and detector
+        variable n + v, and its detection constraints are one clause with
+        -(n + v) and the fire variables of N[v], and a binary clause for each
+        node in N[v]. Since node u is in the closed neighbourhoods of deg(u) + 1
+        nodes, the digits of the detection clauses follow from the degrees.
+        The file size has a range ('file_size_range'), since pblib chooses the
+        encoding of the cardinality constraint itself: with 'pblib', the
+        cardinality clauses are taken to be as small as those of the smallest
+        and as large as those of the largest encoding that
+        cardinality_encoding_size counts. For the other encodings, the range is
+        the estimate itself.
+        :param k:                       Maximum identifiable set size.
+        :param stats:                   See _neighbourhood_statistics.
+        :param cardinality_encoding:    See cardinality_encoding_size.
+        :return:    Dictionary with the estimates.
+        """
+        n_nodes, n_edges = stats['n_nodes'], stats['n_edges']
+        closed_degrees = stats['degrees'] + 1
+        n_aux, n_card_clauses, n_card_literals = cardinality_encoding_size(n_nodes, k, cardinality_encoding)
+        n_vars = 2 * n_nodes + n_aux
+        n_detection_clauses = 2 * n_nodes + 2 * n_edges
+        n_clauses = n_detection_clauses + n_card_clauses
+
+        nodes = np.arange(1, n_nodes + 1)
+        fire_digits = _n_digits(nodes)
+        detector_digits = _n_digits(nodes + n_nodes)
+        file_size = sum(len(line) + 3 for line in self._get_header(encoding='independent support', k=k))
+        file_size += len('p cnf {v} {c}\n'.format(v=n_vars, c=n_clauses))
+        # 'c def' line with the fire variables, 'c ind' line with the fire
+        # and detector variables (two-step) or detector variables (one-step)
+        file_size += 8 + n_nodes + int(fire_digits.sum())
+        if self._two_step:
+            file_size += 8 + 2 * n_nodes + int(fire_digits.sum() + detector_digits.sum())
+            # 'c grp v n+v 0' lines
+            file_size += 10 * n_nodes + int(fire_digits.sum() + detector_digits.sum())
+        else:
+            file_size += 8 + n_nodes + int(detector_digits.sum())
+        # Long detection clauses, and binary detection clauses
+        file_size += int((4 + detector_digits).sum() + (closed_degrees * (1 + fire_digits)).sum())
+        file_size += int((closed_degrees * detector_digits).sum() + (closed_degrees * (5 + fire_digits)).sum())
+
+        # Cardinality clauses, most of whose literals are auxiliary variables
+        def cardinality_size(encoding):
+            n_aux, n_card_clauses, n_card_literals = cardinality_encoding_size(n_nodes, k, encoding)
+            if n_aux == 0:
+                return 0
+            aux_digits = _total_digits(2 * n_nodes + 1, 2 * n_nodes + n_aux + 1) / n_aux
+            return int(n_card_literals * (1.5 + aux_digits) + 2 * n_card_clauses)
+
+        cardinality_sizes = [cardinality_size(encoding) for encoding in CARDINALITY_ENCODINGS] \
+            if cardinality_encoding == 'pblib' else [cardinality_size(cardinality_encoding)]
+        file_size_range = [file_size + min(cardinality_sizes), file_size + max(cardinality_sizes)]
+        file_size += cardinality_size(cardinality_encoding)
+        return {
+            'cardinality_encoding': cardinality_encoding,
+            'n_vars': n_vars,
+            'n_aux_vars': n_aux,
+            'n_clauses': n_clauses,
+            'n_detection_clauses': n_detection_clauses,
+            'n_cardinality_clauses': n_card_clauses,
+            'file_size': file_size,
+            'file_size_range': file_size_range,
+        }
+
+    def _estimate_ilp_sizes(self, k, stats):
+        """
+        Count the rows and nonzeros of the ILP encoding (see ILPEncoding), and
+        the bytes of its LP file, for each configuration of the two-step
+        encoding. The one-step encoding only has uniqueness rows for the pairs
+        of nodes at distance 1 or 2, whose nonzeros are the symmetric
+        differences of their closed neighbourhoods: summed over the pairs,
+        sum_v sizes_2[v] (deg(v) + 1) - 2 sum_z C(deg(z) + 1, 2).
+        The range of the file size ('file_size_range') is that of the two-step
+        uniqueness rows (see _estimate_two_step_uniqueness); the other rows are
+        counted exactly.
+        :param k:       Maximum identifiable set size.
+        :param stats:   See _neighbourhood_statistics.
+        :return:        List of dictionaries with the estimates.
+        """
+        n_nodes, n_edges = stats['n_nodes'], stats['n_edges']
+        degrees, sizes_2 = stats['degrees'], stats['sizes_2']
+        closed_degrees = degrees + 1
+        name_chars = 1 + _n_digits(np.arange(1, n_nodes + 1))
+        # The names in a uniqueness row are about as long as the names in the
+        # closed neighbourhoods
+        mean_name_chars = float((closed_degrees * name_chars).sum() / max(closed_degrees.sum(), 1))
+
+        estimates = []
+        if not self._two_step:
+            n_pairs = int(sizes_2.sum()) // 2
+            n_uniqueness_nonzeros = int((sizes_2 * closed_degrees).sum() - (degrees * closed_degrees).sum())
+            row_groups = [('d', n_nodes, 2 * n_edges + n_nodes, int((closed_degrees * name_chars).sum()), ' >= 1'),
+                          ('i', n_pairs, n_uniqueness_nonzeros, n_uniqueness_nonzeros * mean_name_chars, ' >= 1')]
+            configurations = [(False, False)]
+        else:
+            configurations = [(False, False), (False, True), (True, False), (True, True)]
+        for remove_supersets, check_2_neighbourhood in configurations:
+            # The row groups of the estimate, and of the low and the high end
+            # of its range
+            end_row_groups = [row_groups] * 3 if not self._two_step else [
+                [('a', n_nodes, n_nodes, int(name_chars.sum()), ' >= 1'),
+                 ('d', n_nodes, 2 * n_edges + 2 * n_nodes,
+                  int(name_chars.sum() + (closed_degrees * name_chars).sum()), ' = 0'),
+                 ('u', n_u, n_u_nonzeros, n_u_nonzeros * mean_name_chars, ' >= 1')]
+                for n_u, n_u_nonzeros in self._estimate_two_step_uniqueness(k, remove_supersets,
+                                                                            check_2_neighbourhood, stats)]
+            row_groups = end_row_groups[0]
+            file_sizes = [self._estimate_lp_file_size(k, remove_supersets, check_2_neighbourhood, stats, groups)
+                          for groups in end_row_groups]
+            estimates.append({
+                'remove_supersets': remove_supersets,
+                'check_2_neighbourhood': check_2_neighbourhood,
+                'n_vars': 2 * n_nodes if self._two_step else n_nodes,
+                'n_rows': sum(group[1] for group in row_groups),
+                'n_non_zeros': sum(group[2] for group in row_groups),
+                'file_size': file_sizes[0],
+                'file_size_range': file_sizes[1:],
+            })
+        return estimates
+
+    def _estimate_lp_file_size(self, k, remove_supersets, check_2_neighbourhood, stats, row_groups):
+        """
+        Count the bytes of the LP file that the native writer writes (see
+        LPWriter) for a model with the given rows.
+        :param k:                       Maximum identifiable set size.
+        :param remove_supersets:        For the header.
+        :param check_2_neighbourhood:   For the header.
+        :param stats:                   See _neighbourhood_statistics.
+        :param row_groups:  List of tuples (name prefix, number of rows, number
+                            of nonzeros, total length of the variable names of
+                            the nonzeros, sense and right-hand side), one per
+                            kind of row.
+        :return:            Estimated number of bytes.
+        """
+        n_nodes = stats['n_nodes']
+        name_chars = 1 + _n_digits(np.arange(1, n_nodes + 1))
+        header = self._get_header(encoding="ILP", k=k, remove_supersets=remove_supersets,
+                                  check_2_neighbourhood=check_2_neighbourhood)
+        file_size = sum(len(line) + 3 for line in header) + len('\nMinimize\nSubject To\n')
+        row_groups = [(' obj:', 1, n_nodes, int(name_chars.sum()), '')] + \
+                     [(prefix, n_rows, n_terms, term_chars, suffix)
+                      for prefix, n_rows, n_terms, term_chars, suffix in row_groups]
+        for prefix, n_rows, n_terms, term_chars, suffix in row_groups:
+            if n_rows == 0:
+                continue
+            if prefix == ' obj:':
+                row_chars = len(prefix) + len(suffix) + 1
+            else:
+                # ' <prefix><index>:' and the sense and right-hand side
+                row_chars = n_rows * (len(prefix) + len(suffix) + 3) + _total_digits(0, n_rows)
+            # Terms ' + <name>', the first of a row without the '+ '
+            row_chars += 3 * n_terms + term_chars - 2 * n_rows
+            # Long rows continue on lines that start with 6 spaces
+            row_length = row_chars / n_rows
+            term_length = 3 + term_chars / max(n_terms, 1)
+            n_breaks = max(0.0, (row_length - LP_LINE_LENGTH / 2) / (LP_LINE_LENGTH - 6 - term_length / 2))
+            file_size += row_chars + 7 * int(n_breaks) * n_rows
+
+        # Bounds (0 <= x_v <= 1 and 0 <= y_v <= deg(v) + 1), and the sections
+        # with 10 binary (x) and general (y) variables per line
+        file_size += len('Bounds\n') + int((13 + name_chars).sum())
+        file_size += len('Binaries\n') + int(name_chars.sum()) + 2 * n_nodes + math.ceil(n_nodes / 10)
+        if self._two_step:
+            file_size += int((12 + name_chars + _n_digits(stats['degrees'] + 1)).sum())
+            file_size += len('Generals\n') + int(name_chars.sum()) + 2 * n_nodes + math.ceil(n_nodes / 10)
+        file_size += len('End\n')
+        return int(file_size)
+
+    def _estimate_two_step_pair_uniqueness(self, remove_supersets, check_2_neighbourhood, stats):
+        """
+        Estimate the number of two-step uniqueness rows and their nonzeros for
+        k = 1, i.e., for the pairs of nodes {u, w}, with distinguishing sets
+        {u, w} | (N(u) ^ N(w)). Summed over a set of pairs, the sizes of these
+        sets are the sums of deg(u) + deg(w), minus twice the common
+        neighbours, plus 2 for the pairs that are not adjacent. Since the pairs
+        with a common neighbour are at distance 1 or 2 ('near'), these sums
+        follow from the statistics of the pairs (see _neighbourhood_statistics)
+        exactly, except for the sizes of the 4-neighbourhoods.
+        A pair that is not adjacent has the same set if a node is replaced by
+        a closed twin, so of those pairs we count the pairs of representatives.
+        With check_2_neighbourhood, the pairs at distance more than 4 are not
+        generated.
+        With remove_supersets, the set N[u] | N[w] of a pair at distance 3 or
+        more is a superset of the set of a pair in N[u] if u is reducible, and
+        is mostly kept otherwise, so we count the pairs of irreducible nodes.
+        The near pairs of irreducible nodes are mostly kept as well. Of the
+        other near pairs, a fraction is kept that varies a lot between
+        networks. These fractions (REDUCIBLE_ADJACENT_KEPT and the like) were
+        measured, and their ranges give the range of the estimate.
+        :param remove_supersets:        See _two_step_uniqueness_constraint.
+        :param check_2_neighbourhood:   See _two_step_uniqueness_constraint.
+        :param stats:                   See _neighbourhood_statistics.
+        :return:    List of (number of rows, number of nonzeros) for the
+                    estimate, the low and the high end of its range.
+        """
+        degrees = stats['degrees']
+
+        def pair_counts(pairs):
+            # Numbers of rows and nonzeros of the adjacent pairs, the pairs at
+            # distance 2 and the pairs at a larger distance, of the nodes in
+            # the set
+            mask = pairs['mask']
+            mask_degrees, sizes_2 = degrees[mask], pairs['sizes_2'][mask]
+            n_adjacent = pairs['n_edges']
+            adjacent_nonzeros = pairs['edge_degrees'] - 2 * pairs['edge_common']
+            n_near = float(sizes_2.sum()) / 2
+            near_nonzeros = float((mask_degrees * sizes_2).sum()) - 2 * pairs['common'] + 2 * (n_near - n_adjacent)
+            if check_2_neighbourhood:
+                far_sizes = pairs['sizes_4'][mask] - sizes_2
+            else:
+                far_sizes = pairs['n_nodes'] - 1 - sizes_2
+            n_far = float(far_sizes.sum()) / 2
+            far_nonzeros = float((mask_degrees * far_sizes).sum()) + 2 * n_far
+            return ((n_adjacent, adjacent_nonzeros), (n_near - n_adjacent, near_nonzeros - adjacent_nonzeros),
+                    (n_far, far_nonzeros))
+
+        adjacent, distance_2, _ = pair_counts(stats['all_pairs'])
+        if not remove_supersets:
+            _, representative_distance_2, representative_far = pair_counts(stats['representative_pairs'])
+            counts = [((1, 1, 1), adjacent), ((1, 1, 1), representative_distance_2),
+                      ((1, 1, 1), representative_far)]
+        else:
+            irreducible_adjacent, irreducible_distance_2, irreducible_far = pair_counts(stats['irreducible_pairs'])
+            counts = [(IRREDUCIBLE_ADJACENT_KEPT, irreducible_adjacent),
+                      (IRREDUCIBLE_DISTANCE_2_KEPT, irreducible_distance_2),
+                      (IRREDUCIBLE_FAR_KEPT, irreducible_far),
+                      (REDUCIBLE_ADJACENT_KEPT, np.subtract(adjacent, irreducible_adjacent)),
+                      (REDUCIBLE_DISTANCE_2_KEPT, np.subtract(distance_2, irreducible_distance_2))]
+        return [(int(sum(fractions[end] * rows for fractions, (rows, _) in counts)),
+                 int(sum(fractions[end] * nonzeros for fractions, (_, nonzeros) in counts)))
+                for end in range(3)]
+
+    def _estimate_two_step_uniqueness(self, k, remove_supersets, check_2_neighbourhood, stats):
+        """
+        Estimate the number of two-step uniqueness rows and their nonzeros
+        (see ILPEncoding._two_step_uniqueness_constraint) from the statistics
+        of the neighbourhoods. Unlike ILPEncoding.estimate_two_step_uniqueness,
+        no distinguishing sets are generated.
+
+        A pair (U, W) is described by A = U - W, B = W - U and X = U & W, and
+        its distinguishing set is (A | B) | ((N(A) ^ N(B)) - N(X)). This is
+        the generic set S | N(S) of S = A | B, unless a node in A and a node
+        in B have a common neighbour, or a node in X has a common neighbour
+        with a node in S. All generic pairs with the same S give the same row.
+        Taking pairs of nodes to have a common neighbour independently with
+        probability q = n_sharing / C(n, 2), the rows are the pairs that are
+        not generic, plus the sets S with at least one generic pair. With
+        check_2_neighbourhood, a pair with X empty is only generated if a node
+        in A and a node in B are at distance at most 4, which pairs of nodes
+        without common neighbours are taken to be with the probability that
+        follows from the sizes of the 4-neighbourhoods. For k = 1, the pairs
+        are counted exactly instead (see _estimate_two_step_pair_uniqueness).
+        For k > 1, this overestimates the rows of small, dense networks.
+
+        With remove_supersets, for k > 1, the rows are mostly the sets
+        {w} | (N(w) - N(U')) of the pairs (U', U' + w), |U'| = k - 1, with as
+        many neighbours of w in N(U') as possible. Taking each node of U' to
+        cover max_common[w] neighbours of w, w has
+        C(ceil(deg(w) / max_common[w]), k - 1) such sets, or only {w} if U'
+        can cover all of N(w). This is a coarse estimate;
+        ILPEncoding.estimate_two_step_uniqueness samples the actual sets.
+        The ranges of the estimates follow from the errors that we measured
+        (SET_UNIQUENESS_RATIO and PAIR_UNIQUENESS_RATIO, and for k = 1 with
+        remove_supersets, the ranges of the kept fractions as well).
+        :param k:                       Maximum identifiable set size.
+        :param remove_supersets:        See _two_step_uniqueness_constraint.
+        :param check_2_neighbourhood:   See _two_step_uniqueness_constraint.
+        :param stats:                   See _neighbourhood_statistics.
+        :return:    List of (number of rows, number of nonzeros) for the
+                    estimate, the low and the high end of its range.
+        """
+        n_nodes, n_edges = stats['n_nodes'], stats['n_edges']
+        degrees = stats['degrees']
+        n_pairs = math.comb(n_nodes, 2)
+        if n_pairs == 0:
+            return [(0, 0)] * 3
+
+        def with_range(n_rows, n_nonzeros, ratio_range):
+            return [(int(n_rows), int(n_nonzeros))] + [(int(ratio * n_rows), int(ratio * n_nonzeros))
+                                                       for ratio in ratio_range]
+
+        if k == 1:
+            estimates = self._estimate_two_step_pair_uniqueness(remove_supersets, check_2_neighbourhood, stats)
+            low_ratio, high_ratio = PAIR_UNIQUENESS_RATIO[check_2_neighbourhood]
+            if remove_supersets:
+                # The range of the kept fractions, widened by that of the
+                # 4-neighbourhood sizes
+                (n_rows, n_nonzeros), (low_rows, low_nonzeros), (high_rows, high_nonzeros) = estimates
+                return [(n_rows, n_nonzeros), (int(low_ratio * low_rows), int(low_ratio * low_nonzeros)),
+                        (int(high_ratio * high_rows), int(high_ratio * high_nonzeros))]
+            return with_range(*estimates[0], (low_ratio, high_ratio))
+        ratio_range = SET_UNIQUENESS_RATIO[(remove_supersets, check_2_neighbourhood)]
+
+        if remove_supersets:
+            coverage = np.maximum(stats['max_common'], 1)
+            uncovered = degrees - (k - 1) * coverage
+            n_rows = sum(1 if n_uncovered <= 0 else math.comb(math.ceil(degree / node_coverage), k - 1)
+                         for degree, node_coverage, n_uncovered in zip(degrees.tolist(), coverage.tolist(),
+                                                                       uncovered.tolist()))
+            n_nonzeros = sum(1 if n_uncovered <= 0 else
+                             math.comb(math.ceil(degree / node_coverage), k - 1) * (1 + n_uncovered)
+                             for degree, node_coverage, n_uncovered in zip(degrees.tolist(), coverage.tolist(),
+                                                                           uncovered.tolist()))
+            return with_range(n_rows, n_nonzeros, ratio_range)
+
+        q = stats['n_sharing'] / n_pairs
+        p_4 = min(1.0, float(stats['sizes_4'].mean()) / (n_nodes - 1))
+        p_far = min(1.0, max(0.0, (p_4 - q) / (1 - q))) if q < 1 else 1.0
+        mean_degree = 2 * n_edges / n_nodes
+        closed_fraction = min(1.0, (1 + mean_degree) / n_nodes)
+
+        def row_size(set_size):
+            # Expected size of S | N(S), for a set S of set_size nodes
+            return n_nodes * (1 - (1 - closed_fraction) ** set_size)
+
+        n_rows, n_nonzeros = 0.0, 0.0
+        log_p_no_generic = dict()
+        for x in range(k):
+            for a in range(k - x + 1):
+                for b in range(a, k - x + 1):
+                    if a + x == 0 or a + b == 0:
+                        continue
+                    s = a + b
+                    n_type_pairs = math.comb(n_nodes, x) * math.comb(n_nodes - x, a) * math.comb(n_nodes - x - a, b)
+                    n_realisations = math.comb(s, a) * math.comb(n_nodes - s, x)
+                    if a == b:
+                        n_type_pairs /= 2
+                        n_realisations /= 2
+                    p_generic = (1 - q) ** (a * b + x * s)
+                    # Pairs with a common neighbour in A and B have distinct
+                    # sets. Of the pairs that only interact through X, those
+                    # with the same A and B differ by the neighbours of S that
+                    # N(X) removes, of which there are about s * mean_degree.
+                    n_cross = n_type_pairs * (1 - (1 - q) ** (a * b))
+                    n_through_x = n_type_pairs * (1 - q) ** (a * b) * (1 - (1 - q) ** (x * s))
+                    n_through_x = min(n_through_x, n_type_pairs / math.comb(n_nodes - s, x)
+                                      * math.comb(round(s * mean_degree), x))
+                    n_rows += n_cross + n_through_x
+                    n_nonzeros += (n_cross + n_through_x) * row_size(s)
+                    if check_2_neighbourhood and x == 0:
+                        p_generic *= 1 - (1 - p_far) ** (a * b)
+                    log_p = n_realisations * math.log1p(-p_generic) if p_generic < 1 else -math.inf
+                    log_p_no_generic[s] = log_p_no_generic.get(s, 0.0) + log_p
+        for s, log_p in log_p_no_generic.items():
+            n_generic = math.comb(n_nodes, s) * -math.expm1(log_p)
+            n_rows += n_generic
+            n_nonzeros += n_generic * row_size(s)
+        return with_range(n_rows, n_nonzeros, ratio_range)
+
 
 
 
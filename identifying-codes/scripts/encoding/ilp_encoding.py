@@ -27,13 +27,267 @@ THE SOFTWARE.
 @desc: Class for encoding an Identifying Codes instance as an ILP problem.
 """
 
-from contextlib import suppress
-import cplex
+from array import array
+try:
+    import cplex
+except ImportError:
+    # Only needed for ilp_writer='cplex'
+    cplex = None
+import hashlib
+from heuristic_solver import HeuristicSolver
 from identifying_codes import IdentifyingCodesInstance, \
-    log_message, prepend_multiple_lines
+    log_message, prepend_multiple_lines, nodes_2_bitset, bitset_2_nodes
 from itertools import combinations
+from lp_writer import open_model_writer, write_mip_start
+import math
+import multiprocessing
 import networkx as nx
-import sys
+import numpy as np
+import os
+import pickle
+import random
+import resource
+from scipy.optimize import Bounds, LinearConstraint, OptimizeResult, milp
+from scipy.sparse import csr_matrix, identity, triu
+from set_trie import SetTrie
+import time
+import tracemalloc
+
+# Number of shards per worker process when generating uniqueness constraints
+# in parallel. Using more shards than workers balances the load.
+SHARDS_PER_WORKER = 4
+# Minimum number of shards, which determines how much work is lost when an
+# encoding is killed and resumed from its last checkpoint.
+MIN_N_SHARDS = 256
+# Number of node pairs for which one-step distinguishing sets are computed at
+# once. Bounds the size of the intermediate sparse matrices.
+ONE_STEP_BATCH_SIZE = 100000
+# Number of two-step uniqueness constraints that are decoded from their
+# distinguishing sets at once, when they are streamed to the model file.
+CONSTRAINT_BATCH_SIZE = 100000
+# Number of sets U of each cardinality, and of pairs (U, W), that are sampled
+# to estimate the size of the two-step uniqueness constraints.
+ESTIMATOR_N_SAMPLES = 2000
+# Maximum number of seconds that the estimator spends on timing each step of
+# the generation of the uniqueness constraints.
+ESTIMATOR_TIMING_BUDGET = 1.0
+
+
+class PrefixUnion:
+    """
+    Computes the union of the bitsets of the nodes in a tuple of nodes. The
+    union for the prefix of the tuple (all nodes but the last one) is cached,
+    recursively, such that consecutive tuples that share a prefix (as
+    generated by itertools.combinations) only require a single OR.
+    """
+
+    def __init__(self, node_bitsets):
+        """
+        :param node_bitsets:    Dictionary mapping each node to a bitset.
+        """
+        self._node_bitsets = node_bitsets
+        self._prefix = None
+        self._prefix_union = 0
+        self._prefix_cache = None
+
+    def union(self, nodes):
+        """
+        :param nodes:   Tuple of nodes.
+        :return:        Union of the bitsets of the nodes, as a bitset.
+        """
+        if not nodes:
+            return 0
+        prefix = nodes[:-1]
+        if prefix != self._prefix:
+            if self._prefix_cache is None:
+                self._prefix_cache = PrefixUnion(self._node_bitsets)
+            self._prefix_union = self._prefix_cache.union(prefix)
+            self._prefix = prefix
+        return self._prefix_union | self._node_bitsets[nodes[-1]]
+
+
+class DistinguishingSets:
+    """
+    Collection of the distinguishing sets that become uniqueness constraints.
+    If remove_supersets is True, only the minimal distinguishing sets are kept,
+    in a set-trie. Otherwise, all distinct distinguishing sets are kept, as
+    bitsets. Since the minimal sets of a family do not depend on the order in
+    which its sets are added, collections that were built independently (e.g.,
+    by different processes) can be merged into the same result.
+    """
+
+    def __init__(self, remove_supersets=False):
+        self._remove_supersets = remove_supersets
+        self._ds_trie = SetTrie()   # minimal distinguishing sets, as nodes
+        self._ds_bitsets = set()    # all distinguishing sets, as bitsets
+
+    def __len__(self):
+        return len(self._ds_trie) if self._remove_supersets else len(self._ds_bitsets)
+
+    def add(self, ds_bitset):
+        """
+        :param ds_bitset:   Distinguishing set, as a bitset.
+        :return:            None
+        """
+        if self._remove_supersets:
+            # The set-trie needs the nodes themselves, so here we decode the
+            # bitset.
+            self._add_nodes(bitset_2_nodes(ds_bitset))
+        else:
+            self._ds_bitsets.add(ds_bitset)
+
+    def _add_nodes(self, ds_nodes):
+        # Check if the new set is a superset of an existing set. If it is not,
+        # then remove the existing sets that are supersets of the new one, and
+        # add the new one.
+        if not self._ds_trie.has_subset(ds_nodes):
+            for removable_ds in self._ds_trie.get_supersets(ds_nodes):
+                self._ds_trie.remove(removable_ds)
+            self._ds_trie.insert(ds_nodes)
+
+    def export(self):
+        """
+        :return:    The distinguishing sets in a compact, picklable form that
+                    can be passed to merge().
+        """
+        if self._remove_supersets:
+            return list(self._ds_trie)
+        return self._ds_bitsets
+
+    def merge(self, exported):
+        """
+        Add the distinguishing sets exported by another collection.
+        :param exported:    Output of export() of a collection with the same
+                            value for remove_supersets.
+        :return:            None
+        """
+        if self._remove_supersets:
+            if len(self._ds_trie) == 0:
+                # If the sets are added in order of increasing size, none of
+                # them is a superset of a set that is added after it, so the
+                # (expensive) search for supersets can be skipped.
+                for ds_nodes in sorted(exported, key=len):
+                    if not self._ds_trie.has_subset(ds_nodes):
+                        self._ds_trie.insert(ds_nodes)
+            else:
+                for ds_nodes in exported:
+                    self._add_nodes(ds_nodes)
+        else:
+            self._ds_bitsets.update(exported)
+
+    def get_sets(self):
+        """
+        :return:    List of distinguishing sets, each a list of nodes sorted in
+                    increasing order. The list itself is sorted as well, such
+                    that the result does not depend on the order in which the
+                    sets were added.
+        """
+        if self._remove_supersets:
+            return sorted(list(ds_nodes) for ds_nodes in self._ds_trie)
+        return sorted(bitset_2_nodes(ds_bitset) for ds_bitset in self._ds_bitsets)
+
+
+def _write_pickle(out_file, obj):
+    """
+    Pickle obj to out_file. The file is replaced atomically, such that a job
+    that is killed while writing leaves the previous version intact.
+    """
+    with open(out_file + '.tmp', 'wb') as pfile:
+        pickle.dump(obj, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(out_file + '.tmp', out_file)
+
+
+def _constraint_batches(group):
+    """
+    Iterate over the batches of a group of constraints (see
+    ILPEncoding._write_model): the group itself if it is a (rows, senses,
+    rhs, names) tuple, or else the batches it generates.
+    """
+    if isinstance(group, tuple):
+        yield group
+    else:
+        yield from group
+
+
+def _join_batches(batches):
+    """
+    Concatenate batches of constraints into a single (rows, senses, rhs,
+    names) tuple.
+    """
+    rows, senses, rhs, names = [], [], [], []
+    for batch_rows, batch_senses, batch_rhs, batch_names in batches:
+        rows.extend(batch_rows)
+        senses.append(batch_senses)
+        rhs.extend(batch_rhs)
+        names.extend(batch_names)
+    return rows, ''.join(senses), rhs, names
+
+
+def _constraint_matrix(n_vars, constraints):
+    """
+    Build the constraint matrix of a model as a sparse CSR matrix, with the
+    lower and upper bounds on each row.
+    :param n_vars:      Number of variables (columns).
+    :param constraints: List of (rows, senses, rhs, names) tuples, with the
+                        rows in index form (see ILPEncoding._write_model).
+    :return:            (csr_matrix, numpy array, numpy array)
+    """
+    indptr = array('q', [0])
+    indices = array('i')
+    data = array('d')
+    all_senses = []
+    all_rhs = array('d')
+    for rows, senses, rhs, _ in constraints:
+        for bvars, coeffs in rows:
+            indices.extend(bvars)
+            data.extend(coeffs)
+            indptr.append(len(indices))
+        all_senses.append(senses)
+        all_rhs.extend(rhs)
+    n_rows = len(indptr) - 1
+    A = csr_matrix((np.frombuffer(data, dtype=np.float64),
+                    np.frombuffer(indices, dtype=np.int32),
+                    np.frombuffer(indptr, dtype=np.int64)),
+                   shape=(n_rows, n_vars))
+    senses = np.frombuffer(''.join(all_senses).encode('ascii'), dtype='S1')
+    rhs = np.frombuffer(all_rhs, dtype=np.float64)
+    row_lbs = np.where(senses == b'L', -np.inf, rhs)
+    row_ubs = np.where(senses == b'G', np.inf, rhs)
+    return A, row_lbs, row_ubs
+
+
+def _row_activity_range(bvars, coeffs, lbs, ubs):
+    """
+    Minimum and maximum value of sum_i coeffs[i] * x_bvars[i], given the
+    bounds of the variables.
+    """
+    min_activity = 0
+    max_activity = 0
+    for idx, coeff in zip(bvars, coeffs):
+        if coeff > 0:
+            min_activity += coeff * lbs[idx]
+            max_activity += coeff * ubs[idx]
+        else:
+            min_activity += coeff * ubs[idx]
+            max_activity += coeff * lbs[idx]
+    return min_activity, max_activity
+
+
+# Instance whose uniqueness constraints are generated by the worker processes.
+# It is set before the workers are forked, so they inherit it instead of
+# receiving a pickled copy of the graph with every task.
+_uniqueness_shard_instance = None
+
+
+def _uniqueness_shard_worker(shard_args):
+    shard, first_nodes, k, min_k, remove_supersets, check_2_neighbourhood = shard_args
+    ds_shard = _uniqueness_shard_instance._uniqueness_shard(
+        first_nodes, k,
+        remove_supersets=remove_supersets,
+        check_2_neighbourhood=check_2_neighbourhood,
+        min_k=min_k)
+    return shard, ds_shard.export()
+
 
 class ILPEncoding(IdentifyingCodesInstance):
 
@@ -50,12 +304,530 @@ class ILPEncoding(IdentifyingCodesInstance):
         self._ilp_enc = None
         self._node_vars = []
 
-    def encode(self, lp_file, k, remove_supersets=False, check_2_neighbourhood=False):
+        # Neighbourhood index (distance -> node -> bitset), used for
+        # generating uniqueness constraints
+        self._neighbourhood_index = {1: dict(), 2: dict(), 4: dict()}
+        # Distinguishing sets of the last two-step encoding, which are reused
+        # when encoding a larger k
+        self._uniqueness_store = None
+        # Best known solution for each k of a sweep, used for warm starts
+        self._sweep_solutions = dict()
+
+    def encode(self, lp_file, k, remove_supersets=False, check_2_neighbourhood=False, n_workers=1,
+               checkpoint_interval=0, resume=False, constraint_store=None, ilp_writer='native', presolve=False,
+               warm_start=False):
         log_message("{classname}: Start encoding".format(classname=self.__class__.__name__))
         if self._two_step:
-            self.encode_two_step(lp_file, k, remove_supersets=remove_supersets, check_2_neighbourhood=check_2_neighbourhood)
+            self.encode_two_step(lp_file, k, remove_supersets=remove_supersets, check_2_neighbourhood=check_2_neighbourhood, n_workers=n_workers,
+                                 checkpoint_interval=checkpoint_interval, resume=resume,
+                                 constraint_store=constraint_store, ilp_writer=ilp_writer, presolve=presolve,
+                                 warm_start=warm_start)
+        else:
+            self.encode_one_step(lp_file, k, ilp_writer=ilp_writer, presolve=presolve, warm_start=warm_start)
+
+    def _run_highs(self, var_types, objective, lbs, ubs, constraints, time_limit=None):
+        """
+        Solve a model with the HiGHS MILP solver, through scipy.optimize.milp.
+        Note that scipy runs HiGHS's MIP solver on a single thread.
+        :param var_types:   See _write_model.
+        :param objective:   See _write_model.
+        :param lbs:         See _write_model.
+        :param ubs:         See _write_model.
+        :param constraints: See _write_model.
+        :param time_limit:  Maximum number of seconds for the solver, or None
+                            for no limit.
+        :return:            (scipy.optimize.OptimizeResult, constraint matrix,
+                            solution time)
+        """
+        A, row_lbs, row_ubs = _constraint_matrix(len(var_types), constraints)
+        log_message("{classname}: Built constraint matrix with {n_rows} rows and {n_nz} nonzeros.".format(
+            classname=self.__class__.__name__, n_rows=A.shape[0], n_nz=A.nnz))
+
+        options = {'disp': False}
+        if time_limit is not None:
+            options['time_limit'] = time_limit
+        start_time = time.time()
+        result = milp(c=objective,
+                      constraints=LinearConstraint(A, row_lbs, row_ubs),
+                      integrality=[0 if var_type == 'C' else 1 for var_type in var_types],
+                      bounds=Bounds(lbs, ubs),
+                      options=options)
+        solution_time = time.time() - start_time
+        log_message("{classname}: HiGHS finished in {t:.2f} seconds: {message}".format(
+            classname=self.__class__.__name__, t=solution_time, message=result.message))
+        return result, A, solution_time
+
+    def _get_solution_data(self, k, result, A, var_types, solution_time, time_limit=None):
+        """
+        Collect the results of a HiGHS run, laid out like the data of
+        ILPOutputParser.
+        :return:    Dictionary with 'highs_info' and 'solution_info' groups.
+        """
+        solution = None
+        if result.x is not None:
+            solution = [self._node_2_label[node] for node in range(1, self._G.number_of_nodes() + 1)
+                        if round(result.x[self._fire_var(node)]) == 1]
+        return {
+            'highs_info': {
+                'solution_time': solution_time,
+                'status': int(result.status),
+                'message': result.message,
+                'optimal': bool(result.status == 0),
+                'mip_gap': getattr(result, 'mip_gap', None),
+                'mip_dual_bound': getattr(result, 'mip_dual_bound', None),
+                'n_rows': A.shape[0],
+                'n_non_zeros': A.nnz,
+                'n_binaries': var_types.count('B'),
+                'time_limit': time_limit,
+            },
+            'solution_info': {
+                # The objective (number of sensors) is integral
+                'optimised_value': None if result.x is None else float(round(result.fun)),
+                'k': k,
+                'solution': solution,
+            },
+        }
+
+    def solve(self, k, remove_supersets=True, check_2_neighbourhood=True, n_workers=1, time_limit=None,
+              presolve=False, warm_start=False):
+        """
+        Solve the encoding in-process with the HiGHS MILP solver, instead of
+        writing a model file for a separate CPLEX run.
+        :param k:               Maximum identifiable set size.
+        :param remove_supersets:        See _two_step_uniqueness_constraint.
+        :param check_2_neighbourhood:   See _two_step_uniqueness_constraint.
+        :param n_workers:       See _two_step_uniqueness_constraint.
+        :param time_limit:      Maximum number of seconds for the solver, or
+                                None for no limit.
+        :param presolve:        True if the model should be simplified first
+                                (see _presolve).
+        :param warm_start:      True if the solutions for other values of k
+                                should be used (see _warm_start_solution).
+                                Since scipy's HiGHS interface does not take a
+                                starting solution, the starting solution
+                                bounds the objective from above, and is
+                                returned if HiGHS finds no better solution.
+        :return:    Dictionary with 'highs_info' and 'solution_info' groups,
+                    laid out like the data of ILPOutputParser. The solution is
+                    the list of sensor nodes, by their original labels.
+        """
+        log_message("{classname}: Start solving with HiGHS".format(classname=self.__class__.__name__))
+        self._k = k
+        if self._two_step:
+            model = self._two_step_model(k, remove_supersets=remove_supersets,
+                                         check_2_neighbourhood=check_2_neighbourhood, n_workers=n_workers)
         else:
-            self.encode_one_step(lp_file, k)
+            model = self._one_step_model()
+        if presolve:
+            model, _ = self._presolve(*model)
+        var_names, var_types, objective, lbs, ubs, constraints = model
+        lower_bound = start = upper_bound = start_source = None
+        if warm_start:
+            lower_bound, start, upper_bound, start_source = self._warm_start_solution(
+                k, var_types, objective, lbs, ubs, constraints)
+        if start is not None and lower_bound is not None and upper_bound <= lower_bound:
+            log_message("{classname}: The starting solution meets the lower bound, so it is optimal.".format(
+                classname=self.__class__.__name__))
+            A = _constraint_matrix(len(var_types), constraints)[0]
+            result = OptimizeResult(x=np.array(start, dtype=float), fun=upper_bound, status=0,
+                                    message='The starting solution meets the lower bound.',
+                                    mip_gap=0.0, mip_dual_bound=float(lower_bound))
+            solution_time = 0.0
+        else:
+            bound_constraint = self._objective_bound_constraint(objective, lower_bound=lower_bound,
+                                                                upper_bound=upper_bound)
+            if bound_constraint[0]:
+                constraints = constraints + [bound_constraint]
+            result, A, solution_time = self._run_highs(var_types, objective, lbs, ubs, constraints,
+                                                       time_limit=time_limit)
+            if result.x is None and start is not None:
+                # Return the starting solution as the best known solution
+                result.x = np.array(start, dtype=float)
+                result.fun = upper_bound
+        self._record_solution(k, result)
+        solution_data = self._get_solution_data(k, result, A, var_types, solution_time, time_limit=time_limit)
+        if warm_start:
+            solution_data['highs_info']['warm_start'] = {
+                'lower_bound': lower_bound,
+                'start_value': upper_bound,
+                'start': start_source,
+            }
+        return solution_data
+
+    def _record_solution(self, k, result):
+        """
+        Keep the solution for k, for warm starts for other values of k (see
+        _warm_start_solution). An optimal solution is not replaced by a
+        solution that is not known to be optimal.
+        :param k:       Maximum identifiable set size.
+        :param result:  scipy.optimize.OptimizeResult, or an object with the
+                        same x, fun, status and mip_dual_bound attributes.
+        :return:        None
+        """
+        if result.x is None:
+            return
+        optimal = result.status == 0
+        previous = self._sweep_solutions.get(k)
+        if previous is not None and previous['optimal'] and not optimal:
+            return
+        self._sweep_solutions[k] = {
+            'sensors': nodes_2_bitset(node for node in range(1, self._G.number_of_nodes() + 1)
+                                      if round(result.x[self._fire_var(node)]) == 1),
+            'value': int(round(result.fun)),
+            'optimal': optimal,
+            'dual_bound': getattr(result, 'mip_dual_bound', None),
+        }
+
+    def _warm_start_sensors(self, k):
+        """
+        Derive a lower bound and a starting sensor placement for k from the
+        solutions for other values of k (see _record_solution). Since an
+        identifying code for k is also one for any smaller k, the optimum is
+        monotonic in k. Therefore, the optimum (or a dual bound) for a smaller
+        k is a lower bound for k, and a solution for a larger k is a solution
+        for k. Otherwise, the solution for the largest smaller k is repaired
+        into a solution for k (see _repair_sensors), or if there is none, a
+        solution is found with HeuristicSolver (or, if that fails, by
+        repairing the empty placement).
+        The one-step encoding does not depend on k, so there the solution for
+        any other k is a solution for k.
+        :param k:   Maximum identifiable set size.
+        :return:    (lower bound or None, bitset of sensor nodes or None,
+                    description of where the sensors come from or None)
+        """
+        lower_bound = None
+        for other_k, solution in self._sweep_solutions.items():
+            bound = solution['value'] if solution['optimal'] else solution['dual_bound']
+            if other_k < k and bound is not None:
+                # The objective is integral
+                bound = math.ceil(bound - 1e-6)
+                lower_bound = bound if lower_bound is None else max(lower_bound, bound)
+
+        larger_ks = [other_k for other_k in self._sweep_solutions if other_k > k]
+        smaller_ks = [other_k for other_k in self._sweep_solutions if other_k < k]
+        if larger_ks or not self._two_step and smaller_ks:
+            other_k = min(larger_ks) if larger_ks else max(smaller_ks)
+            return lower_bound, self._sweep_solutions[other_k]['sensors'], \
+                'solution for k = {k}'.format(k=other_k)
+        if smaller_ks:
+            other_k = max(smaller_ks)
+            return lower_bound, self._repair_sensors(self._sweep_solutions[other_k]['sensors'], k), \
+                'repaired solution for k = {k}'.format(k=other_k)
+        # The one-step encoding does not depend on k, so the heuristic only
+        # needs to solve it for k = 1. If the heuristic fails, the empty
+        # placement is repaired instead, such that a warm start never breaks
+        # a solve.
+        try:
+            heuristic = HeuristicSolver.from_instance(self)
+            solution = heuristic.solve(k if self._two_step else 1)['solution_info']['solution']
+            return lower_bound, nodes_2_bitset(self._label_2_node[label] for label in solution), \
+                'heuristic solution'
+        except Exception as exc:
+            log_message("{classname}: Heuristic warm start FAILED ({exc}), repairing the empty placement.".format(
+                classname=self.__class__.__name__, exc=exc))
+            return lower_bound, self._repair_sensors(0, k), 'repaired empty placement'
+
+    def _repair_sensors(self, sensors, k):
+        """
+        Add sensors to a sensor placement until it is feasible for the
+        encoding of k: each node has a sensor in its closed 1-neighbourhood,
+        and no two sets have the same signature (see
+        _violated_uniqueness_sets for the two-step encoding, and the closed
+        1-neighbourhood of each node for the one-step encoding). The sensors
+        are added greedily: each time the node that is in the most violated
+        constraints. Adding sensors never makes two signatures equal, so the
+        violations that are left after a round are only those that were not
+        reported yet (at most one per set of nodes with equal signatures).
+        :param sensors: Bitset of the sensor nodes.
+        :param k:       Maximum identifiable set size.
+        :return:        Bitset of the sensor nodes.
+        """
+        if not self._neighbourhood_index[1]:
+            self._build_neighbourhood_index()
+        N1_index = self._neighbourhood_index[1]
+        n_sensors = bin(sensors).count('1')
+        while True:
+            violated = [N1_index[node] | (1 << node) for node in self._G.nodes()
+                        if not (N1_index[node] | (1 << node)) & sensors]
+            if self._two_step:
+                violated.extend(self._violated_uniqueness_sets(sensors, k))
+            else:
+                signatures = dict()
+                for node in self._G.nodes():
+                    closed_neighbourhood = N1_index[node] | (1 << node)
+                    first = signatures.setdefault(closed_neighbourhood & sensors, closed_neighbourhood)
+                    if first != closed_neighbourhood:
+                        violated.append(first ^ closed_neighbourhood)
+            if not violated:
+                break
+            counts = dict()
+            for ds in violated:
+                for node in bitset_2_nodes(ds):
+                    counts[node] = counts.get(node, 0) + 1
+            while violated:
+                best_node = min(counts, key=lambda node: (-counts[node], node))
+                sensors |= 1 << best_node
+                remaining = []
+                for ds in violated:
+                    if ds >> best_node & 1:
+                        for node in bitset_2_nodes(ds):
+                            counts[node] -= 1
+                    else:
+                        remaining.append(ds)
+                violated = remaining
+        log_message("{classname}: Repaired sensor placement for k = {k} by adding {n} sensors.".format(
+            classname=self.__class__.__name__, k=k, n=bin(sensors).count('1') - n_sensors))
+        return sensors
+
+    def _start_vector(self, sensors, n_vars):
+        """
+        :param sensors: Bitset of the sensor nodes.
+        :param n_vars:  Number of variables in the model.
+        :return:        List with the value of each variable, where the
+                        detection variables (two-step) count the sensors in
+                        the closed 1-neighbourhood of their node.
+        """
+        start = [0] * n_vars
+        for node in self._G.nodes():
+            start[self._fire_var(node)] = sensors >> node & 1
+            if self._two_step:
+                closed_neighbourhood = nodes_2_bitset(self._G.neighbors(node)) | (1 << node)
+                start[self._detection_var(node)] = bin(closed_neighbourhood & sensors).count('1')
+        return start
+
+    def _warm_start_solution(self, k, var_types, objective, lbs, ubs, constraints):
+        """
+        Derive a lower bound and a starting solution for a model for k, from
+        the solutions for other values of k (see _warm_start_sensors). The
+        starting solution is checked against the model, and dropped if it is
+        infeasible.
+        :param k:   Maximum identifiable set size.
+        :param var_types, objective, lbs, ubs, constraints: See _write_model.
+        :return:    (lower bound or None, list of variable values or None,
+                    objective value of the start or None, description of the
+                    start or None)
+        """
+        lower_bound, sensors, source = self._warm_start_sensors(k)
+        start = upper_bound = None
+        if sensors is not None:
+            start = self._start_vector(sensors, len(var_types))
+            A, row_lbs, row_ubs = _constraint_matrix(len(var_types), constraints)
+            activity = A @ np.array(start, dtype=float)
+            var_ubs = [math.inf if ub is None else ub for ub in ubs]
+            if np.all(activity >= row_lbs - 1e-6) and np.all(activity <= row_ubs + 1e-6) \
+                    and all(lb <= value <= ub for value, lb, ub in zip(start, lbs, var_ubs)):
+                upper_bound = int(round(sum(coeff * value for coeff, value in zip(objective, start))))
+            else:
+                log_message("{classname}: The starting solution ({source}) is infeasible, ignoring it.".format(
+                    classname=self.__class__.__name__, source=source))
+                start = source = None
+        log_message("{classname}: Warm start for k = {k}: lower bound {lb}, starting solution with value {ub} "
+                    "({source}).".format(classname=self.__class__.__name__, k=k, lb=lower_bound, ub=upper_bound,
+                                         source=source))
+        return lower_bound, start, upper_bound, source
+
+    def _objective_bound_constraint(self, objective, lower_bound=None, upper_bound=None):
+        """
+        Bound the objective function from below and/or from above.
+        :param objective:   List of objective coefficients.
+        :param lower_bound: Lower bound, or None.
+        :param upper_bound: Upper bound, or None.
+        :return:            (rows, senses, rhs, names), as for the other
+                            constraints.
+        """
+        bvars = [idx for idx, coeff in enumerate(objective) if coeff != 0]
+        row = [bvars, [objective[idx] for idx in bvars]]
+        rows, senses, rhs, names = [], '', [], []
+        if lower_bound is not None:
+            rows.append(row)
+            senses += 'G'
+            rhs.append(lower_bound)
+            names.append('lb')
+        if upper_bound is not None:
+            rows.append(row)
+            senses += 'L'
+            rhs.append(upper_bound)
+            names.append('ub')
+        return rows, senses, rhs, names
+
+    def _warm_start_model(self, lp_file, k, model):
+        """
+        Add the lower bound for k (see _warm_start_solution) to a model that is
+        written to lp_file, and write the starting solution to a MIP start
+        file next to it (see write_mip_start).
+        :param lp_file: Path to the model file.
+        :param k:       Maximum identifiable set size.
+        :param model:   (var_names, var_types, objective, lbs, ubs,
+                        constraints), see _write_model.
+        :return:        The model, with the bound.
+        """
+        var_names, var_types, objective, lbs, ubs, constraints = model
+        lower_bound, start, upper_bound, _ = self._warm_start_solution(k, var_types, objective, lbs, ubs, constraints)
+        if start is not None:
+            mst_file = write_mip_start(lp_file, var_names, start)
+            log_message("{classname}: Wrote MIP start to file {mst_file}".format(
+                classname=self.__class__.__name__, mst_file=mst_file))
+            optimal = lower_bound is not None and upper_bound <= lower_bound
+            self._record_solution(k, OptimizeResult(x=start, fun=upper_bound, status=0 if optimal else 1,
+                                                    mip_dual_bound=None))
+        bound_constraint = self._objective_bound_constraint(objective, lower_bound=lower_bound)
+        if bound_constraint[0]:
+            constraints = constraints + [bound_constraint]
+        return var_names, var_types, objective, lbs, ubs, constraints
+
+    def _nearby_uniqueness_sets(self):
+        """
+        Distinguishing sets (see _two_step_uniqueness_constraint) of the pairs
+        of single nodes ({u}, {w}) with w in the 2-neighbourhood of u, with
+        supersets removed. Assumes that the neighbourhood index has been built
+        with check_2_neighbourhood.
+        :return:    DistinguishingSets
+        """
+        N1_index = self._neighbourhood_index[1]
+        N2_index = self._neighbourhood_index[2]
+        ds_bitsets = set()
+        for u in self._G.nodes():
+            for w in bitset_2_nodes(N2_index[u]):
+                if w > u:
+                    ds_bitsets.add(((1 << u) ^ (1 << w)) | (N1_index[u] ^ N1_index[w]))
+        ds_sets = DistinguishingSets(remove_supersets=True)
+        ds_sets.merge(bitset_2_nodes(ds_bitset) for ds_bitset in ds_bitsets)
+        return ds_sets
+
+    def _violated_uniqueness_sets(self, sensors, k):
+        """
+        Find the two-step uniqueness constraints that a sensor placement
+        violates. A constraint for (U, W) is violated iff U and W have the
+        same signature (U & S, N(U) & S) under the sensors S. We group all
+        sets U with |U| <= k by their signature, and return the distinguishing
+        set of each U with the first set in its group. Assumes that the
+        neighbourhood index has been built.
+        :param sensors: Bitset of the sensor nodes.
+        :param k:       Maximum identifiable set size.
+        :return:        Set of distinguishing sets (as bitsets).
+        """
+        n_nodes = self._G.number_of_nodes()
+        N1_U_prefixes = PrefixUnion(self._neighbourhood_index[1])
+        signatures = dict()
+        ds_sets = set()
+        for U_size in range(1, k + 1):
+            for U in combinations(range(1, n_nodes + 1), U_size):
+                U_bits = nodes_2_bitset(U)
+                N1_U = N1_U_prefixes.union(U)
+                signature = (U_bits & sensors, N1_U & sensors)
+                first = signatures.get(signature)
+                if first is None:
+                    signatures[signature] = (U_bits, N1_U)
+                else:
+                    ds_sets.add((U_bits ^ first[0]) | (N1_U ^ first[1]))
+        return ds_sets
+
+    def solve_lazy(self, k, time_limit=None, warm_start=False):
+        """
+        Solve the two-step encoding with HiGHS, adding the uniqueness
+        constraints lazily. We start from the alo and detection constraints,
+        and the uniqueness constraints of nearby pairs of single nodes. Then we
+        repeatedly solve the model, and add the uniqueness constraints that
+        the solution violates (see _violated_uniqueness_sets), until the
+        solution violates none. The uniqueness constraints are kept with
+        supersets removed. Since each model is a relaxation of the full
+        model, that solution is optimal for the full model.
+        Note that pairs (U, W) whose closed 2-neighbourhoods do not intersect
+        never yield a violated constraint, since the alo constraints already
+        distinguish them.
+        :param k:           Maximum identifiable set size.
+        :param time_limit:  Maximum number of seconds for all solver runs
+                            together, or None for no limit.
+        :param warm_start:  See solve(). The starting solution is also
+                            returned if the time limit is reached before a
+                            solution without violations is found.
+        :return:    Dictionary like the one of solve(), with the number of
+                    iterations and uniqueness constraints in 'highs_info'.
+        """
+        assert self._two_step, "Lazy constraint generation is only implemented for the two-step encoding."
+        log_message("{classname}: Start lazy solving with HiGHS".format(classname=self.__class__.__name__))
+        self._k = k
+        n_nodes = self._G.number_of_nodes()
+        self._build_neighbourhood_index(check_2_neighbourhood=True)
+
+        var_types = 'B' * n_nodes + 'I' * n_nodes
+        objective = [1] * n_nodes + [0] * n_nodes
+        lbs = [0] * (2 * n_nodes)
+        ubs = [1] * n_nodes + [len(nx.ego_graph(self._G, node, radius=1, center=True).nodes())
+                               for node in range(1, n_nodes + 1)]
+        a_rows, a_senses, a_rhs, a_names = self._two_step_alo_constraint()
+        d_rows, d_senses, d_rhs, d_names = self._two_step_detection_constraint()
+
+        # The starting solution is only checked against the alo and
+        # detection constraints, but it satisfies the uniqueness constraints
+        # by construction.
+        lower_bound = start = upper_bound = start_source = None
+        if warm_start:
+            lower_bound, start, upper_bound, start_source = self._warm_start_solution(
+                k, var_types, objective, lbs, ubs,
+                [(a_rows, a_senses, a_rhs, a_names), (d_rows, d_senses, d_rhs, d_names)])
+        bound_constraint = self._objective_bound_constraint(objective, lower_bound=lower_bound,
+                                                            upper_bound=upper_bound)
+        ds_store = self._nearby_uniqueness_sets()
+        log_message("{classname}: Starting from {n_u} uniqueness constraints of nearby pairs.".format(
+            classname=self.__class__.__name__, n_u=len(ds_store)))
+
+        total_time = 0
+        n_iterations = 0
+        while start is None or lower_bound is None or upper_bound > lower_bound:
+            n_iterations += 1
+            remaining_time = None if time_limit is None else max(0, time_limit - total_time)
+            u_rows = [[[self._fire_var(node) for node in ds_sig], [1] * len(ds_sig)]
+                      for ds_sig in ds_store.get_sets()]
+            constraints = [(a_rows, a_senses, a_rhs, a_names),
+                           (d_rows, d_senses, d_rhs, d_names),
+                           (u_rows, 'G' * len(u_rows), [1] * len(u_rows),
+                            ['u' + str(i) for i in range(len(u_rows))])]
+            if bound_constraint[0]:
+                constraints.append(bound_constraint)
+            result, A, solution_time = self._run_highs(var_types, objective, lbs, ubs, constraints,
+                                                       time_limit=remaining_time)
+            total_time += solution_time
+            if result.status != 0:
+                # Time limit reached (or the solver failed), so the solution,
+                # if any, may violate uniqueness constraints
+                break
+            sensors = nodes_2_bitset(node for node in range(1, n_nodes + 1)
+                                     if round(result.x[self._fire_var(node)]) == 1)
+            ds_sets = self._violated_uniqueness_sets(sensors, k)
+            log_message("{classname}: Iteration {i}: {n_s} sensors, {n_v} violated uniqueness constraints.".format(
+                classname=self.__class__.__name__, i=n_iterations, n_s=round(result.fun), n_v=len(ds_sets)))
+            if len(ds_sets) == 0:
+                break
+            for ds_sig in ds_sets:
+                ds_store.add(ds_sig)
+
+        if n_iterations == 0:
+            log_message("{classname}: The starting solution meets the lower bound, so it is optimal.".format(
+                classname=self.__class__.__name__))
+            u_rows = []
+            A = _constraint_matrix(len(var_types), [(a_rows, a_senses, a_rhs, a_names),
+                                                    (d_rows, d_senses, d_rhs, d_names)])[0]
+            result = OptimizeResult(x=np.array(start, dtype=float), fun=upper_bound, status=0,
+                                    message='The starting solution meets the lower bound.',
+                                    mip_gap=0.0, mip_dual_bound=float(lower_bound))
+        elif result.status != 0 and start is not None:
+            # The solution (if any) may violate uniqueness constraints, so
+            # return the starting solution as the best known solution
+            result.x = np.array(start, dtype=float)
+            result.fun = upper_bound
+        if result.status == 0 or start is not None:
+            self._record_solution(k, result)
+        solution_data = self._get_solution_data(k, result, A, var_types, total_time, time_limit=time_limit)
+        solution_data['highs_info']['n_iterations'] = n_iterations
+        solution_data['highs_info']['n_uniqueness_csts'] = len(u_rows)
+        if warm_start:
+            solution_data['highs_info']['warm_start'] = {
+                'lower_bound': lower_bound,
+                'start_value': upper_bound,
+                'start': start_source,
+            }
+        return solution_data
 
     def _one_step_detection_constraint(self):
         """
@@ -65,7 +837,7 @@ class ILPEncoding(IdentifyingCodesInstance):
         rows = []
         for node in self._G.nodes():
             neighbourhood = list(self._G.neighbors(node)) + [node]
-            bvars = ['x' + str(node) for node in sorted(set(neighbourhood))]
+            bvars = [self._fire_var(node) for node in sorted(set(neighbourhood))]
             coeff = [1] * len(bvars)
             rows.append([bvars, coeff])
         senses = 'G' * len(rows)
@@ -74,79 +846,319 @@ class ILPEncoding(IdentifyingCodesInstance):
         return rows, senses, rhs, names
 
     def _one_step_uniqueness_constraint(self):
-        identity_constraints = set()
-        rows = []
-        for node in self._G.nodes():
-            # The 2-neighbourhood contains all neighbours at a distance of
-            # 1 or 2 from node.
-            neighbourhood = nx.ego_graph(self._G, node, 2).nodes()
-
-            for neighbour in neighbourhood:
-                pair = tuple(sorted([node, neighbour]))
-
-                # Check that this node pair doesn't already have a constraint.
-                # If it doesn't, create it.
-                if node is not neighbour and pair not in identity_constraints:
-                    # Get the complete 1-neighbourhood of each node in the pair
-                    # (such that the node itself is included)
-                    N0 = set(self._G.neighbors(pair[0])).union({pair[0]})
-                    N1 = set(self._G.neighbors(pair[1])).union({pair[1]})
-                    # Get the difference between the neighbourhoods:
-                    distinguishing_set = N0.symmetric_difference(N1)
-
-                    # Encode that at least one node in the distinguishing set
-                    # must have a colour injected / a sensor placed on it,
-                    # in order for the node's and the neighbour's signatures to
-                    # be different:
-                    bvars = ['x' + str(n) for n in sorted(distinguishing_set)]
-                    coeff = [1] * len(bvars)
-                    rows.append([bvars, coeff])
-                    identity_constraints.add(pair)
-        senses = 'G' * len(rows)
-        rhs = [1] * len(rows)
-        names = ['i' + str(i) for i in range(len(rows))]
-        return rows, senses, rhs, names
+        """
+        For each pair of nodes u < w at distance 1 or 2 from each other,
+        encode that at least one node in the symmetric difference of their
+        closed 1-neighbourhoods must have a colour injected / a sensor placed
+        on it, in order for their signatures to be different.
+        With C = A + I the closed-neighbourhood incidence matrix of the graph,
+        these pairs are the nonzeros above the diagonal of C^2, and the
+        distinguishing set of a pair is the XOR of rows u and w of C. Both are
+        computed with sparse matrix operations, in batches of pairs.
+        :return:    (number of rows, iterator over the batches of rows), see
+                    _one_step_uniqueness_batches.
+        """
+        n_nodes = self._G.number_of_nodes()
+        C = nx.to_scipy_sparse_array(self._G, nodelist=range(1, n_nodes + 1), dtype=np.int32, format='csr')
+        C = (C + identity(n_nodes, dtype=np.int32, format='csr')).tocsr()
+        # A self-loop (which the graph keeps) would make a diagonal entry 2,
+        # and then u would be in the difference of rows u and w even if it is
+        # in both closed neighbourhoods
+        C.data[:] = 1
+        pairs = triu(C @ C, k=1).tocoo()
+        order = np.lexsort((pairs.col, pairs.row))
+        us = pairs.row[order]
+        ws = pairs.col[order]
+        return len(us), self._one_step_uniqueness_batches(C, us, ws)
+
+    def _one_step_uniqueness_batches(self, C, us, ws):
+        """
+        Generate the uniqueness constraints of the pairs of nodes (us[i],
+        ws[i]) (0-based), ONE_STEP_BATCH_SIZE pairs at a time, such that only
+        one batch is in memory when they are streamed to the model file.
+        :param C:   Closed-neighbourhood incidence matrix (CSR).
+        :param us:  Array of the first nodes of the pairs.
+        :param ws:  Array of the second nodes of the pairs.
+        :return:    Generator of (rows, senses, rhs, names) batches.
+        """
+        for start in range(0, len(us), ONE_STEP_BATCH_SIZE):
+            # Row i of D is nonzero exactly on the symmetric difference of the
+            # closed neighbourhoods of the i-th pair in the batch
+            D = (C[us[start:start + ONE_STEP_BATCH_SIZE]] - C[ws[start:start + ONE_STEP_BATCH_SIZE]]).tocsr()
+            D.eliminate_zeros()
+            D.sort_indices()
+            indptr = D.indptr.tolist()
+            # Column node - 1 of C is the index of variable x_node
+            indices = D.indices.tolist()
+            rows = []
+            for row_start, row_end in zip(indptr[:-1], indptr[1:]):
+                bvars = indices[row_start:row_end]
+                rows.append([bvars, [1] * len(bvars)])
+            yield rows, 'G' * len(rows), [1] * len(rows), ['i' + str(i) for i in range(start, start + len(rows))]
 
     def _objective_function(self):
         return self._ilp_enc.sum(self._node_vars)
 
-    def encode_one_step(self, lp_file, k):
-        self._k = k
+    def _fire_var(self, node):
+        """
+        Index of the variable x_node in the model.
+        """
+        return node - 1
+
+    def _detection_var(self, node):
+        """
+        Index of the variable y_node in the model (two-step encoding only).
+        """
+        return self._G.number_of_nodes() + node - 1
+
+    def _presolve(self, var_names, var_types, objective, lbs, ubs, constraints):
+        """
+        Simplify a model before it is written or solved:
+        - a row with a single variable (e.g., a distinguishing set of size 1,
+          or an alo constraint) is replaced by a bound on that variable, which
+          for a distinguishing set of size 1 fixes the sensor;
+        - fixed variables are substituted into the right-hand sides;
+        - rows that are satisfied by the bounds alone are removed, which
+          includes all covering rows that contain a fixed sensor;
+        - duplicate rows are removed;
+        - covering rows (sum_{z in Z} x_z >= 1) that are supersets of other
+          covering rows are removed;
+        - the bounds of the integer variables in equality rows (the detection
+          variables y) are tightened to the range of the rest of the row.
+        The first steps are repeated until nothing changes. The fixed
+        variables stay in the model (with equal bounds), such that solutions
+        still contain them. The rows in each group are renumbered.
+        :param var_names:   See _write_model.
+        :param var_types:   See _write_model.
+        :param objective:   See _write_model.
+        :param lbs:         See _write_model.
+        :param ubs:         See _write_model.
+        :param constraints: See _write_model.
+        :return:    (model, header lines), where model is (var_names,
+                    var_types, objective, lbs, ubs, constraints).
+        """
+        lbs = list(lbs)
+        ubs = [math.inf if ub is None else ub for ub in ubs]
+        fixed_before = {idx for idx in range(len(var_names)) if lbs[idx] == ubs[idx]}
+        groups = [[[list(bvars), list(coeffs), sense, row_rhs]
+                   for (bvars, coeffs), sense, row_rhs in zip(rows, senses, rhs)]
+                  for rows, senses, rhs, _ in constraints]
+        n_rows_before = sum(len(group) for group in groups)
+        n_non_zeros_before = sum(len(row[0]) for group in groups for row in group)
+        n_removed = {'bound': 0, 'satisfied': 0, 'duplicate': 0, 'dominated': 0}
+
+        def tighten(idx, lb, ub):
+            """ Tighten the bounds of variable idx, return True if they changed. """
+            if var_types[idx] in 'BI':
+                lb = math.ceil(lb - 1e-9)
+                ub = math.floor(ub + 1e-9)
+            changed = False
+            if lb > lbs[idx]:
+                lbs[idx] = lb
+                changed = True
+            if ub < ubs[idx]:
+                ubs[idx] = ub
+                changed = True
+            return changed
+
+        changed = True
+        while changed:
+            changed = False
+            for group in groups:
+                kept = []
+                for bvars, coeffs, sense, row_rhs in group:
+                    # Substitute the fixed variables
+                    if any(lbs[idx] == ubs[idx] for idx in bvars):
+                        row_rhs -= sum(coeff * lbs[idx] for idx, coeff in zip(bvars, coeffs)
+                                       if lbs[idx] == ubs[idx])
+                        bvars, coeffs = [idx for idx in bvars if lbs[idx] != ubs[idx]], \
+                            [coeff for idx, coeff in zip(bvars, coeffs) if lbs[idx] != ubs[idx]]
+                    min_activity, max_activity = _row_activity_range(bvars, coeffs, lbs, ubs)
+                    if (sense in 'GE' and min_activity < row_rhs) or (sense in 'LE' and max_activity > row_rhs):
+                        if len(bvars) == 1:
+                            # Replace the row by a bound
+                            bound = row_rhs / coeffs[0]
+                            if (sense == 'G') == (coeffs[0] > 0) or sense == 'E':
+                                changed |= tighten(bvars[0], bound, ubs[bvars[0]])
+                            if (sense == 'L') == (coeffs[0] > 0) or sense == 'E':
+                                changed |= tighten(bvars[0], lbs[bvars[0]], bound)
+                            n_removed['bound'] += 1
+                        else:
+                            kept.append([bvars, coeffs, sense, row_rhs])
+                    elif min_activity <= row_rhs <= max_activity or sense != 'E':
+                        n_removed['satisfied'] += 1
+                    else:
+                        # Infeasible row, which is left to the solver to report
+                        kept.append([bvars, coeffs, sense, row_rhs])
+                group[:] = kept
+
+        # Remove duplicate rows, and covering rows that are supersets of other
+        # covering rows
+        def is_covering(row):
+            return row[2] == 'G' and row[3] == 1 and all(coeff == 1 for coeff in row[1]) \
+                and all(var_types[idx] in 'BI' and lbs[idx] == 0 and ubs[idx] == 1 for idx in row[0])
+        covering_sets = DistinguishingSets(remove_supersets=True)
+        for group in groups:
+            for row in group:
+                if is_covering(row):
+                    covering_sets.add(nodes_2_bitset(row[0]))
+        minimal_sets = {tuple(ds_sig) for ds_sig in covering_sets.get_sets()}
+        seen_rows = set()
+        for group in groups:
+            kept = []
+            for row in group:
+                row_key = (tuple(sorted(zip(row[0], row[1]))), row[2], row[3])
+                if row_key in seen_rows:
+                    n_removed['duplicate'] += 1
+                elif is_covering(row) and tuple(sorted(row[0])) not in minimal_sets:
+                    n_removed['dominated'] += 1
+                else:
+                    seen_rows.add(row_key)
+                    kept.append(row)
+            group[:] = kept
+
+        # Tighten the bounds of integer variables in equality rows
+        n_tightened = 0
+        for group in groups:
+            for bvars, coeffs, sense, row_rhs in group:
+                if sense != 'E':
+                    continue
+                min_activity, max_activity = _row_activity_range(bvars, coeffs, lbs, ubs)
+                for idx, coeff in zip(bvars, coeffs):
+                    if var_types[idx] != 'I':
+                        continue
+                    # coeff * x = row_rhs - (rest of the row)
+                    own_min, own_max = _row_activity_range([idx], [coeff], lbs, ubs)
+                    rest_min = min_activity - own_min
+                    rest_max = max_activity - own_max
+                    bounds = sorted([(row_rhs - rest_max) / coeff, (row_rhs - rest_min) / coeff])
+                    if tighten(idx, bounds[0], bounds[1]):
+                        n_tightened += 1
+
+        new_constraints = []
+        for group, (_, _, _, names) in zip(groups, constraints):
+            prefix = names[0].rstrip('0123456789') if len(names) > 0 else ''
+            new_constraints.append(([[bvars, coeffs] for bvars, coeffs, _, _ in group],
+                                    ''.join(row[2] for row in group),
+                                    [row[3] for row in group],
+                                    [prefix + str(i) for i in range(len(group))]))
+        n_rows = sum(len(group) for group in groups)
+        n_non_zeros = sum(len(row[0]) for group in groups for row in group)
+        fixed = [idx for idx in range(len(var_names)) if lbs[idx] == ubs[idx] and idx not in fixed_before]
+        log_message("{classname}: Presolve fixed {n_f} variables and removed {n_r} of {n_rows} rows.".format(
+            classname=self.__class__.__name__, n_f=len(fixed), n_r=n_rows_before - n_rows, n_rows=n_rows_before))
+
+        presolve_info = [
+            'Fixed variables:   {n}'.format(n=len(fixed)),
+        ]
+        fixings = ['{name}={value}'.format(name=var_names[idx], value=lbs[idx]) for idx in fixed]
+        for start in range(0, len(fixings), 10):
+            presolve_info.append('    ' + ' '.join(fixings[start:start + 10]))
+        presolve_info += [
+            'Rows removed:      {n} of {n_rows} ({b} became bounds, {s} satisfied, {d} duplicate, {m} dominated)'.format(
+                n=n_rows_before - n_rows, n_rows=n_rows_before, b=n_removed['bound'], s=n_removed['satisfied'],
+                d=n_removed['duplicate'], m=n_removed['dominated']),
+            'Bounds tightened:  {n}'.format(n=n_tightened),
+            'Nonzeros:          {before} -> {after}'.format(before=n_non_zeros_before, after=n_non_zeros),
+        ]
+        ubs = [None if ub == math.inf else ub for ub in ubs]
+        return (var_names, var_types, objective, lbs, ubs, new_constraints), presolve_info
+
+    def _write_model(self, lp_file, header, var_names, var_types, objective, lbs, ubs, constraints,
+                     ilp_writer='native'):
+        """
+        Write the model to lp_file, with the header as comments at the top.
+        :param lp_file:     Path to the model file (.lp or .mps, optionally
+                            gzipped).
+        :param header:      List of header lines.
+        :param var_names:   List of variable names. The constraints refer to
+                            the variables by their index in this list.
+        :param var_types:   String with a CPLEX type ('B', 'I' or 'C') per
+                            variable.
+        :param objective:   List of objective coefficients (minimised).
+        :param lbs:         List of lower bounds.
+        :param ubs:         List of upper bounds.
+        :param constraints: List of groups of constraints, each a (rows,
+                            senses, rhs, names) tuple, or an iterator over
+                            such tuples (batches), which are then generated
+                            while the model is written.
+        :param ilp_writer:  'native' to stream the model to the file directly,
+                            'cplex' to build a CPLEX model and let CPLEX write
+                            it (uncompressed).
+        :return:            None
+        """
+        if ilp_writer == 'native':
+            with open_model_writer(lp_file, var_names, var_types, objective, lbs, ubs,
+                                   header=header) as writer:
+                for group in constraints:
+                    for rows, senses, rhs, names in _constraint_batches(group):
+                        writer.add_constraints(rows, senses, rhs, names)
+            log_message("{classname}: Wrote model to file {lp_file}".format(
+                classname=self.__class__.__name__, lp_file=lp_file))
+            return
+
+        assert ilp_writer == 'cplex', "Unknown ILP writer: {w}".format(w=ilp_writer)
+        assert cplex is not None, "The cplex writer requires the CPLEX Python API."
         self._ilp_enc = cplex.Cplex()
+        log_message("{classname}: Initialised CPLEX".format(classname=self.__class__.__name__))
+        self._ilp_enc.variables.add(obj=objective, lb=lbs, ub=ubs, names=var_names, types=var_types)
+        for group in constraints:
+            for rows, senses, rhs, names in _constraint_batches(group):
+                self._ilp_enc.linear_constraints.add(lin_expr=rows, senses=senses, rhs=rhs, names=names)
+        log_message("{classname}: Added constraints to model.".format(classname=self.__class__.__name__))
+
+        # Write model to file
+        if lp_file.endswith('.gz'):
+            lp_file = lp_file[:-3]
+        self._ilp_enc.write(lp_file)
+        log_message("{classname}: Wrote model to file {lp_file}".format(
+            classname=self.__class__.__name__, lp_file=lp_file))
+
+        # Add header to the top of the model file
+        comment = '* ' if lp_file.endswith('.mps') else '\\ '
+        prepend_multiple_lines(lp_file, [comment + line for line in header])
+        log_message("{classname}: Prepended header to model file.".format(classname=self.__class__.__name__))
 
+    def _one_step_model(self, stream=False):
+        """
+        Generate the variables and constraints of the one-step encoding.
+        :param stream:  True if the uniqueness constraints should be generated
+                        in batches as the model is written, rather than all
+                        at once (see _write_model).
+        :return:    (var_names, var_types, objective, lbs, ubs, constraints),
+                    see _write_model.
+        """
         # Define variables and their bounds
-        varnames = ['x' + str(node) for node in self._G.nodes()]
-        vartypes = [self._ilp_enc.variables.type.binary] * len(varnames)
+        varnames = ['x' + str(node) for node in range(1, self._G.number_of_nodes() + 1)]
+        vartypes = 'B' * len(varnames)
         obj_coeff = [1] * len(varnames)
         lbs = [0] * len(varnames)
         ubs = [1] * len(varnames)
-        self._ilp_enc.variables.add(obj=obj_coeff, lb=lbs, ub=ubs, names=varnames, types=vartypes)
         self._node_vars = varnames
         self._n_vars = len(varnames)
 
         d_rows, d_senses, d_rhs, d_names = self._one_step_detection_constraint()
-        i_rows, i_senses, i_rhs, i_names = self._one_step_uniqueness_constraint()
+        n_i_rows, i_batches = self._one_step_uniqueness_constraint()
+        self._n_csts = len(d_rows) + n_i_rows
 
-        rows = d_rows + i_rows
-        senses = d_senses + i_senses
-        rhs = d_rhs + i_rhs
-        names = d_names + i_names
+        return (varnames, vartypes, obj_coeff, lbs, ubs,
+                [(d_rows, d_senses, d_rhs, d_names),
+                 i_batches if stream else _join_batches(i_batches)])
 
-        self._ilp_enc.linear_constraints.add(lin_expr=rows, senses=senses,
-                                             rhs=rhs, names=names)
-        self._n_csts = len(rows)
-
-        # Write model to file
-        if lp_file.endswith('.lp.gz'):
-            lp_file = lp_file[:-3]
-        self._ilp_enc.write(lp_file)
+    def encode_one_step(self, lp_file, k, ilp_writer='native', presolve=False, warm_start=False):
+        self._k = k
+        # Presolve and the warm start need all constraints at once
+        model = self._one_step_model(stream=not (presolve or warm_start))
+        presolve_info = None
+        if presolve:
+            model, presolve_info = self._presolve(*model)
+        if warm_start:
+            model = self._warm_start_model(lp_file, k, model)
 
         # Get header
-        header = self._get_header(encoding="ILP", k=k)
-        lines = ['\ ' + line for line in header]
+        header = self._get_header(encoding="ILP", k=k, presolve_info=presolve_info)
 
-        # Add header to the top of the model file
-        prepend_multiple_lines(lp_file, lines)
+        self._write_model(lp_file, header, *model, ilp_writer=ilp_writer)
 
     def _two_step_detection_constraint(self):
         """
@@ -159,7 +1171,7 @@ class ILPEncoding(IdentifyingCodesInstance):
         rows = []
         for node in self._G.nodes():
             neighbourhood = nx.ego_graph(self._G, node, radius=1, center=True).nodes()
-            bvars = ['y' + str(node)] + ['x' + str(node) for node in sorted(set(neighbourhood))]
+            bvars = [self._detection_var(node)] + [self._fire_var(node) for node in sorted(set(neighbourhood))]
             coeff = [1] + [-1] * len(neighbourhood)
             rows.append([bvars, coeff])
         senses = 'E' * len(rows)
@@ -174,7 +1186,7 @@ class ILPEncoding(IdentifyingCodesInstance):
             y_v >= 1
         :return:
         """
-        bvars_list = ['y' + str(node) for node in self._G.nodes()]
+        bvars_list = [self._detection_var(node) for node in self._G.nodes()]
         coeff_list = [1] * self._G.number_of_nodes()
         rows = [[[bvars], [coeff]] for bvars, coeff in zip(bvars_list, coeff_list)]
         senses = 'G' * len(rows)
@@ -184,34 +1196,680 @@ class ILPEncoding(IdentifyingCodesInstance):
 
     def _get_set_neighbourhood(self, the_set, distance, closed=False):
         """
-
-        :param the_set:
-        :param distance:
-        :param closed:
-        :return:
+        Get the neighbourhood of a set of nodes, as a bitset (see
+        nodes_2_bitset). For distances 1, 2 and 4, the neighbourhood is the
+        union of the precomputed neighbourhoods of the nodes in the set.
+        :param the_set:     Iterable of nodes.
+        :param distance:    Radius of the neighbourhood.
+        :param closed:      True if the nodes in the_set are to be included.
+        :return:            int
         """
-        the_neighbourhood = set()
-        if distance == 1:
-            for node in the_set:
-                the_neighbourhood = the_neighbourhood.union(self._1_neighbourhoods[node])
-            if closed:
-                the_neighbourhood = the_neighbourhood.union(the_set)
-        elif distance == 2:
-            assert len(self._2_neighbourhoods) > 0
+        the_neighbourhood = 0
+        if distance in [1, 2, 4]:
+            neighbourhood_index = self._neighbourhood_index[distance]
+            assert len(neighbourhood_index) > 0
             for node in the_set:
-                the_neighbourhood = the_neighbourhood.union(self._2_neighbourhoods[node])
-            if closed:
-                the_neighbourhood = the_neighbourhood.union(the_set)
+                the_neighbourhood |= neighbourhood_index[node]
         else:
             for node in the_set:
-                neighbourhood = nx.ego_graph(self._G, node, radius=distance, center=closed).nodes()
-                the_neighbourhood = the_neighbourhood.union(neighbourhood)
+                neighbourhood = nx.ego_graph(self._G, node, radius=distance, center=False).nodes()
+                the_neighbourhood |= nodes_2_bitset(neighbourhood)
+        if closed:
+            the_neighbourhood |= nodes_2_bitset(the_set)
         return the_neighbourhood
 
+    def _build_neighbourhood_index(self, check_2_neighbourhood=False):
+        """
+        Precompute the (open) 1-neighbourhood of each node, as a bitset. If
+        check_2_neighbourhood is True, also precompute the (open)
+        2-neighbourhood and 4-neighbourhood of each node. Two sets U and W
+        have intersecting closed 2-neighbourhoods iff W contains a node in the
+        closed 4-neighbourhood of U.
+        :param check_2_neighbourhood:   True if the 2- and 4-neighbourhoods are
+                                        needed.
+        :return:    None
+        """
+        self._neighbourhood_index = {1: dict(), 2: dict(), 4: dict()}
+        self._neighbourhood_index[1] = {
+            node: nodes_2_bitset(self._G.neighbors(node))
+            for node in self._G.nodes()
+        }
+        if check_2_neighbourhood:
+            # The 2-neighbourhood of a node is the union of the
+            # 1-neighbourhoods of its neighbours, and the 4-neighbourhood is
+            # the union of the 2-neighbourhoods of the nodes in its 2-neighbourhood.
+            for distance in [2, 4]:
+                half_distance = distance // 2
+                for node in self._G.nodes():
+                    N_node = self._get_set_neighbourhood([node], half_distance, closed=True)
+                    N_node = self._get_set_neighbourhood(bitset_2_nodes(N_node), half_distance)
+                    self._neighbourhood_index[distance][node] = N_node & ~(1 << node)
+
+    def _combinations_meeting(self, the_nodes, size):
+        """
+        Generate all sets of nodes of cardinality size that contain at least
+        one node from the_nodes, each exactly once. Each such set is generated
+        from its smallest node v in the_nodes: the nodes smaller than v are all
+        taken from outside the_nodes, the nodes larger than v can be any node.
+        :param the_nodes:   List of nodes, sorted in increasing order.
+        :param size:        Cardinality of the sets to generate.
+        :return:            Generator of tuples of nodes, sorted in increasing
+                            order.
+        """
+        if size == 1:
+            for node in the_nodes:
+                yield (node,)
+            return
+        n_nodes = self._G.number_of_nodes()
+        outside = []    # nodes smaller than the current node, not in the_nodes
+        previous = 0
+        for node in the_nodes:
+            outside.extend(range(previous + 1, node))
+            after = range(node + 1, n_nodes + 1)
+            for n_before in range(min(size - 1, len(outside)) + 1):
+                for before in combinations(outside, n_before):
+                    for rest in combinations(after, size - 1 - n_before):
+                        yield before + (node,) + rest
+            previous = node
+
+    def _uniqueness_partners(self, U, k, check_2_neighbourhood=False, min_k=1):
+        """
+        Generate the sets W, with |W| <= k, from which set U must be
+        distinguished. Since the distinguishing set of (U, W) is the same as
+        that of (W, U), we only generate the sets W with |W| > |U|, or with
+        |W| == |U| and W > U, such that each unordered pair {U, W} is generated
+        exactly once. Since |W| >= |U|, the pair {U, W} belongs to layer |W|
+        of a sweep over k, and we only generate the sets W with |W| >= min_k.
+        If check_2_neighbourhood is True, we only generate the sets W whose
+        closed 2-neighbourhood intersects the closed 2-neighbourhood of U,
+        i.e., the sets W that contain a node in the closed 4-neighbourhood of U.
+        We generate those directly, rather than generating all sets W and
+        discarding the ones that are too far away from U.
+        :param U:   Tuple of nodes, sorted in increasing order.
+        :param k:   Maximum identifiable set size.
+        :param check_2_neighbourhood:   True if only sets W in the vicinity of U
+                                        should be generated.
+        :param min_k:   Minimum cardinality of the sets W.
+        :return:    Generator of tuples of nodes, sorted in increasing order.
+        """
+        n_nodes = self._G.number_of_nodes()
+        U_size = len(U)
+        if check_2_neighbourhood:
+            N4_U = bitset_2_nodes(self._get_set_neighbourhood(U, 4, closed=True))
+        for W_size in range(max(U_size, min_k), k + 1):
+            if check_2_neighbourhood:
+                Ws = self._combinations_meeting(N4_U, W_size)
+            else:
+                Ws = combinations(range(1, n_nodes + 1), W_size)
+            for W in Ws:
+                if W_size == U_size and W <= U:
+                    continue
+                yield W
+
+    def _uniqueness_shard(self, first_nodes, k, remove_supersets=True, check_2_neighbourhood=True,
+                          ds_sets=None, min_k=1):
+        """
+        Generate the distinguishing sets for all pairs (U, W) for which the
+        smallest node in U is in first_nodes, and max(|U|, |W|) >= min_k. See
+        _two_step_uniqueness_constraint. Assumes that the neighbourhood index
+        has been built.
+        :param first_nodes:     List of nodes.
+        :param k:               Maximum identifiable set size.
+        :param min_k:           Smallest layer of pairs to generate.
+        :param remove_supersets:        See _two_step_uniqueness_constraint.
+        :param check_2_neighbourhood:   See _two_step_uniqueness_constraint.
+        :param ds_sets:         DistinguishingSets to add the sets to. If None,
+                                a new collection is created.
+        :return:                DistinguishingSets
+        """
+        if ds_sets is None:
+            ds_sets = DistinguishingSets(remove_supersets=remove_supersets)
+        n_nodes = self._G.number_of_nodes()
+        N1_index = self._neighbourhood_index[1]
+        N1_U_prefixes = PrefixUnion(N1_index)
+        N1_W_prefixes = PrefixUnion(N1_index)
+
+        # All sets and neighbourhoods below are bitsets (see nodes_2_bitset),
+        # such that symmetric differences and unions are XORs and ORs on ints.
+        # Iterate over all possible cardinalities of set U
+        for U_size in range(1, k + 1):
+            # Generate all sets U of cardinality U_size
+            for first_node in first_nodes:
+                for other_nodes in combinations(range(first_node + 1, n_nodes + 1), U_size - 1):
+                    U = (first_node,) + other_nodes
+                    U_bits = nodes_2_bitset(U)
+                    # 1-neighbourhood of set U (works for both closed and not closed)
+                    # NOTE: 15 oct 2022: I can't remember why it should work for both, changing to closed.
+                    # NOTE: 15 oct 2022: I think I made a mistake earlier, we need
+                    # (U triangle W) cup (N_1(U) triangle N_1(W))
+                    # The neighbourhood indeed can be either closed or not, doesn't matter.
+                    N1_U = N1_U_prefixes.union(U)
+
+                    # Generate the sets W that U must be distinguished from. Each
+                    # unordered pair {U, W} is generated only once, and if
+                    # check_2_neighbourhood is set, only those W are generated
+                    # whose closed 2-neighbourhood intersects that of U.
+                    for W in self._uniqueness_partners(U, k, check_2_neighbourhood=check_2_neighbourhood,
+                                                       min_k=min_k):
+                        # Determine the distinguishing set for the first element
+                        # of the signature:
+                        # ds_sig0 = set(U).union(set(W)) # NOTE: 15 oct 202: I think this line is wrong. I think it should be symmetric difference. Changing it now
+                        ds_sig0 = U_bits ^ nodes_2_bitset(W)
+
+                        # Get the neighbourhoods for set W
+                        # 1-neighbourhood of set W (works for both closed and not closed)
+                        N1_W = N1_W_prefixes.union(W)
+
+                        # Determine the distinguishing set of the second element
+                        # of the signature:
+                        ds_sig1 = N1_U ^ N1_W
+
+                        # Determine the entire distinguishing set for this
+                        # (U, W) pair, and add it to the distinguishing sets
+                        # that will be constraints. If remove_supersets is
+                        # True, this avoids adding a distinguishing set that is
+                        # a superset of a distinguishing set that we already
+                        # have.
+                        ds_sets.add(ds_sig0 | ds_sig1)
+        return ds_sets
+
+    def _uniqueness_partner_counts(self, U, k, N4_U=None):
+        """
+        Count the sets W generated by _uniqueness_partners for U, for each
+        cardinality of W. For |W| == |U|, half of the sets (other than U) are
+        counted, as an approximation of the number of sets W > U.
+        :param U:       Tuple of nodes.
+        :param k:       Maximum identifiable set size.
+        :param N4_U:    List of nodes in the closed 4-neighbourhood of U, if W
+                        must contain one of them.
+        :return:        (list of cardinalities, list of counts)
+        """
+        n_nodes = self._G.number_of_nodes()
+        W_sizes = list(range(len(U), k + 1))
+        W_counts = []
+        for W_size in W_sizes:
+            n_Ws = math.comb(n_nodes, W_size)
+            if N4_U is not None:
+                n_Ws -= math.comb(n_nodes - len(N4_U), W_size)
+            if W_size == len(U):
+                n_Ws = (n_Ws - 1) / 2
+            W_counts.append(n_Ws)
+        return W_sizes, W_counts
+
+    def _sample_uniqueness_partner(self, rng, U, W_sizes, W_counts, N4_U=None):
+        """
+        Draw a set W uniformly from the sets counted by
+        _uniqueness_partner_counts (ignoring the order of U and W if they have
+        the same cardinality).
+        :param rng:         random.Random
+        :param U:           Tuple of nodes.
+        :param W_sizes:     See _uniqueness_partner_counts.
+        :param W_counts:    See _uniqueness_partner_counts.
+        :param N4_U:        See _uniqueness_partner_counts.
+        :return:            Tuple of nodes, sorted in increasing order.
+        """
+        n_nodes = self._G.number_of_nodes()
+        nodes = range(1, n_nodes + 1)
+        while True:
+            W_size = rng.choices(W_sizes, weights=W_counts)[0]
+            if N4_U is None:
+                W = tuple(sorted(rng.sample(nodes, W_size)))
+            else:
+                # Choose the number of nodes that W has in N4_U (at least one),
+                # then choose those nodes, and the other nodes of W.
+                n_near = len(N4_U)
+                n_far = n_nodes - n_near
+                n_ins = list(range(1, min(W_size, n_near) + 1))
+                n_in = rng.choices(n_ins, weights=[math.comb(n_near, n_in) * math.comb(n_far, W_size - n_in)
+                                                   for n_in in n_ins])[0]
+                near = set(N4_U)
+                W = set(rng.sample(N4_U, n_in))
+                while len(W) < W_size:
+                    node = rng.choice(nodes)
+                    if node not in near:
+                        W.add(node)
+                W = tuple(sorted(W))
+            if W != U:
+                return W
+
+    def _reference_uniqueness_matches(self, ds, k, N2_nodes):
+        """
+        Compare a distinguishing set with the distinguishing sets of the
+        reference pairs: the pairs ({u}, {w}), and (if k > 1) the pairs ({u},
+        {u, w}), with w in the 2-neighbourhood of u. These distinguishing sets
+        are small, and most others are a superset of one of them. Since they
+        contain w (and u, for the first kind), only the reference pairs with
+        those nodes in ds need to be checked. Assumes that the neighbourhood
+        index has been built with check_2_neighbourhood.
+        :param ds:  Distinguishing set, as a bitset.
+        :param k:   Maximum identifiable set size.
+        :param N2_nodes:    Dictionary in which the nodes in the
+                            2-neighbourhood of each node are cached.
+        :return:    (True if the distinguishing set of a reference pair is a
+                    strict subset of ds, number of reference pairs with
+                    distinguishing set ds)
+        """
+        N1_index = self._neighbourhood_index[1]
+        N2_index = self._neighbourhood_index[2]
+        n_equal = 0
+        for w in bitset_2_nodes(ds):
+            N1_w = N1_index[w]
+            if w not in N2_nodes:
+                N2_nodes[w] = bitset_2_nodes(N2_index[w])
+            for u in N2_nodes[w]:
+                ref_sets = []
+                if u < w and ds >> u & 1:
+                    ref_sets.append((1 << u) | (1 << w) | (N1_index[u] ^ N1_w))
+                if k > 1:
+                    ref_sets.append((1 << w) | (N1_w & ~N1_index[u]))
+                for ref_set in ref_sets:
+                    if ref_set == ds:
+                        n_equal += 1
+                    elif ref_set & ~ds == 0:
+                        return True, n_equal
+        return False, n_equal
+
+    def estimate_two_step_uniqueness(self, k, n_samples=ESTIMATOR_N_SAMPLES, seed=0):
+        """
+        Estimate the number of two-step uniqueness constraints for k, their
+        number of nonzeros, and the peak memory and time needed to generate
+        them (with a single worker), for each combination of remove_supersets
+        and check_2_neighbourhood (see _two_step_uniqueness_constraint).
+
+        The number of pairs (U, W) is counted for a sample of the sets U of
+        each cardinality, and pairs are then sampled uniformly by drawing U in
+        proportion to its number of partners W. Without remove_supersets,
+        each sampled pair counts for the fraction of the pairs with the same
+        distinguishing set that can be recognised from the pair itself. With
+        remove_supersets, the minimal distinguishing sets mostly come from
+        the reference pairs (see _reference_uniqueness_matches), which are
+        sampled separately, and the other sampled pairs only count if their
+        distinguishing set is not a superset of that of a reference pair. Both
+        estimates are on the high side. If there are at most n_samples pairs,
+        all pairs are used, and the numbers of constraints and nonzeros are
+        exact.
+        :param k:           Maximum identifiable set size.
+        :param n_samples:   Number of sets U of each cardinality, and of pairs
+                            (U, W), to sample.
+        :param seed:        Seed for the random number generator.
+        :return:            Dictionary mapping (remove_supersets,
+                            check_2_neighbourhood) to a dictionary with the
+                            estimated n_rows, n_non_zeros, peak_memory (in
+                            bytes) and generation_time (in seconds).
+        """
+        n_nodes = self._G.number_of_nodes()
+        rng = random.Random(seed)
+        start = time.time()
+        self._build_neighbourhood_index(check_2_neighbourhood=True)
+        index_time = time.time() - start
+        # Memory used before any constraints are generated (ru_maxrss is in KiB)
+        base_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        N1_index = self._neighbourhood_index[1]
+        N2_index = self._neighbourhood_index[2]
+
+        def distinguishing_set(U, W):
+            return (nodes_2_bitset(U) ^ nodes_2_bitset(W)) | \
+                (self._get_set_neighbourhood(U, 1) ^ self._get_set_neighbourhood(W, 1))
+
+        def n_splits(U, W, ds, check_2_neighbourhood):
+            # Number of (unordered) pairs that are generated for k, with the
+            # same nodes in common and the same nodes in total as U and W,
+            # and with distinguishing set ds. If U and W have no nodes in
+            # common, for example, and the neighbourhoods of their nodes are
+            # disjoint, then all ways to split their nodes give ds.
+            common = sorted(set(U) & set(W))
+            rest = sorted(set(U) ^ set(W))
+            count = 0
+            for n_others in range(len(rest)):
+                for others in combinations(rest[1:], n_others):
+                    U_split = sorted(common + [rest[0]] + list(others))
+                    W_split = sorted(common + [node for node in rest[1:] if node not in others])
+                    if not W_split or max(len(U_split), len(W_split)) > k:
+                        continue
+                    if check_2_neighbourhood and \
+                            not self._get_set_neighbourhood(U_split, 4, closed=True) & nodes_2_bitset(W_split):
+                        continue
+                    if distinguishing_set(U_split, W_split) == ds:
+                        count += 1
+            return max(count, 1)
+
+        def is_reducible(U, W, ds):
+            # If leaving out a node that U and W have in common does not
+            # change the distinguishing set, the pair has the same
+            # distinguishing set as a smaller pair.
+            return any(len(U) > 1 and ds == distinguishing_set(tuple(u for u in U if u != node),
+                                                              tuple(w for w in W if w != node))
+                       for node in set(U) & set(W))
+
+        def is_reference_pair(U, W):
+            others = [w for w in W if w not in U]
+            return len(U) == 1 and len(W) <= 2 and len(others) == 1 and bool(N2_index[U[0]] >> others[0] & 1)
+
+        # Sample the reference pairs, which are generated in all
+        # configurations, and keep the distinguishing sets that are not a
+        # superset of that of another reference pair. Each set is weighted by
+        # the number of pairs it represents, divided by the number of
+        # reference pairs that have that same distinguishing set.
+        N2_nodes = dict()
+        N2_sizes = [bin(N2_index[u]).count('1') for u in range(1, n_nodes + 1)]
+        n_ordered = sum(N2_sizes)
+        if n_ordered <= n_samples:
+            ordered_pairs = [(u, w) for u in range(1, n_nodes + 1) for w in bitset_2_nodes(N2_index[u])]
+        else:
+            ordered_pairs = [(u, rng.choice(bitset_2_nodes(N2_index[u])))
+                             for u in rng.choices(range(1, n_nodes + 1), weights=N2_sizes, k=n_samples)]
+        ref_strata = [(n_ordered / 2, lambda u, w: ((min(u, w),), (max(u, w),)))]
+        if k > 1:
+            ref_strata.append((n_ordered, lambda u, w: ((u,), tuple(sorted((u, w))))))
+        ref_minimal = []
+        for n_stratum, reference_pair in ref_strata:
+            for u, w in ordered_pairs:
+                ds = distinguishing_set(*reference_pair(u, w))
+                dominated, n_equal = self._reference_uniqueness_matches(ds, k, N2_nodes)
+                if not dominated:
+                    ref_minimal.append((ds, n_stratum / len(ordered_pairs) / n_equal))
+
+        estimates = dict()
+        for check_2_neighbourhood in [False, True]:
+            # Sample the sets U of each cardinality, weighted by the number of
+            # sets U they represent times their number of partners W.
+            Us = []
+            U_weights = []
+            for U_size in range(1, k + 1):
+                n_Us = math.comb(n_nodes, U_size)
+                if n_Us <= n_samples:
+                    size_Us = list(combinations(range(1, n_nodes + 1), U_size))
+                else:
+                    size_Us = [tuple(sorted(rng.sample(range(1, n_nodes + 1), U_size))) for _ in range(n_samples)]
+                for U in size_Us:
+                    N4_U = None
+                    if check_2_neighbourhood:
+                        N4_U = bitset_2_nodes(self._get_set_neighbourhood(U, 4, closed=True))
+                    W_sizes, W_counts = self._uniqueness_partner_counts(U, k, N4_U)
+                    Us.append((U, N4_U, W_sizes, W_counts))
+                    U_weights.append(n_Us / len(size_Us) * sum(W_counts))
+            n_pairs = sum(U_weights)
+
+            # Time the generation of the distinguishing sets for the first
+            # sampled sets U, as _uniqueness_shard does it.
+            N1_U_prefixes = PrefixUnion(N1_index)
+            N1_W_prefixes = PrefixUnion(N1_index)
+            ds_sets = DistinguishingSets(remove_supersets=False)
+            n_timed = 0
+            start = time.perf_counter()
+            for U, _, _, _ in Us:
+                U_bits = nodes_2_bitset(U)
+                N1_U = N1_U_prefixes.union(U)
+                for W in self._uniqueness_partners(U, k, check_2_neighbourhood=check_2_neighbourhood):
+                    ds_sets.add((U_bits ^ nodes_2_bitset(W)) | (N1_U ^ N1_W_prefixes.union(W)))
+                    n_timed += 1
+                    if n_timed >= n_samples or time.perf_counter() - start > ESTIMATOR_TIMING_BUDGET:
+                        break
+                if n_timed >= n_samples or time.perf_counter() - start > ESTIMATOR_TIMING_BUDGET:
+                    break
+            pair_time = (time.perf_counter() - start) / max(n_timed, 1)
+
+            # Take all pairs (U, W) if there are few, or sample them
+            exact = n_pairs <= n_samples
+            if exact:
+                pairs = [(U, W)
+                         for U_size in range(1, k + 1)
+                         for U in combinations(range(1, n_nodes + 1), U_size)
+                         for W in self._uniqueness_partners(U, k, check_2_neighbourhood=check_2_neighbourhood)]
+                n_pairs = len(pairs)
+            elif n_pairs > 0:
+                pairs = [(U, self._sample_uniqueness_partner(rng, U, W_sizes, W_counts, N4_U))
+                         for U, N4_U, W_sizes, W_counts in rng.choices(Us, weights=U_weights, k=n_samples)]
+            else:
+                pairs = []
+            ds_sample = [distinguishing_set(U, W) for U, W in pairs]
+
+            if exact:
+                distinct = [(ds, 1) for ds in set(ds_sample)]
+                ds_sets = DistinguishingSets(remove_supersets=True)
+                for ds in ds_sample:
+                    ds_sets.add(ds)
+                minimal = [(nodes_2_bitset(ds_sig), 1) for ds_sig in ds_sets.get_sets()]
+            else:
+                # Without remove_supersets, only the irreducible pairs count,
+                # each for the fraction of the ways to split its nodes that
+                # give the same distinguishing set.
+                scale = n_pairs / len(pairs)
+                irreducible = [(U, W, ds, scale / n_splits(U, W, ds, check_2_neighbourhood))
+                               for (U, W), ds in zip(pairs, ds_sample) if not is_reducible(U, W, ds)]
+                distinct = [(ds, weight) for _, _, ds, weight in irreducible]
+
+                # With remove_supersets, the reference pairs are counted
+                # separately, and the other pairs only count if their
+                # distinguishing set is not a superset of (or equal to) that
+                # of a reference pair. Of both, only the sets that are minimal
+                # in the sample are kept.
+                minimal = list(ref_minimal)
+                for U, W, ds, weight in irreducible:
+                    if not is_reference_pair(U, W):
+                        dominated, n_equal = self._reference_uniqueness_matches(ds, k, N2_nodes)
+                        if not dominated and n_equal == 0:
+                            minimal.append((ds, weight))
+                ds_sets = DistinguishingSets(remove_supersets=True)
+                ds_sets.merge(bitset_2_nodes(ds) for ds, _ in minimal)
+                minimal_bitsets = set(nodes_2_bitset(ds_sig) for ds_sig in ds_sets.get_sets())
+                minimal = [(ds, weight) for ds, weight in minimal if ds in minimal_bitsets]
+
+            for remove_supersets, weighted_sets in [(False, distinct), (True, minimal)]:
+                n_rows = min(sum(weight for _, weight in weighted_sets), n_pairs)
+                n_non_zeros = sum(weight * bin(ds).count('1') for ds, weight in weighted_sets)
+                if check_2_neighbourhood and not remove_supersets:
+                    # The pairs are a subset of those without
+                    # check_2_neighbourhood, so they have fewer distinct sets
+                    n_rows = min(n_rows, estimates[(False, False)]['n_rows'])
+                    n_non_zeros = min(n_non_zeros, estimates[(False, False)]['n_non_zeros'])
+                ds_bitsets = set(ds for ds, _ in weighted_sets)
+
+                # Time the addition of the sampled sets to a collection that
+                # (with remove_supersets) already holds small sets, and the
+                # decoding of the sets into rows
+                ds_sets = DistinguishingSets(remove_supersets=remove_supersets)
+                if remove_supersets:
+                    ds_sets.merge(bitset_2_nodes(ds) for ds, _ in ref_minimal)
+                n_timed = 0
+                start = time.perf_counter()
+                for ds in ds_sample:
+                    ds_sets.add(ds)
+                    n_timed += 1
+                    if time.perf_counter() - start > ESTIMATOR_TIMING_BUDGET:
+                        break
+                add_time = (time.perf_counter() - start) / max(n_timed, 1)
+                start = time.perf_counter()
+                rows = [[[self._fire_var(node) for node in ds_sig], [1] * len(ds_sig)]
+                        for ds_sig in ds_sets.get_sets()]
+                row_time = (time.perf_counter() - start) / max(len(rows), 1)
+                del rows
+
+                # Measure the memory per stored set and per row
+                tracemalloc.start()
+                ds_sets = DistinguishingSets(remove_supersets=remove_supersets)
+                ds_sets.merge(ds_bitsets if not remove_supersets else
+                              [bitset_2_nodes(ds) for ds in ds_bitsets])
+                store_memory = tracemalloc.get_traced_memory()[0]
+                rows = [[[self._fire_var(node) for node in ds_sig], [1] * len(ds_sig)]
+                        for ds_sig in ds_sets.get_sets()]
+                row_memory = tracemalloc.get_traced_memory()[0] - store_memory
+                tracemalloc.stop()
+                del rows, ds_sets
+                set_memory = (store_memory + row_memory) / max(len(ds_bitsets), 1)
+
+                generation_time = n_pairs * pair_time + n_rows * row_time
+                if remove_supersets:
+                    generation_time += n_pairs * add_time
+                if check_2_neighbourhood:
+                    generation_time += index_time
+                estimates[(remove_supersets, check_2_neighbourhood)] = {
+                    'n_rows': int(round(n_rows)),
+                    'n_non_zeros': int(round(n_non_zeros)),
+                    'peak_memory': int(base_memory + n_rows * set_memory),
+                    'generation_time': generation_time,
+                }
+        return estimates
+
+    def choose_ilp_configuration(self, k, memory_limit=None, n_samples=ESTIMATOR_N_SAMPLES, seed=0):
+        """
+        Choose remove_supersets and check_2_neighbourhood for the two-step
+        encoding of k, based on estimate_two_step_uniqueness: the configuration
+        with the smallest estimated generation time among the ones whose
+        estimated peak memory is within memory_limit, or the one with the
+        smallest estimated peak memory if none of them is. Among
+        configurations with about the same generation time, the one with the
+        fewest nonzeros is chosen.
+        :param k:               Maximum identifiable set size.
+        :param memory_limit:    Available memory, in bytes. Defaults to the
+                                physical memory of the machine.
+        :param n_samples:       See estimate_two_step_uniqueness.
+        :param seed:            See estimate_two_step_uniqueness.
+        :return:                (remove_supersets, check_2_neighbourhood)
+        """
+        if memory_limit is None:
+            memory_limit = os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+        estimates = self.estimate_two_step_uniqueness(k, n_samples=n_samples, seed=seed)
+        for (remove_supersets, check_2_neighbourhood), estimate in sorted(estimates.items()):
+            log_message("{classname}: Estimate for k = {k}, remove_supersets = {rs}, check_2_neighbourhood = {c2}: "
+                        "{n_rows} uniqueness constraints, {n_nz} nonzeros, {mem:.1f} MB peak memory, "
+                        "{t:.1f} seconds.".format(
+                            classname=self.__class__.__name__, k=k, rs=remove_supersets, c2=check_2_neighbourhood,
+                            n_rows=estimate['n_rows'], n_nz=estimate['n_non_zeros'],
+                            mem=estimate['peak_memory'] / 2 ** 20, t=estimate['generation_time']))
+        feasible = [config for config, estimate in estimates.items() if estimate['peak_memory'] <= memory_limit]
+        if feasible:
+            # Configurations that are (almost) as fast as the fastest one are
+            # compared by the size of the model they generate.
+            fastest = min(estimates[config]['generation_time'] for config in feasible)
+            config = min([config for config in feasible
+                          if estimates[config]['generation_time'] <= max(1.1 * fastest, fastest + 1.0)],
+                         key=lambda config: estimates[config]['n_non_zeros'])
+        else:
+            config = min(estimates, key=lambda config: estimates[config]['peak_memory'])
+            log_message("{classname}: No configuration is estimated to fit in {mem:.1f} MB.".format(
+                classname=self.__class__.__name__, mem=memory_limit / 2 ** 20))
+        log_message("{classname}: Chose remove_supersets = {rs}, check_2_neighbourhood = {c2}.".format(
+            classname=self.__class__.__name__, rs=config[0], c2=config[1]))
+        return config
+
+    def _save_checkpoint(self, checkpoint_file, ds_sets, k, min_k, n_shards, completed_shards,
+                         remove_supersets=False, check_2_neighbourhood=False):
+        """
+        Write the distinguishing sets found so far, and the shards of sets U
+        that have been completed, to disk. The file is replaced atomically,
+        such that a job that is killed while writing leaves the previous
+        checkpoint intact.
+        """
+        checkpoint = {
+            'network_file': self._network_file,
+            'graph_hash': self._graph_hash(),
+            'n_nodes': self._G.number_of_nodes(),
+            'k': k,
+            'min_k': min_k,
+            'remove_supersets': remove_supersets,
+            'check_2_neighbourhood': check_2_neighbourhood,
+            'n_shards': n_shards,
+            'completed_shards': set(completed_shards),
+            'ds_sets': ds_sets.export(),
+        }
+        _write_pickle(checkpoint_file, checkpoint)
+        log_message("{classname}: Wrote checkpoint to {f}, {n_done} of {n_shards} shards done.".format(
+            classname=self.__class__.__name__, f=checkpoint_file,
+            n_done=len(completed_shards), n_shards=n_shards))
+
+    def _load_checkpoint(self, checkpoint_file, ds_sets, k,
+                         remove_supersets=False, check_2_neighbourhood=False):
+        """
+        Read a checkpoint written by _save_checkpoint, and add its
+        distinguishing sets to ds_sets. The sets in the checkpoint include
+        those of the layers below min_k, if the sweep started from a
+        constraint store.
+        :return:    (min_k, n_shards, completed_shards)
+        """
+        with open(checkpoint_file, 'rb') as cfile:
+            checkpoint = pickle.load(cfile)
+        settings = {
+            'network_file': self._network_file,
+            'graph_hash': self._graph_hash(),
+            'n_nodes': self._G.number_of_nodes(),
+            'k': k,
+            'remove_supersets': remove_supersets,
+            'check_2_neighbourhood': check_2_neighbourhood,
+        }
+        for setting, value in settings.items():
+            assert checkpoint.get(setting) == value, \
+                "Checkpoint {f} was made with {setting} = {c}, not {v}.".format(
+                    f=checkpoint_file, setting=setting, c=checkpoint.get(setting), v=value)
+        ds_sets.merge(checkpoint['ds_sets'])
+        return checkpoint['min_k'], checkpoint['n_shards'], checkpoint['completed_shards']
+
+    def _graph_hash(self):
+        """
+        Hash of the (preprocessed) graph and the labels of its nodes, which
+        identifies the network that a checkpoint or constraint store was made
+        for.
+        :return:    Hexadecimal digest.
+        """
+        digest = hashlib.sha256()
+        for node in sorted(self._G.nodes()):
+            digest.update("{node} {label}\n".format(node=node, label=self._node_2_label[node]).encode())
+        for u, w in sorted((min(edge), max(edge)) for edge in self._G.edges()):
+            digest.update("{u} {w}\n".format(u=u, w=w).encode())
+        return digest.hexdigest()
+
+    def save_constraint_store(self, store_file):
+        """
+        Write the distinguishing sets of the last two-step encoding to disk,
+        such that a later process can encode a larger k for the same network
+        without regenerating them. See _two_step_uniqueness_constraint.
+        :param store_file:  Path to the constraint store.
+        :return:            None
+        """
+        if self._uniqueness_store is None:
+            return
+        store = dict(self._uniqueness_store)
+        store['network_file'] = self._network_file
+        store['graph_hash'] = self._graph_hash()
+        store['n_nodes'] = self._G.number_of_nodes()
+        store['ds_sets'] = store['ds_sets'].export()
+        _write_pickle(store_file, store)
+        log_message("{classname}: Wrote constraint store for k = {k} to {f}.".format(
+            classname=self.__class__.__name__, k=store['k'], f=store_file))
+
+    def load_constraint_store(self, store_file):
+        """
+        Read a constraint store written by save_constraint_store. The store is
+        ignored if it belongs to another network: one from another network
+        file, or whose (preprocessed) graph differs (see _graph_hash).
+        :param store_file:  Path to the constraint store.
+        :return:            None
+        """
+        with open(store_file, 'rb') as sfile:
+            store = pickle.load(sfile)
+        if store.get('network_file') != self._network_file or store.get('graph_hash') != self._graph_hash():
+            log_message("{classname}: Ignoring constraint store {f}, which belongs to another network ({n}).".format(
+                classname=self.__class__.__name__, f=store_file, n=store.get('network_file')))
+            return
+        ds_sets = DistinguishingSets(remove_supersets=store['remove_supersets'])
+        ds_sets.merge(store['ds_sets'])
+        self._uniqueness_store = {
+            'k': store['k'],
+            'remove_supersets': store['remove_supersets'],
+            'check_2_neighbourhood': store['check_2_neighbourhood'],
+            'ds_sets': ds_sets,
+        }
+        log_message("{classname}: Read constraint store for k = {k} from {f}.".format(
+            classname=self.__class__.__name__, k=store['k'], f=store_file))
+
     def _two_step_uniqueness_constraint(self,
                                         k=1,
                                         remove_supersets=True,
-                                        check_2_neighbourhood=True):
+                                        check_2_neighbourhood=True,
+                                        n_workers=1,
+                                        checkpoint_file=None,
+                                        checkpoint_interval=0,
+                                        resume=False):
         """ For all subsets U and W of the nodes in the graph, with |U| <= k
         and |W| <= k, create the following constraint, which guarantees the
         uniqueness of the signature:
@@ -234,6 +1892,14 @@ class ILPEncoding(IdentifyingCodesInstance):
         also holds, with Z' any superset of Z. We can therefore reduce the
         number of constraints by also removing all supersets.
 
+        The pairs (U, W) for k - 1 are a subset of the pairs for k. The
+        distinguishing sets of the last encoding are therefore kept (see
+        save_constraint_store), and when encoding a larger k with the same
+        settings, only the pairs with max(|U|, |W|) > k - 1 are added to them.
+        The minimal sets of the union of two families are the minimal sets of
+        the union of their minimal sets, so removing supersets layer by layer
+        gives the same constraints as removing them in one go.
+
         :param k:   Maximum identifiable set size (maximum number of
                     simultaneous events).
         :param remove_supersets:    Optimisation to eliminate larger constraints
@@ -241,132 +1907,143 @@ class ILPEncoding(IdentifyingCodesInstance):
                                     constraints are satisfied.
         :param check_2_neighbourhood:   Optimisation to limit number of
                                         constraints.
-        :return:
+        :param n_workers:   Number of processes that generate the constraints.
+        :param checkpoint_file:     File to regularly write the constraints
+                                    generated so far to.
+        :param checkpoint_interval: Minimum number of seconds between
+                                    checkpoints (0 to disable checkpoints).
+        :param resume:      True if the generation should continue from the
+                            checkpoint in checkpoint_file, if it exists.
+        :return:    (number of rows, iterator over the batches of rows), see
+                    _covering_batches.
         """
-        ds_sigs = set()
         n_nodes = self._G.number_of_nodes()
         # Do a bit of preprocessing
-        self._1_neighbourhoods = {
-            node: frozenset(nx.ego_graph(self._G, node, radius=1, center=False).nodes())
-            for node in self._G.nodes()
-        }
-        self._2_neighbourhoods = dict()
-        if check_2_neighbourhood:
-            self._2_neighbourhoods = {
-                node: frozenset(nx.ego_graph(self._G, node, radius=2, center=False).nodes())
-                for node in self._G.nodes()
-            }
-        # Iterate over all possible cardinalities of set U
-        for U_size in range(1, k + 1):
-            # Generate all sets U of cardinality U_size
-            for U in combinations(range(1, n_nodes + 1), U_size):
-                # 1-neighbourhood of set U (works for both closed and not closed)
-                # NOTE: 15 oct 2022: I can't remember why it should work for both, changing to closed.
-                # NOTE: 15 oct 2022: I think I made a mistake earlier, we need
-                # (U triangle W) cup (N_1(U) triangle N_1(W))
-                # The neighbourhood indeed can be either closed or not, doesn't matter.
-                N1_U = self._get_set_neighbourhood(U, 1, closed=False)
-                if check_2_neighbourhood:
-                    N2_U = self._get_set_neighbourhood(U, 2, closed=True)    # closed 2-neighbourhood of set U
+        self._build_neighbourhood_index(check_2_neighbourhood=check_2_neighbourhood)
 
-                # Iterate over all possible cardinalities of set W:
-                for W_size in range(U_size, k + 1):
-                    # Generate all sets W of cardinality W_size
-                    for W in combinations(range(1, n_nodes + 1), W_size):
-                        if U == W:
-                            continue
+        # Split the sets U into shards, based on the smallest node in U. The
+        # nodes are dealt out round-robin, such that each shard gets a similar
+        # mix of small nodes (many sets U) and large nodes (few sets U). The
+        # completed shards serve as the enumeration cursor for checkpoints.
+        n_shards = max(MIN_N_SHARDS, SHARDS_PER_WORKER * n_workers)
+        ds_sets = DistinguishingSets(remove_supersets=remove_supersets)
+        completed_shards = set()
+        min_k = 1
+        store = self._uniqueness_store
+        if resume and checkpoint_file is not None and os.path.exists(checkpoint_file):
+            min_k, n_shards, completed_shards = self._load_checkpoint(
+                checkpoint_file, ds_sets, k,
+                remove_supersets=remove_supersets,
+                check_2_neighbourhood=check_2_neighbourhood)
+            log_message("{classname}: Resuming from checkpoint {f}, {n_done} of {n_shards} shards done.".format(
+                classname=self.__class__.__name__, f=checkpoint_file,
+                n_done=len(completed_shards), n_shards=n_shards))
+        elif store is not None and store['k'] <= k \
+                and store['remove_supersets'] == remove_supersets \
+                and store['check_2_neighbourhood'] == check_2_neighbourhood:
+            # Continue the sweep over k from the stored constraints
+            ds_sets = store['ds_sets']
+            min_k = store['k'] + 1
+            log_message("{classname}: Reusing {n} uniqueness constraints for k = {k_store}.".format(
+                classname=self.__class__.__name__, n=len(ds_sets), k_store=store['k']))
+        self._uniqueness_store = None
+        shards = [list(range(1 + shard, n_nodes + 1, n_shards)) for shard in range(n_shards)]
+        todo_shards = [shard for shard in range(n_shards) if shard not in completed_shards]
 
-                        # Determine the distinguishing set for the first element
-                        # of the signature:
-                        # ds_sig0 = set(U).union(set(W)) # NOTE: 15 oct 202: I think this line is wrong. I think it should be symmetric difference. Changing it now
-                        ds_sig0 = set(U).symmetric_difference(set(W))
+        last_checkpoint = time.time()
 
-                        # Get the neighbourhoods for set W
-                        # 1-neighbourhood of set W (works for both closed and not closed)
-                        N1_W = self._get_set_neighbourhood(W, 1, closed=False)
-                        if check_2_neighbourhood:
-                            N2_W = self._get_set_neighbourhood(W, 2, closed=True)  # closed 2-neighbourhood of set W
+        def complete_shard(shard):
+            nonlocal last_checkpoint
+            completed_shards.add(shard)
+            if checkpoint_file is not None and checkpoint_interval > 0 \
+                    and time.time() - last_checkpoint >= checkpoint_interval \
+                    and len(completed_shards) < n_shards:
+                self._save_checkpoint(checkpoint_file, ds_sets, k, min_k, n_shards, completed_shards,
+                                      remove_supersets=remove_supersets,
+                                      check_2_neighbourhood=check_2_neighbourhood)
+                last_checkpoint = time.time()
 
-                        # Avoid adding unnecessary constraints
-                        if check_2_neighbourhood:
-                            intersection_U_and_W = N2_U.intersection(N2_W)
-                            if len(intersection_U_and_W) == 0:
-                                continue
+        if min_k > k:
+            todo_shards = []
+        if n_workers == 1:
+            for shard in todo_shards:
+                self._uniqueness_shard(shards[shard], k,
+                                       remove_supersets=remove_supersets,
+                                       check_2_neighbourhood=check_2_neighbourhood,
+                                       ds_sets=ds_sets,
+                                       min_k=min_k)
+                complete_shard(shard)
+        else:
+            # Each worker reduces its own shard, and the shards are merged
+            # (including a global superset elimination) as they come in.
+            global _uniqueness_shard_instance
+            _uniqueness_shard_instance = self
+            shard_args = [(shard, shards[shard], k, min_k, remove_supersets, check_2_neighbourhood)
+                          for shard in todo_shards]
+            with multiprocessing.get_context('fork').Pool(n_workers) as pool:
+                for shard, ds_shard in pool.imap_unordered(_uniqueness_shard_worker, shard_args):
+                    ds_sets.merge(ds_shard)
+                    complete_shard(shard)
+            _uniqueness_shard_instance = None
 
-                        # Determine the distinguishing set of the second element
-                        # of the signature:
-                        ds_sig1 = N1_U.symmetric_difference(N1_W)
+        self._uniqueness_store = {
+            'k': k,
+            'remove_supersets': remove_supersets,
+            'check_2_neighbourhood': check_2_neighbourhood,
+            'ds_sets': ds_sets,
+        }
 
-                        # Determine the entire distinguishing set for this
-                        # (U, W) pair
-                        ds_full_sig = frozenset(ds_sig0.union(ds_sig1))
-
-                        # Avoid adding a distinguishing set that is a super set
-                        # of a distinguishing set that we already have
-                        if remove_supersets:
-                            # Check if the new signature is a superset of an
-                            # existing signature
-                            is_superset = False
-                            for ds_sig in ds_sigs:
-                                if ds_full_sig >= ds_sig:
-                                    is_superset = True
-                                    break
-
-                            # If it is not, then check which existing signatures
-                            # are supersets of the new one, create a set of
-                            # existing supersets to remove, and then remove
-                            # them.
-                            if not is_superset:
-                                to_remove = set()
-                                for ds_sig in ds_sigs:
-                                    if ds_sig >= ds_full_sig:
-                                        to_remove.add(ds_sig)
-                                for removable_sig in to_remove:
-                                    with suppress(ValueError, AttributeError):
-                                        ds_sigs.remove(removable_sig)
-
-                        # Add the distinguishing set to the set of
-                        # distinguishing sets that will be constraints:
-                        if not remove_supersets \
-                                or (remove_supersets and not is_superset) \
-                                and len(ds_full_sig) > 0:
-                            ds_sigs.add(ds_full_sig)
-
-
-        bvars_list = [tuple(['x' + str(node) for node in ds_sig]) for ds_sig in ds_sigs]
-        rows = [[bvars, [1] * len(bvars)] for bvars in bvars_list]
-        senses = 'G' * len(rows)
-        rhs = [1] * len(rows)
-        names = ['u' + str(i) for i in range(len(rows))]
-        return rows, senses, rhs, names
+        # Decode the distinguishing sets into lists of nodes, in a fixed order
+        ds_sigs = ds_sets.get_sets()
+        return len(ds_sigs), self._covering_batches(ds_sigs, 'u')
 
-    def encode_two_step(self, lp_file, k, remove_supersets=False, check_2_neighbourhood=False):
-        log_message("{classname}: Start two-step encoding".format(classname=self.__class__.__name__))
+    def _covering_batches(self, ds_sigs, prefix):
+        """
+        Generate the constraints sum_{z in Z} x_z >= 1 for the distinguishing
+        sets Z, CONSTRAINT_BATCH_SIZE at a time, such that the rows are only
+        built when they are written.
+        :param ds_sigs: List of distinguishing sets, as lists of nodes.
+        :param prefix:  Prefix of the constraint names.
+        :return:        Generator of (rows, senses, rhs, names) batches.
+        """
+        for start in range(0, len(ds_sigs), CONSTRAINT_BATCH_SIZE):
+            bvars_list = [[self._fire_var(node) for node in ds_sig]
+                          for ds_sig in ds_sigs[start:start + CONSTRAINT_BATCH_SIZE]]
+            rows = [[bvars, [1] * len(bvars)] for bvars in bvars_list]
+            yield rows, 'G' * len(rows), [1] * len(rows), [prefix + str(i) for i in range(start, start + len(rows))]
 
-        self._ilp_enc = cplex.Cplex()
-        log_message("{classname}: Initialised CPLEX".format(classname=self.__class__.__name__))
+    def _two_step_model(self, k, remove_supersets=False, check_2_neighbourhood=False, n_workers=1,
+                        checkpoint_file=None, checkpoint_interval=0, resume=False, constraint_store=None,
+                        stream=False):
+        """
+        Generate the variables and constraints of the two-step encoding. See
+        _two_step_uniqueness_constraint for the parameters, and _one_step_model
+        for stream.
+        :return:    (var_names, var_types, objective, lbs, ubs, constraints),
+                    see _write_model.
+        """
+        # Continue a sweep over k from a previous process
+        if constraint_store is not None and self._uniqueness_store is None \
+                and os.path.exists(constraint_store):
+            self.load_constraint_store(constraint_store)
 
         # Define variables and their bounds
 
         # Define fire variables (first element of signature):
         varnames_X = ['x' + str(node) for node in range(1, self._G.number_of_nodes() + 1)]
-        vartypes_X = [self._ilp_enc.variables.type.binary] * len(varnames_X)
+        vartypes_X = 'B' * len(varnames_X)
         obj_coeff_X = [1] * len(varnames_X)     # these variables are part of the objective function
         lbs_X = [0] * len(varnames_X)
         ubs_X = [1] * len(varnames_X)
-        self._ilp_enc.variables.add(
-            obj=obj_coeff_X, lb=lbs_X, ub=ubs_X, names=varnames_X, types=vartypes_X)
         self._fire_vars = varnames_X
 
         # Define detection variables (second element of signature)
         varnames_Y = ['y' + str(node) for node in range(1, self._G.number_of_nodes() + 1)]
-        vartypes_Y = [self._ilp_enc.variables.type.integer] * len(varnames_Y)
+        vartypes_Y = 'I' * len(varnames_Y)
         obj_coeff_Y = [0] * len(varnames_Y)         # these variables are not part of the objective function
         lbs_Y = [0] * len(varnames_Y)
         ubs_Y = [len(nx.ego_graph(self._G, node, radius=1, center=True).nodes())
                  for node in sorted(self._G.nodes())]
-        self._ilp_enc.variables.add(
-            obj=obj_coeff_Y, lb=lbs_Y, ub=ubs_Y, names=varnames_Y, types=vartypes_Y)
         self._detection_vars = varnames_Y
 
         self._n_vars = len(varnames_X) + len(varnames_Y)
@@ -376,41 +2053,57 @@ class ILPEncoding(IdentifyingCodesInstance):
         log_message("{classname}: Generated alo constraints.".format(classname=self.__class__.__name__))
         d_rows, d_senses, d_rhs, d_names = self._two_step_detection_constraint()
         log_message("{classname}: Generated two-step detection constraints.".format(classname=self.__class__.__name__))
-        u_rows, u_senses, u_rhs, u_names = self._two_step_uniqueness_constraint(k=k, remove_supersets=remove_supersets, check_2_neighbourhood=check_2_neighbourhood)
+        n_u_rows, u_batches = self._two_step_uniqueness_constraint(
+            k=k, remove_supersets=remove_supersets, check_2_neighbourhood=check_2_neighbourhood, n_workers=n_workers,
+            checkpoint_file=checkpoint_file, checkpoint_interval=checkpoint_interval, resume=resume)
         log_message("{classname}: Generated two-step uniqueness constraints.".format(classname=self.__class__.__name__))
+        if constraint_store is not None:
+            self.save_constraint_store(constraint_store)
 
-        self._n_csts = len(a_rows) + len(d_rows) + len(u_rows)
+        self._n_csts = len(a_rows) + len(d_rows) + n_u_rows
 
         log_message("{classname}: number of constraints generated:.".format(classname=self.__class__.__name__))
         log_message("{classname}: {n_a} alo constraints.".format(classname=self.__class__.__name__, n_a=len(a_rows)))
         log_message("{classname}: {n_d} two-step detection constraints.".format(classname=self.__class__.__name__, n_d=len(d_rows)))
-        log_message("{classname}: {n_u} two-step uniqueness constraints.".format(classname=self.__class__.__name__, n_u=len(u_rows)))
-
-        self._ilp_enc.linear_constraints.add(
-            lin_expr=a_rows + d_rows + u_rows,
-            senses=a_senses + d_senses + u_senses,
-            rhs=a_rhs + d_rhs + u_rhs,
-            names=a_names + d_names + u_names)
-        log_message("{classname}: Added constraints to model.".format(classname=self.__class__.__name__))
+        log_message("{classname}: {n_u} two-step uniqueness constraints.".format(classname=self.__class__.__name__, n_u=n_u_rows))
 
+        return (varnames_X + varnames_Y, vartypes_X + vartypes_Y,
+                obj_coeff_X + obj_coeff_Y, lbs_X + lbs_Y, ubs_X + ubs_Y,
+                [(a_rows, a_senses, a_rhs, a_names),
+                 (d_rows, d_senses, d_rhs, d_names),
+                 u_batches if stream else _join_batches(u_batches)])
 
+    def encode_two_step(self, lp_file, k, remove_supersets=False, check_2_neighbourhood=False, n_workers=1,
+                        checkpoint_interval=0, resume=False, constraint_store=None, ilp_writer='native',
+                        presolve=False, warm_start=False):
+        log_message("{classname}: Start two-step encoding".format(classname=self.__class__.__name__))
 
-        # Write model to file
-        if lp_file.endswith('.lp.gz'):
-            lp_file = lp_file[:-3]
-        self._ilp_enc.write(lp_file)
-        log_message("{classname}: Wrote model to file {lp_file}".format(
-            classname=self.__class__.__name__, lp_file=lp_file))
+        # The generation of uniqueness constraints is checkpointed next to the
+        # model file, and the checkpoint is removed once the model is written.
+        checkpoint_file = lp_file + '.ckpt'
 
+        # Presolve and the warm start need all constraints at once
+        model = self._two_step_model(k, remove_supersets=remove_supersets,
+                                     check_2_neighbourhood=check_2_neighbourhood, n_workers=n_workers,
+                                     checkpoint_file=checkpoint_file, checkpoint_interval=checkpoint_interval,
+                                     resume=resume, constraint_store=constraint_store,
+                                     stream=not (presolve or warm_start))
+        presolve_info = None
+        if presolve:
+            model, presolve_info = self._presolve(*model)
+        if warm_start:
+            model = self._warm_start_model(lp_file, k, model)
 
         # Get header
         header = self._get_header(encoding="ILP",
                                   k=k,
                                   remove_supersets=remove_supersets,
-                                  check_2_neighbourhood=check_2_neighbourhood)
-        lines = ['\ ' + line for line in header]
+                                  check_2_neighbourhood=check_2_neighbourhood,
+                                  presolve_info=presolve_info)
         log_message("{classname}: Generated header.".format(classname=self.__class__.__name__))
 
-        # Add header to the top of the model file
-        prepend_multiple_lines(lp_file, lines)
-        log_message("{classname}: Prepended header to model file.".format(classname=self.__class__.__name__))
\ No newline at end of file
+        # Write model to file, with the header at the top
+        self._write_model(lp_file, header, *model, ilp_writer=ilp_writer)
+
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
@@ -0,0 +1,210 @@
+# encoding: utf-8
+"""
+@file: lower_bounds.py
+@desc: Lower bounds on the number of sensors in an identifying code, that are
+       cheap enough to report the optimality gap of a solution that was found
+       without (or before the end of) an exact solve.
+"""
+
+from identifying_codes import IdentifyingCodesInstance, log_message
+import math
+import networkx as nx
+import numpy as np
+from scipy.optimize import linprog
+from scipy.sparse import identity, triu, vstack
+import time
+
+# Time limit (in seconds) for the LP relaxation. If HiGHS does not finish in
+# time, the LP bound is taken from a simple feasible dual (see _lp_relaxation).
+LP_TIME_LIMIT = 10
+
+# Maximum number of pairs of nodes for which a uniqueness row is added to the
+# LP relaxation. Any subset of the rows gives a valid bound; if there are more
+# pairs, we keep those with the smallest closed neighbourhoods, since these
+# have the smallest distinguishing sets and thus the strongest rows.
+LP_MAX_PAIRS = 200000
+
+# Tolerance for rounding the LP bound up to an integer
+LP_TOLERANCE = 1e-6
+
+
+def optimality_gap(lower_bound, upper_bound):
+    """
+    Relative gap between a lower bound and the size of a solution.
+    :param lower_bound: Lower bound on the number of sensors.
+    :param upper_bound: Number of sensors in a solution.
+    :return:            (upper_bound - lower_bound) / upper_bound, or None if
+                        either is unknown. The gap is 0 if the solution is
+                        empty.
+    """
+    if lower_bound is None or upper_bound is None:
+        return None
+    if upper_bound == 0:
+        return 0.0
+    return (upper_bound - lower_bound) / upper_bound
+
+
+class LowerBounds(IdentifyingCodesInstance):
+    """
+    Computes three lower bounds on the size of an identifying code, and takes
+    the largest:
+    1. Counting: all sets of at most k nodes need distinct signatures, and b
+       sensors only give so many signatures.
+    2. Degree: a sensor is in the signatures of at most deg + 1 nodes, and all
+       but b nodes need at least two sensors in their signature.
+    3. LP relaxation: the optimum of the LP relaxation of the detection
+       constraints and the uniqueness constraints of the pairs of single nodes
+       at distance at most 2, solved with HiGHS.
+    The degree and LP bounds are computed for k = 1. They are also bounds for
+    larger k, since an identifying code for k is one for k = 1.
+    """
+
+    def __init__(self):
+        IdentifyingCodesInstance.__init__(self)
+
+    def compute(self, k, lp_time_limit=LP_TIME_LIMIT):
+        """
+        Compute the lower bounds for k.
+        :param k:               Maximum identifiable set size.
+        :param lp_time_limit:   Time limit (in seconds) for the LP relaxation,
+                                or None for no limit.
+        :return:    Dictionary with the bounds (one per method, and the
+                    largest as 'lower_bound'), and statistics of the LP.
+        """
+        log_message("{classname}: Start computing lower bounds".format(classname=self.__class__.__name__))
+        start_time = time.perf_counter()
+        self._k = k
+        counting_bound = self._counting_bound(k)
+        degree_bound = self._degree_bound()
+        lp_value, lp_status, n_lp_rows = self._lp_relaxation(lp_time_limit)
+        lp_bound = max(0, math.ceil(lp_value - LP_TOLERANCE))
+        lower_bound = max(counting_bound, degree_bound, lp_bound)
+        bound_time = time.perf_counter() - start_time
+        log_message("{classname}: Lower bound {lb} (counting: {c}, degree: {d}, LP: {lp}) in {t:.2f} seconds.".format(
+            classname=self.__class__.__name__, lb=lower_bound, c=counting_bound, d=degree_bound,
+            lp=lp_bound, t=bound_time))
+        return {
+            'k': k,
+            'lower_bound': lower_bound,
+            'counting_bound': counting_bound,
+            'degree_bound': degree_bound,
+            'lp_bound': lp_bound,
+            'lp_value': lp_value,
+            'lp_status': lp_status,
+            'n_lp_rows': n_lp_rows,
+            'bound_time': bound_time,
+        }
+
+    def _counting_bound(self, k):
+        """
+        One-step: the signatures N[U] & S of the sets U with |U| <= k (and the
+        empty set) are distinct subsets of the b sensors S, so
+            2^b >= sum_{i <= k} C(n, i).
+        Two-step: the signature of U is (U & S, N(U) & S). The sets U that
+        contain no sensor share U & S (the empty set), so their parts N(U) & S
+        must be distinct subsets of S:
+            2^b >= sum_{i <= k} C(n - b, i).
+        :param k:   Maximum identifiable set size.
+        :return:    Smallest b that satisfies the inequality.
+        """
+        n_nodes = self._G.number_of_nodes()
+        b = 0
+        while b < n_nodes:
+            n_free = n_nodes - b if self._two_step else n_nodes
+            n_sets = sum(math.comb(n_free, size) for size in range(min(k, n_free) + 1))
+            if 2 ** b >= n_sets:
+                break
+            b += 1
+        return b
+
+    def _degree_bound(self):
+        """
+        One-step (k = 1): each node needs a distinct, nonempty set of sensors
+        in its closed neighbourhood. At most b of these sets have a single
+        sensor, so, summing their sizes,
+            sum_{s in S} (deg(s) + 1) >= b + 2 (n - b).
+        Two-step (k = 1): a node that is no sensor needs a distinct, nonempty
+        set of sensors in its open neighbourhood, so, with m = min(b, n - b),
+            sum_{s in S} deg(s) >= m + 2 (n - b - m).
+        The left-hand sides are at most the sums over the b nodes of highest
+        degree. (With maximum degree D, the one-step bound is at least the
+        classic 2n / (D + 2).)
+        :return:    Smallest b that satisfies the inequality.
+        """
+        n_nodes = self._G.number_of_nodes()
+        degrees = sorted((degree for _, degree in self._G.degree()), reverse=True)
+        covered = 0
+        for b in range(n_nodes + 1):
+            if self._two_step:
+                n_single = min(b, n_nodes - b)
+                needed = n_single + 2 * (n_nodes - b - n_single)
+            else:
+                needed = b + 2 * (n_nodes - b)
+            if covered >= needed:
+                return b
+            if b < n_nodes:
+                covered += degrees[b] + (0 if self._two_step else 1)
+        return n_nodes
+
+    def _lp_rows(self):
+        """
+        Rows of the LP relaxation, over the variables x_v (index v - 1, as in
+        ILPEncoding). With C = A + I the closed-neighbourhood incidence matrix,
+        the detection rows are the rows of C, and the pairs of nodes at
+        distance 1 or 2 are the nonzeros above the diagonal of C^2. The
+        distinguishing set of a pair {u, w} is N[u] ^ N[w] (one-step), or
+        {u, w} | (N(u) ^ N(w)) (two-step).
+        :return:    Sparse 0/1 matrix with a row per constraint (each row must
+                    have at least one sensor).
+        """
+        n_nodes = self._G.number_of_nodes()
+        A = nx.to_scipy_sparse_array(self._G, nodelist=range(1, n_nodes + 1), dtype=np.int32, format='csr')
+        I = identity(n_nodes, dtype=np.int32, format='csr')
+        C = (A + I).tocsr()
+        # A self-loop would leave a 2 on the diagonal (see ILPEncoding)
+        C.data[:] = 1
+        pairs = triu(C @ C, k=1).tocoo()
+        us, ws = pairs.row, pairs.col
+        if len(us) > LP_MAX_PAIRS:
+            closed_degrees = np.diff(C.indptr)
+            keep = np.argpartition(closed_degrees[us] + closed_degrees[ws], LP_MAX_PAIRS)[:LP_MAX_PAIRS]
+            us, ws = us[keep], ws[keep]
+        if self._two_step:
+            D = abs(A[us] - A[ws]) + I[us] + I[ws]
+        else:
+            D = abs(C[us] - C[ws])
+        D = D.tocsr()
+        D.eliminate_zeros()
+        D.data[:] = 1
+        return vstack([C, D], format='csr')
+
+    def _lp_relaxation(self, time_limit):
+        """
+        Solve the LP relaxation min sum x s.t. R x >= 1, 0 <= x <= 1 of the
+        rows R (see _lp_rows) with the HiGHS interior point solver, which is
+        much faster than simplex on these covering LPs. The bound is evaluated
+        from the dual values y >= 0 of the rows, as the Lagrangian
+            sum y + sum_v min(0, 1 - (R^T y)_v),
+        which is a valid bound for any y >= 0: at the optimum it equals the
+        optimum of the LP. If HiGHS stops without dual values, we fall back on
+        the dual y_i = 1 / (the largest number of rows that a variable in row i
+        appears in), for which R^T y <= 1.
+        :param time_limit:  Time limit (in seconds), or None for no limit.
+        :return:            (bound, status message, number of rows)
+        """
+        n_nodes = self._G.number_of_nodes()
+        if n_nodes == 0:
+            return 0.0, 'empty graph', 0
+        R = self._lp_rows()
+        options = dict() if time_limit is None else {'time_limit': float(time_limit)}
+        result = linprog(np.ones(n_nodes), A_ub=-R, b_ub=-np.ones(R.shape[0]), bounds=(0, 1),
+                         method='highs-ipm', options=options)
+        ineqlin = getattr(result, 'ineqlin', None)
+        if ineqlin is None or ineqlin.marginals is None or len(ineqlin.marginals) != R.shape[0]:
+            column_counts = np.asarray(R.sum(axis=0)).ravel()
+            y = 1 / R.multiply(column_counts).max(axis=1).toarray().ravel()
+        else:
+            y = np.maximum(-np.asarray(ineqlin.marginals), 0)
+        reduced_costs = 1 - R.T @ y
+        bound = float(y.sum() + np.minimum(reduced_costs, 0).sum())
+        return max(bound, 0.0), result.message, R.shape[0]
@@ -0,0 +1,295 @@
+# encoding: utf-8
+"""
+@file: lp_writer.py
+@desc: Writers that stream an ILP model to an (optionally gzipped) LP or MPS
+       file, without building the model in memory first.
+"""
+
+from array import array
+import gzip
+import os
+
+# Compression level for .gz model files. The highest level is much slower on
+# multi-GB models, for a few percent smaller files.
+GZIP_COMPRESSLEVEL = 6
+
+# Number of lines that are collected before they are written to the file
+LINE_BUFFER_SIZE = 10000
+
+# Maximum length of a line in an LP file, after which terms are continued on
+# the next line (like CPLEX does)
+LP_LINE_LENGTH = 80
+
+_LP_SENSES = {'G': '>=', 'L': '<=', 'E': '='}
+
+
+def open_model_writer(model_file, var_names, var_types, objective, lbs, ubs, header=None):
+    """
+    Open a writer for model_file, in the format given by its extension (.lp,
+    .mps, .lp.gz or .mps.gz).
+    :param model_file:  Path to the model file.
+    :param var_names:   List of variable names. Constraints refer to the
+                        variables by their index in this list.
+    :param var_types:   String with a type per variable, as in CPLEX: 'B'
+                        (binary), 'I' (integer) or 'C' (continuous).
+    :param objective:   List of objective coefficients (minimised).
+    :param lbs:         List of lower bounds.
+    :param ubs:         List of upper bounds (None for no bound).
+    :param header:      List of lines that are written as comments at the top
+                        of the file.
+    :return:            LPWriter or MPSWriter
+    """
+    base_file = model_file[:-3] if model_file.endswith('.gz') else model_file
+    if base_file.endswith('.mps'):
+        writer_class = MPSWriter
+    elif base_file.endswith('.lp'):
+        writer_class = LPWriter
+    else:
+        raise ValueError("Unknown model file format: {f}".format(f=model_file))
+    return writer_class(model_file, var_names, var_types, objective, lbs, ubs, header=header)
+
+
+def write_mip_start(model_file, var_names, values):
+    """
+    Write a solution to a MIP start file in the CPLEX format, next to the
+    model file: with extension .mst instead of .lp or .mps (and without .gz).
+    CPLEX reads it after the model, e.g., with 'read <file>.mst' in the
+    interactive optimizer.
+    :param model_file:  Path to the model file.
+    :param var_names:   List of variable names.
+    :param values:      List with a value per variable.
+    :return:            Path to the MIP start file.
+    """
+    base_file = model_file[:-3] if model_file.endswith('.gz') else model_file
+    mst_file = os.path.splitext(base_file)[0] + '.mst'
+    lines = ['<?xml version = "1.0" encoding="UTF-8" standalone="yes"?>',
+             '<CPLEXSolutions version="1.2">',
+             ' <CPLEXSolution version="1.2">',
+             '  <header',
+             '    problemName="{name}"'.format(name=os.path.basename(base_file)),
+             '    solutionName="m1"',
+             '    solutionIndex="0"',
+             '    MIPStartEffortLevel="0"',
+             '    writeLevel="1"/>',
+             '  <variables>']
+    for idx, (name, value) in enumerate(zip(var_names, values)):
+        lines.append('   <variable name="{name}" index="{idx}" value="{value}"/>'.format(
+            name=name, idx=idx, value=_format_number(value)))
+    lines.extend(['  </variables>',
+                  ' </CPLEXSolution>',
+                  '</CPLEXSolutions>',
+                  ''])
+    with open(mst_file, 'w') as mfile:
+        mfile.write('\n'.join(lines))
+    return mst_file
+
+
+def _format_number(number):
+    if float(number).is_integer():
+        return str(int(number))
+    return repr(float(number))
+
+
+class _ModelWriter:
+    """
+    Base class for the model writers. The header, objective and variables are
+    given when the writer is opened, the constraints are streamed to the file
+    with add_constraints, and the file is completed by close().
+    """
+
+    def __init__(self, model_file, var_names, var_types, objective, lbs, ubs, header=None):
+        assert len(var_names) == len(var_types) == len(objective) == len(lbs) == len(ubs)
+        self._model_file = model_file
+        self._var_names = var_names
+        self._var_types = var_types
+        self._objective = objective
+        self._lbs = lbs
+        self._ubs = ubs
+        self._n_csts = 0
+        self._lines = []
+        if model_file.endswith('.gz'):
+            self._file = gzip.open(model_file, 'wt', compresslevel=GZIP_COMPRESSLEVEL)
+        else:
+            self._file = open(model_file, 'w')
+        self._write_header([] if header is None else header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write_line(self, line):
+        self._lines.append(line)
+        if len(self._lines) >= LINE_BUFFER_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if self._lines:
+            self._lines.append('')
+            self._file.write('\n'.join(self._lines))
+            self._lines = []
+
+    def add_constraints(self, rows, senses, rhs, names):
+        """
+        Write constraints to the model file. The arguments are as in
+        cplex.Cplex().linear_constraints.add, with the variables of each row
+        given by their indices.
+        :param rows:    Iterable of [indices, coefficients] pairs.
+        :param senses:  Iterable of 'G', 'L' or 'E'.
+        :param rhs:     Iterable of right-hand sides.
+        :param names:   Iterable of constraint names.
+        :return:        None
+        """
+        for (indices, coeffs), sense, row_rhs, name in zip(rows, senses, rhs, names):
+            terms = sorted(zip(indices, coeffs))
+            if not terms:
+                # All terms of the row were removed (e.g. by fixings in
+                # presolve). Neither format has empty rows, so the row keeps
+                # a zero term, which leaves it as (in)feasible as it was.
+                terms = [(0, 0)]
+            self._add_constraint(terms, sense, row_rhs, name)
+            self._n_csts += 1
+
+    def close(self):
+        """
+        Write the remaining sections of the model and close the file.
+        :return:    None
+        """
+        if self._file is None:
+            return
+        self._write_tail()
+        self._flush()
+        self._file.close()
+        self._file = None
+
+    def _write_header(self, header):
+        raise NotImplementedError
+
+    def _add_constraint(self, terms, sense, rhs, name):
+        raise NotImplementedError
+
+    def _write_tail(self):
+        raise NotImplementedError
+
+
+class LPWriter(_ModelWriter):
+    """
+    Writes a model in the CPLEX LP format. The terms of each constraint are
+    ordered by variable index, and the sections after the constraints are
+    laid out as CPLEX writes them.
+    """
+
+    def _write_header(self, header):
+        for line in header:
+            self._write_line('\\ ' + line)
+        self._write_line('')
+        self._write_line('Minimize')
+        terms = [(idx, coeff) for idx, coeff in enumerate(self._objective) if coeff != 0]
+        self._write_expression(' obj:', terms, '')
+        self._write_line('Subject To')
+
+    def _write_expression(self, prefix, terms, suffix):
+        """
+        Write a linear expression, continuing it on the next line when it gets
+        too long.
+        """
+        line = prefix
+        for idx, coeff in terms:
+            if coeff == 1:
+                term = ' + ' + self._var_names[idx]
+            elif coeff == -1:
+                term = ' - ' + self._var_names[idx]
+            elif coeff < 0:
+                term = ' - ' + _format_number(-coeff) + ' ' + self._var_names[idx]
+            else:
+                term = ' + ' + _format_number(coeff) + ' ' + self._var_names[idx]
+            if line == prefix and term.startswith(' + '):
+                term = ' ' + term[3:]
+            if len(line) + len(term) > LP_LINE_LENGTH and line != prefix:
+                self._write_line(line)
+                line = '      '
+            line += term
+        self._write_line(line + suffix)
+
+    def _add_constraint(self, terms, sense, rhs, name):
+        self._write_expression(' {name}:'.format(name=name), terms,
+                               ' {sense} {rhs}'.format(sense=_LP_SENSES[sense], rhs=_format_number(rhs)))
+
+    def _write_tail(self):
+        self._write_line('Bounds')
+        for name, lb, ub in zip(self._var_names, self._lbs, self._ubs):
+            if ub is None:
+                self._write_line(' {name} >= {lb}'.format(name=name, lb=_format_number(lb)))
+            else:
+                self._write_line(' {lb} <= {name} <= {ub}'.format(
+                    name=name, lb=_format_number(lb), ub=_format_number(ub)))
+        for section, var_type in [('Binaries', 'B'), ('Generals', 'I')]:
+            section_vars = [name for name, name_type in zip(self._var_names, self._var_types)
+                            if name_type == var_type]
+            if not section_vars:
+                continue
+            self._write_line(section)
+            for start in range(0, len(section_vars), 10):
+                self._write_line(' ' + '  '.join(section_vars[start:start + 10]) + ' ')
+        self._write_line('End')
+
+
+class MPSWriter(_ModelWriter):
+    """
+    Writes a model in the free MPS format. Since the COLUMNS section lists the
+    matrix column by column, the rows are streamed to the ROWS section, but
+    the matrix entries are kept (as arrays of ints and floats) until the file
+    is closed.
+    """
+
+    def _write_header(self, header):
+        for line in header:
+            self._write_line('* ' + line)
+        self._write_line('NAME')
+        self._write_line('ROWS')
+        self._write_line(' N  obj')
+        self._row_names = []
+        self._rhs = []
+        self._column_rows = [array('i') for _ in self._var_names]
+        self._column_coeffs = [array('d') for _ in self._var_names]
+
+    def _add_constraint(self, terms, sense, rhs, name):
+        row = len(self._row_names)
+        self._row_names.append(name)
+        self._write_line(' {sense}  {name}'.format(sense=sense, name=name))
+        for idx, coeff in terms:
+            self._column_rows[idx].append(row)
+            self._column_coeffs[idx].append(coeff)
+        if rhs != 0:
+            self._rhs.append((row, rhs))
+
+    def _write_tail(self):
+        self._write_line('COLUMNS')
+        integer = False
+        for idx, name in enumerate(self._var_names):
+            is_integer = self._var_types[idx] in 'BI'
+            if is_integer != integer:
+                self._write_line('    MARKER  \'MARKER\'  \'{m}\''.format(m='INTORG' if is_integer else 'INTEND'))
+                integer = is_integer
+            if self._objective[idx] != 0:
+                self._write_line('    {name}  obj  {c}'.format(name=name, c=_format_number(self._objective[idx])))
+            for row, coeff in zip(self._column_rows[idx], self._column_coeffs[idx]):
+                self._write_line('    {name}  {row}  {c}'.format(
+                    name=name, row=self._row_names[row], c=_format_number(coeff)))
+            self._column_rows[idx] = None
+            self._column_coeffs[idx] = None
+        if integer:
+            self._write_line('    MARKER  \'MARKER\'  \'INTEND\'')
+        self._write_line('RHS')
+        for row, rhs in self._rhs:
+            self._write_line('    rhs  {row}  {rhs}'.format(row=self._row_names[row], rhs=_format_number(rhs)))
+        self._write_line('BOUNDS')
+        for name, lb, ub in zip(self._var_names, self._lbs, self._ubs):
+            if lb != 0:
+                self._write_line(' LO bnd  {name}  {lb}'.format(name=name, lb=_format_number(lb)))
+            if ub is None:
+                self._write_line(' PL bnd  {name}'.format(name=name))
+            else:
+                self._write_line(' UP bnd  {name}  {ub}'.format(name=name, ub=_format_number(ub)))
+        self._write_line('ENDATA')
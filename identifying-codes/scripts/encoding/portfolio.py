@@ -0,0 +1,308 @@
+# encoding: utf-8
+"""
+@file: portfolio.py
+@desc: Portfolio runner that races gismo (on the GCNF encoding) against the
+       ILP encoding (solved with HiGHS) on the same two-step instance, keeps
+       the first proven-optimal result and logs which backend won.
+"""
+
+import argparse
+import csv
+from datetime import datetime
+from gis_encoding import GISEncoding
+from identifying_codes import log_message
+from ilp_encoding import ILPEncoding
+import json
+import multiprocessing
+import os
+import pathlib
+import signal
+import subprocess
+import time
+
+# Number of seconds between two checks on the backends
+POLL_INTERVAL = 0.1
+
+# Fields of the winner log, one row per race
+WINNER_LOG_FIELDS = ['date', 'network', 'network_type', 'n_nodes', 'n_edges', 'k', 'winner', 'n_sensors',
+                     'wallclock_time', 'cpu_time_gismo', 'cpu_time_ilp', 'cpu_budget']
+
+try:
+    _CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = None
+
+
+def _process_cpu_time(pid):
+    """
+    CPU time (user + system) that a running process has used so far, read
+    from /proc.
+    :param pid: Process id.
+    :return:    Number of seconds, or None if it cannot be read (the process
+                has been reaped, or there is no /proc).
+    """
+    if _CLOCK_TICKS is None:
+        return None
+    try:
+        with open('/proc/{pid}/stat'.format(pid=pid), 'r') as stat_file:
+            stat = stat_file.read()
+    except OSError:
+        return None
+    # The command name (field 2) may contain spaces, so split after it;
+    # utime and stime are fields 14 and 15
+    fields = stat[stat.rindex(')') + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+
+
+def _ilp_worker(ilp_instance, k, time_limit, connection):
+    """
+    Solve the ILP encoding in a separate process, and send the results back.
+    """
+    try:
+        results = ilp_instance.solve(k, time_limit=time_limit)
+    except Exception as exc:
+        results = {'error': str(exc)}
+    connection.send(results)
+    connection.close()
+
+
+class PortfolioRunner:
+    """
+    Races gismo against the two-step ILP encoding on one preprocessed
+    instance. Both backends start at the same time, and share a budget of CPU
+    seconds: as soon as one of them proves an optimal solution, the other is
+    killed, and if the CPU time that they used together exceeds the budget,
+    both are killed.
+    gismo runs on a GCNF file written by GISEncoding, and the ILP is solved
+    by ILPEncoding.solve (HiGHS) in a forked process, on the same
+    (preprocessed) graph.
+    """
+
+    def __init__(self, gismo_binary, cpu_budget=None, poll_interval=POLL_INTERVAL):
+        """
+        :param gismo_binary:    Path to the gismo executable.
+        :param cpu_budget:      Number of CPU seconds that the backends may
+                                use together, or None for no limit.
+        :param poll_interval:   Number of seconds between two checks on the
+                                backends.
+        """
+        self._gismo_binary = gismo_binary
+        self._cpu_budget = cpu_budget
+        self._poll_interval = poll_interval
+
+    def run(self, gis_instance, k, gcnf_file):
+        """
+        Race the backends for k.
+        :param gis_instance:    Two-step GISEncoding that has been built.
+        :param k:               Maximum identifiable set size.
+        :param gcnf_file:       Path to which the GCNF is written; gismo's
+                                output is written next to it, with extension
+                                .gismo.out.
+        :return:    Dictionary with 'portfolio_info' and 'solution_info'
+                    groups. The solution is the list of sensor nodes, by their
+                    original labels, or None if no backend proved an optimal
+                    solution within the budget.
+        """
+        classname = self.__class__.__name__
+        log_message("{classname}: Writing GCNF for k = {k}".format(classname=classname, k=k))
+        gis_instance.encode(gcnf_file, k)
+        ilp_instance = ILPEncoding.from_instance(gis_instance)
+
+        start_time = time.perf_counter()
+        gismo_out_file = gcnf_file + '.gismo.out'
+        with open(gismo_out_file, 'w') as gismo_out:
+            # In a new session, such that gismo and anything it starts can be
+            # killed as a group
+            gismo = subprocess.Popen([self._gismo_binary, gcnf_file], stdout=gismo_out,
+                                     stderr=subprocess.STDOUT, start_new_session=True)
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        ilp = multiprocessing.get_context('fork').Process(
+            target=_ilp_worker, args=(ilp_instance, k, self._cpu_budget, sender), daemon=True)
+        ilp.start()
+        sender.close()
+        log_message("{classname}: Started gismo (pid {g}) and ILP (pid {i})".format(
+            classname=classname, g=gismo.pid, i=ilp.pid))
+
+        cpu_times = {'gismo': 0.0, 'ilp': 0.0}
+        pids = {'gismo': gismo.pid, 'ilp': ilp.pid}
+        running = {'gismo', 'ilp'}
+        winner = None
+        solution = None
+        ilp_results = None
+        status = 'no optimal solution'
+        while running:
+            for backend in running:
+                cpu_time = _process_cpu_time(pids[backend])
+                if cpu_time is not None:
+                    cpu_times[backend] = cpu_time
+
+            # The pipe also becomes readable (at EOF) if the ILP process dies
+            # without sending results
+            if 'ilp' in running and receiver.poll():
+                try:
+                    ilp_results = receiver.recv()
+                except EOFError:
+                    ilp_results = {'error': 'The ILP process ended without results.'}
+                ilp.join()
+                running.discard('ilp')
+                if ilp_results.get('highs_info', dict()).get('optimal'):
+                    winner = 'ilp'
+                    solution = ilp_results['solution_info']['solution']
+
+            if winner is None and 'gismo' in running and gismo.poll() is not None:
+                running.discard('gismo')
+                if gismo.returncode == 0:
+                    solution = self._read_gismo_solution(gis_instance, gismo_out_file)
+                    if solution is not None:
+                        winner = 'gismo'
+
+            if winner is not None:
+                status = 'optimal'
+                break
+            if self._cpu_budget is not None and sum(cpu_times.values()) > self._cpu_budget:
+                status = 'cpu budget exhausted'
+                break
+            time.sleep(self._poll_interval)
+
+        # Kill the loser(s)
+        if 'gismo' in running and gismo.poll() is None:
+            os.killpg(gismo.pid, signal.SIGKILL)
+        gismo.wait()
+        if ilp.is_alive():
+            ilp.kill()
+        ilp.join()
+        receiver.close()
+        wallclock_time = time.perf_counter() - start_time
+        log_message("{classname}: {status} after {t:.2f} seconds; winner: {w}".format(
+            classname=classname, status=status, t=wallclock_time, w=winner))
+
+        return {
+            'portfolio_info': {
+                'winner': winner,
+                'status': status,
+                'wallclock_time': wallclock_time,
+                'cpu_time_gismo': cpu_times['gismo'],
+                'cpu_time_ilp': cpu_times['ilp'],
+                'cpu_budget': self._cpu_budget,
+                'gismo_returncode': gismo.returncode,
+                'ilp_results': ilp_results,
+            },
+            'solution_info': {
+                'optimised_value': None if solution is None else float(len(solution)),
+                'k': k,
+                'solution': solution,
+            },
+        }
+
+    @staticmethod
+    def _read_gismo_solution(gis_instance, gismo_out_file):
+        """
+        Read the sensor nodes from the 'c ind' line of gismo's output. The
+        GCNF groups are the pairs (x_v, y_v) = (v, n + v) (see
+        GISEncoding.encode), so variable i belongs to node i if i <= n, and
+        to node i - n otherwise.
+        :return:    List of the original labels of the sensor nodes, or None
+                    if gismo reported no solution.
+        """
+        n_nodes = gis_instance._G.number_of_nodes()
+        with open(gismo_out_file, 'r') as gismo_out:
+            for line in gismo_out:
+                if line.startswith('c ind '):
+                    variables = [int(var) for var in line.split()[2:] if var != '0']
+                    nodes = sorted({var if var <= n_nodes else var - n_nodes for var in variables})
+                    return [gis_instance._node_2_label[node] for node in nodes]
+        return None
+
+
+def log_winner(winner_log, network_file, network_type, gis_instance, results):
+    """
+    Append the outcome of a race to a CSV file, to collect which backend wins
+    on which type of network.
+    """
+    new_file = not os.path.exists(winner_log)
+    with open(winner_log, 'a', newline='') as log_file:
+        writer = csv.DictWriter(log_file, fieldnames=WINNER_LOG_FIELDS)
+        if new_file:
+            writer.writeheader()
+        portfolio_info = results['portfolio_info']
+        writer.writerow({
+            'date': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'network': os.path.basename(network_file),
+            'network_type': network_type,
+            'n_nodes': gis_instance._G.number_of_nodes(),
+            'n_edges': gis_instance._G.number_of_edges(),
+            'k': results['solution_info']['k'],
+            'winner': portfolio_info['winner'] or 'none',
+            'n_sensors': results['solution_info']['optimised_value'],
+            'wallclock_time': '{t:.4f}'.format(t=portfolio_info['wallclock_time']),
+            'cpu_time_gismo': '{t:.2f}'.format(t=portfolio_info['cpu_time_gismo']),
+            'cpu_time_ilp': '{t:.2f}'.format(t=portfolio_info['cpu_time_ilp']),
+            'cpu_budget': portfolio_info['cpu_budget'],
+        })
+
+
+def winner_counts(winner_log, network_type):
+    """
+    Count how often each backend won on a type of network, according to the
+    winner log.
+    :return:    Dictionary mapping 'gismo', 'ilp' and 'none' to counts.
+    """
+    counts = {'gismo': 0, 'ilp': 0, 'none': 0}
+    with open(winner_log, 'r', newline='') as log_file:
+        for row in csv.DictReader(log_file):
+            if row['network_type'] == network_type:
+                counts[row['winner']] = counts.get(row['winner'], 0) + 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    required_args = parser.add_argument_group("Required arguments")
+    optional_args = parser.add_argument_group("Optional arguments")
+    required_args.add_argument("--network", "-n", type=str, required=True,
+                               help="Path to network file.")
+    required_args.add_argument("--out_dir", type=str, required=True,
+                               help="Path to output directory above k sub directory.")
+    required_args.add_argument("--out_file", type=str, required=True,
+                               help="Basename of output file: the GCNF is written to <out_file>.cnf and the "
+                                    "results (as JSON) to <out_file>.json.")
+    optional_args.add_argument("-k", type=int, nargs='+', default=[1],
+                               help="Max number of simultaneous events.")
+    optional_args.add_argument("--gismo", type=str, required=False,
+                               default=os.getenv('GISMO', './gismo/build/gismo'),
+                               help="Path to the gismo executable (default: $GISMO, or ./gismo/build/gismo).")
+    optional_args.add_argument("--cpu_budget", type=float, required=False, default=None,
+                               help="Number of CPU seconds that gismo and the ILP solver may use together, per k.")
+    optional_args.add_argument("--network_type", type=str, required=False, default=None,
+                               help="Network type for the winner log (default: name of the directory of the "
+                                    "network file, as in instances/networks/<network type>/).")
+    optional_args.add_argument("--winner_log", type=str, required=False, default=None,
+                               help="CSV file to which the winning backend is appended, per network and k.")
+    args = parser.parse_args()
+
+    network_type = args.network_type
+    if network_type is None:
+        network_type = os.path.basename(os.path.dirname(os.path.abspath(args.network)))
+
+    log_message("Processing {network}".format(network=args.network))
+    gis_instance = GISEncoding(two_step=True)
+    gis_instance.build_from_file(args.network, two_step=True)
+    runner = PortfolioRunner(args.gismo, cpu_budget=args.cpu_budget)
+    for k in sorted(args.k):
+        out_dir = '{out_dir}/k{k}/'.format(out_dir=args.out_dir, k=k)
+        pathlib.Path(out_dir).mkdir(parents=True, exist_ok=True)
+        results = runner.run(gis_instance, k, out_dir + args.out_file + '.cnf')
+        log_message("Winner for k = {k}: {winner}".format(k=k, winner=results['portfolio_info']['winner']))
+        log_message("Solution: {solution}".format(solution=results['solution_info']['solution']))
+        with open(out_dir + args.out_file + '.json', 'w') as rfile:
+            rfile.write(json.dumps(results, indent=4) + "\n")
+        if args.winner_log is not None:
+            log_winner(args.winner_log, args.network, network_type, gis_instance, results)
+            counts = winner_counts(args.winner_log, network_type)
+            log_message("Wins on {network_type} networks so far: gismo {gismo}, ilp {ilp}, none {none}".format(
+                network_type=network_type, **counts))
+    log_message("Done!")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+# encoding: utf-8
+"""
+@file: set_trie.py
+@desc: Set-trie for storing a family of sets of nodes, supporting fast subset
+       and superset queries. Used for removing redundant (superset)
+       constraints from ILP encodings.
+"""
+
+
+class _SetTrieNode:
+    __slots__ = ['children', 'is_end']
+
+    def __init__(self):
+        self.children = dict()  # maps element to child node
+        self.is_end = False     # True if the path to this node is a stored set
+
+
+class SetTrie:
+    """
+    Set-trie (Savnik, 2013). Each stored set is a path from the root, with the
+    elements of the set sorted in increasing order. Because the elements on
+    each path are sorted, subset and superset queries only need to visit the
+    branches of the trie that can still lead to an answer, rather than
+    comparing the query against every stored set.
+    """
+
+    def __init__(self):
+        self._root = _SetTrieNode()
+        self._n_sets = 0
+
+    def __len__(self):
+        return self._n_sets
+
+    def __iter__(self):
+        """
+        Iterate over the stored sets.
+        :return:    Generator of tuples of elements, sorted in increasing order.
+        """
+        stack = [(self._root, ())]
+        while stack:
+            node, path = stack.pop()
+            if node.is_end:
+                yield path
+            for element, child in node.children.items():
+                stack.append((child, path + (element,)))
+
+    def insert(self, the_set):
+        """
+        Add a set to the trie.
+        :param the_set: Iterable of (sortable) elements.
+        :return:        None
+        """
+        node = self._root
+        for element in sorted(the_set):
+            child = node.children.get(element)
+            if child is None:
+                child = _SetTrieNode()
+                node.children[element] = child
+            node = child
+        if not node.is_end:
+            node.is_end = True
+            self._n_sets += 1
+
+    def remove(self, the_set):
+        """
+        Remove a set from the trie, and prune the branches that no longer lead
+        to a stored set.
+        :param the_set: Iterable of (sortable) elements.
+        :return:        None
+        """
+        path = [(None, self._root)]
+        node = self._root
+        for element in sorted(the_set):
+            node = node.children.get(element)
+            if node is None:
+                return
+            path.append((element, node))
+        if not node.is_end:
+            return
+        node.is_end = False
+        self._n_sets -= 1
+        for idx in range(len(path) - 1, 0, -1):
+            element, node = path[idx]
+            if node.is_end or node.children:
+                break
+            del path[idx - 1][1].children[element]
+
+    def has_subset(self, the_set):
+        """
+        Check if the trie contains a subset of the_set (including the_set
+        itself).
+        :param the_set: Iterable of (sortable) elements.
+        :return:        True if a stored set is a subset of the_set.
+        """
+        elements = sorted(the_set)
+        n_elements = len(elements)
+        position = {element: pos for pos, element in enumerate(elements)}
+        stack = [(self._root, 0)]
+        while stack:
+            node, idx = stack.pop()
+            if node.is_end:
+                return True
+            # Only follow the children whose element is in the_set and comes
+            # after the elements on the path so far.
+            if len(node.children) < n_elements - idx:
+                for element, child in node.children.items():
+                    pos = position.get(element)
+                    if pos is not None and pos >= idx:
+                        stack.append((child, pos + 1))
+            else:
+                for pos in range(idx, n_elements):
+                    child = node.children.get(elements[pos])
+                    if child is not None:
+                        stack.append((child, pos + 1))
+        return False
+
+    def get_supersets(self, the_set):
+        """
+        Find all sets in the trie that are supersets of the_set (including
+        the_set itself).
+        :param the_set: Iterable of (sortable) elements.
+        :return:        List of tuples of elements, sorted in increasing order.
+        """
+        elements = sorted(the_set)
+        n_elements = len(elements)
+        supersets = []
+        stack = [(self._root, 0, ())]
+        while stack:
+            node, idx, path = stack.pop()
+            if idx == n_elements:
+                if node.is_end:
+                    supersets.append(path)
+                for element, child in node.children.items():
+                    stack.append((child, idx, path + (element,)))
+                continue
+            # A path can only contain the next required element if it has not
+            # passed it yet.
+            for element, child in node.children.items():
+                if element < elements[idx]:
+                    stack.append((child, idx, path + (element,)))
+                elif element == elements[idx]:
+                    stack.append((child, idx + 1, path + (element,)))
+        return supersets
@@ -0,0 +1,378 @@
+# encoding: utf-8
+"""
+@file: verifier.py
+@desc: Independent check that a set of sensors is a k-identifying code, i.e.,
+       that all sets of at most k nodes have distinct signatures, for the
+       solutions of gismo, the ILP solvers and the heuristic.
+"""
+
+import argparse
+from identifying_codes import IdentifyingCodesInstance, log_message
+from itertools import combinations
+import json
+import networkx as nx
+import numpy as np
+from scipy.sparse import hstack, identity
+import time
+
+# Seed of the random keys from which the signatures are hashed, such that a
+# verification can be reproduced
+HASH_SEED = 0
+
+# Maximum number of (confirmed) pairs of sets with equal signatures that are
+# reported
+MAX_REPORTED_COLLISIONS = 10
+
+# Maximum number of candidate sets generated when extending the connected sets
+# of one size to the next (see CodeVerifier._extend). On sparse networks this
+# is far from being reached for k <= 3, but around hubs the number of
+# connected sets explodes, and we would rather fail than run out of memory.
+MAX_CANDIDATE_SETS = 5 * 10 ** 7
+
+
+def _expand_rows(indptr, indices, rows):
+    """
+    Gather the entries of a number of rows of a CSR matrix.
+    :param indptr:  Index pointer array of the matrix.
+    :param indices: Column indices of the matrix.
+    :param rows:    Array of row indices (may contain repetitions).
+    :return:        (owner, columns): for each entry of the rows, the position
+                    in rows of the row it belongs to, and its column.
+    """
+    counts = indptr[rows + 1] - indptr[rows]
+    owner = np.repeat(np.arange(len(rows)), counts)
+    offsets = np.cumsum(counts) - counts
+    positions = np.repeat(indptr[rows] - offsets, counts) + np.arange(counts.sum())
+    return owner, indices[positions]
+
+
+def _pack(sets, n_nodes):
+    """
+    Pack each row of an array of node tuples into a single integer.
+    :param sets:    Integer array with a tuple of nodes (0..n_nodes - 1) per
+                    row, with n_nodes ** (number of columns) < 2 ** 63.
+    :param n_nodes: Number of nodes.
+    :return:        Array of int64 keys, ordered as the rows lexicographically.
+    """
+    packed = np.zeros(len(sets), dtype=np.int64)
+    for column in range(sets.shape[1]):
+        packed = packed * n_nodes + sets[:, column]
+    return packed
+
+
+def _unique_rows(sets, n_nodes):
+    """
+    Remove duplicate rows from an array of sorted node tuples.
+    :param sets:    See _pack.
+    :param n_nodes: Number of nodes.
+    :return:        Array of the unique rows, in lexicographic order.
+    """
+    packed = _pack(sets, n_nodes)
+    packed.sort()
+    packed = packed[np.diff(packed, prepend=-1) != 0]
+    unique = np.empty((len(packed), sets.shape[1]), dtype=sets.dtype)
+    for column in reversed(range(sets.shape[1])):
+        unique[:, column] = packed % n_nodes
+        packed //= n_nodes
+    return unique
+
+
+class CodeVerifier(IdentifyingCodesInstance):
+    """
+    Verifies that a sensor placement S is a k-identifying code of the
+    (preprocessed) graph. The signature of a set of nodes U is the union of the
+    signatures of its nodes: N[U] & S in the one-step setting, and
+    (U & S, N(U) & S) in the two-step setting, so we describe each node by a
+    row of 'features' (the sensors in its closed neighbourhood, or the sensor
+    on the node itself and the sensors in its open neighbourhood), and hash
+    the signature of a set as the sum of random 64-bit keys of the features in
+    the union of its rows. Equal hashes are confirmed by comparing the actual
+    signatures.
+
+    Hashing all sets of at most k nodes takes time C(n, k), but we only need
+    to hash the sets that are connected in H^2, where H links the nodes that
+    share a feature. If sets U != W have the same signature, then so do
+    U & K and W & K for some component K of U | W in H for which they differ,
+    since the features of the nodes in K are not shared with any other node
+    of U | W. If U | W is connected in H, then so is U in H^2: each feature
+    that links two consecutive nodes on a path in U | W is also a feature of a
+    node in U, since U and W have the same signature. The same holds for W.
+    For k = 1 this reduces to comparing the n signatures of the single nodes
+    (and that of the empty set).
+    """
+
+    def __init__(self):
+        IdentifyingCodesInstance.__init__(self)
+
+    def nodes_from_labels(self, labels):
+        """
+        Map the labels of the sensors in the network file to the nodes of the
+        preprocessed graph. In the one-step setting, a sensor on a twin that
+        was removed is equivalent to a sensor on the twin that replaced it.
+        :param labels:  Iterable of node labels (the labels of an edge list
+                        are strings, but ints are accepted too).
+        :return:        Sorted list of nodes.
+        """
+        replaced_by = {twin: node for node, twins in self._twins.items() for twin in twins}
+        nodes = set()
+        for label in labels:
+            for candidate in (label, str(label)):
+                candidate = replaced_by.get(candidate, candidate)
+                if candidate in self._label_2_node:
+                    nodes.add(self._label_2_node[candidate])
+                    break
+            else:
+                raise ValueError("Unknown node label: {label}".format(label=label))
+        return sorted(nodes)
+
+    def verify(self, sensors, k):
+        """
+        Check whether the sensors form a k-identifying code.
+        :param sensors: Iterable of sensor nodes (indices 1..n of the
+                        preprocessed graph, see nodes_from_labels).
+        :param k:       Maximum identifiable set size.
+        :return:        Dictionary with 'valid', the number of checked sets,
+                        and up to MAX_REPORTED_COLLISIONS pairs of sets of
+                        nodes (as labels) with the same signature.
+        """
+        log_message("{classname}: Start verifying for k = {k}".format(classname=self.__class__.__name__, k=k))
+        start_time = time.perf_counter()
+        self._k = k
+        n_nodes = self._G.number_of_nodes()
+        sensors = sorted(set(int(sensor) for sensor in sensors))
+        if sensors and not (1 <= sensors[0] and sensors[-1] <= n_nodes):
+            raise ValueError("Sensors must be nodes 1..{n}.".format(n=n_nodes))
+
+        P = self._features(np.array(sensors, dtype=np.int64) - 1)
+        keys = np.random.default_rng(HASH_SEED).integers(0, 2 ** 64, size=P.shape[1], dtype=np.uint64)
+        cumulative = np.zeros(P.nnz + 1, dtype=np.uint64)
+        np.cumsum(keys[P.indices], out=cumulative[1:])
+        node_hashes = cumulative[P.indptr[1:]] - cumulative[P.indptr[:-1]]
+
+        # The empty set has the empty signature, with hash 0
+        levels = [np.zeros((1, 0), dtype=np.int64)]
+        hashes = [np.zeros(1, dtype=np.uint64)]
+        max_size = min(k, n_nodes)
+        H2, tables = None, None
+        if max_size >= 2:
+            if n_nodes ** max_size >= 2 ** 63:
+                raise ValueError("Cannot verify k = {k} on {n} nodes.".format(k=k, n=n_nodes))
+            H2 = self._sharing_graph_squared(P)
+            tables = self._intersection_tables(P, keys, max_size)
+        for size in range(1, max_size + 1):
+            if size == 1:
+                sets = np.arange(n_nodes, dtype=np.int64).reshape(-1, 1)
+            elif size == 2:
+                pairs = H2.tocoo()
+                mask = pairs.row < pairs.col
+                sets = np.column_stack([pairs.row[mask], pairs.col[mask]]).astype(np.int64)
+            else:
+                sets = self._extend(levels[-1], H2, n_nodes)
+            if len(sets) == 0:
+                break
+            levels.append(sets)
+            hashes.append(self._set_hashes(sets, node_hashes, tables))
+
+        collisions = self._confirmed_collisions(levels, hashes, P)
+        n_sets = sum(len(sets) for sets in levels)
+        verify_time = time.perf_counter() - start_time
+        log_message("{classname}: {result} for k = {k}: checked {n_sets} sets in {t:.2f} seconds.".format(
+            classname=self.__class__.__name__, result='Valid' if not collisions else 'NOT VALID', k=k,
+            n_sets=n_sets, t=verify_time))
+        return {
+            'k': k,
+            'valid': not collisions,
+            'n_sensors': len(sensors),
+            'n_sets': n_sets,
+            'collisions': collisions,
+            'verify_time': verify_time,
+        }
+
+    def _features(self, sensor_indices):
+        """
+        :param sensor_indices:  Array of the (0-based) indices of the sensors.
+        :return:    CSR matrix with a row per node and a column per feature,
+                    with sorted indices.
+        """
+        n_nodes = self._G.number_of_nodes()
+        A = nx.to_scipy_sparse_array(self._G, nodelist=range(1, n_nodes + 1), dtype=np.int32, format='csc')
+        I = identity(n_nodes, dtype=np.int32, format='csc')
+        if self._two_step:
+            P = hstack([I[:, sensor_indices], A[:, sensor_indices]], format='csr')
+        else:
+            P = (A + I)[:, sensor_indices].tocsr()
+        P.eliminate_zeros()
+        P.sort_indices()
+        return P
+
+    @staticmethod
+    def _sharing_graph_squared(P):
+        """
+        :param P:   Feature matrix (see _features).
+        :return:    CSR matrix of the pairs of distinct nodes at distance at
+                    most 2 in the graph H that links nodes that share a
+                    feature.
+        """
+        H = (P @ P.T).tocsr()
+        H.data[:] = 1
+        H2 = (H + H @ H).tocsr()
+        H2.setdiag(0)
+        H2.eliminate_zeros()
+        H2.sort_indices()
+        return H2
+
+    @staticmethod
+    def _extend(sets, H2, n_nodes):
+        """
+        Extend each set by one of the neighbours in H^2 of its nodes. Each set
+        that is connected in H^2 is the extension of a smaller connected set
+        (remove a leaf of a spanning tree), so this generates all connected
+        sets of the next size.
+        :param sets:    Array with a sorted tuple of nodes per row.
+        :param H2:      See _sharing_graph_squared.
+        :param n_nodes: Number of nodes.
+        :return:        Array of the unique extended sets, sorted per row.
+        """
+        degrees = np.diff(H2.indptr)
+        n_candidates = int(degrees[sets].sum())
+        if n_candidates > MAX_CANDIDATE_SETS:
+            raise ValueError("Too many sets of {size} nodes to verify ({n} candidates).".format(
+                size=sets.shape[1] + 1, n=n_candidates))
+        extended = []
+        for column in range(sets.shape[1]):
+            owner, neighbours = _expand_rows(H2.indptr, H2.indices, sets[:, column])
+            extended.append(np.column_stack([sets[owner], neighbours]))
+        extended = np.vstack(extended)
+        extended.sort(axis=1)
+        extended = extended[np.all(extended[:, 1:] != extended[:, :-1], axis=1)]
+        return _unique_rows(extended, n_nodes)
+
+    @staticmethod
+    def _intersection_tables(P, keys, max_size):
+        """
+        Hash the intersections of the feature rows of the sets of 2 to
+        max_size nodes that have a feature in common, for the inclusion-
+        exclusion in _set_hashes. Only the nodes of a column of P share its
+        feature, so these sets are the subsets of the columns.
+        :param P:           Feature matrix (see _features).
+        :param keys:        Random key per feature.
+        :param max_size:    Largest set size.
+        :return:            Dictionary mapping each size to a pair (sorted
+                            packed sets, hash of their intersection).
+        """
+        n_nodes = P.shape[0]
+        Q = P.tocsc()
+        Q.sort_indices()
+        counts = np.diff(Q.indptr)
+        tables = dict()
+        for size in range(2, max_size + 1):
+            packed, subset_keys = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.uint64)]
+            for count in np.unique(counts[counts >= size]):
+                features = np.flatnonzero(counts == count)
+                members = Q.indices[Q.indptr[features][:, np.newaxis] + np.arange(count)]
+                subsets = np.array(list(combinations(range(count), size)))
+                packed.append(_pack(members[:, subsets].reshape(-1, size).astype(np.int64), n_nodes))
+                subset_keys.append(np.repeat(keys[features], len(subsets)))
+            packed, subset_keys = np.concatenate(packed), np.concatenate(subset_keys)
+            order = np.argsort(packed, kind='stable')
+            packed, subset_keys = packed[order], subset_keys[order]
+            first = np.flatnonzero(np.diff(packed, prepend=-1))
+            cumulative = np.zeros(len(subset_keys) + 1, dtype=np.uint64)
+            np.cumsum(subset_keys, out=cumulative[1:])
+            bounds = np.append(first, len(packed))
+            tables[size] = (packed[first], cumulative[bounds[1:]] - cumulative[bounds[:-1]])
+        return tables
+
+    @staticmethod
+    def _set_hashes(sets, node_hashes, tables):
+        """
+        Hash the signatures of the sets by inclusion-exclusion: the sum of the
+        hashes of their nodes, minus the hashes of the pairwise intersections,
+        plus those of the intersections of three nodes, etc. All arithmetic is
+        modulo 2^64.
+        :param sets:        Array with a sorted tuple of nodes per row.
+        :param node_hashes: Hash of the feature row of each node.
+        :param tables:      See _intersection_tables.
+        :return:            Array with a hash per set.
+        """
+        hashes = node_hashes[sets].sum(axis=1, dtype=np.uint64)
+        n_nodes = len(node_hashes)
+        for size in range(2, sets.shape[1] + 1):
+            packed, intersection_hashes = tables[size]
+            if len(packed) == 0:
+                break
+            for columns in combinations(range(sets.shape[1]), size):
+                lookup = _pack(sets[:, columns], n_nodes)
+                positions = np.minimum(np.searchsorted(packed, lookup), len(packed) - 1)
+                values = np.where(packed[positions] == lookup, intersection_hashes[positions], np.uint64(0))
+                if size % 2 == 0:
+                    hashes -= values
+                else:
+                    hashes += values
+        return hashes
+
+    def _confirmed_collisions(self, levels, hashes, P):
+        """
+        Find the sets with equal hashes, and confirm that their signatures are
+        equal (rather than their hashes colliding by chance).
+        :return:    List of up to MAX_REPORTED_COLLISIONS pairs of sets (as
+                    sorted lists of labels) with the same signature.
+        """
+        set_hashes = np.concatenate(hashes)
+        order = np.argsort(set_hashes, kind='stable')
+        sorted_hashes = set_hashes[order]
+        equal = np.flatnonzero(sorted_hashes[1:] == sorted_hashes[:-1])
+        if len(equal) == 0:
+            return []
+        level_offsets = np.cumsum([0] + [len(sets) for sets in levels])
+
+        def nodes_of(position):
+            level = np.searchsorted(level_offsets, position, side='right') - 1
+            return levels[level][position - level_offsets[level]]
+
+        def signature(nodes):
+            return frozenset(feature for node in nodes
+                             for feature in P.indices[P.indptr[node]:P.indptr[node + 1]].tolist())
+
+        collisions = []
+        for idx in equal:
+            U, W = nodes_of(order[idx]), nodes_of(order[idx + 1])
+            if signature(U) == signature(W):
+                collisions.append([[self._node_2_label[int(node) + 1] for node in U],
+                                   [self._node_2_label[int(node) + 1] for node in W]])
+                if len(collisions) >= MAX_REPORTED_COLLISIONS:
+                    break
+        return collisions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    required_args = parser.add_argument_group("Required arguments")
+    optional_args = parser.add_argument_group("Optional arguments")
+    required_args.add_argument("--network", "-n", type=str, required=True,
+                               help="Path to network file.")
+    required_args.add_argument("--sensors", type=str, nargs='*', required=True,
+                               help="Labels of the sensor nodes, as in the network file.")
+    optional_args.add_argument("-k", type=int, nargs='+', default=[1],
+                               help="Max number of simultaneous events.")
+    optional_args.add_argument("--two_step", required=False, action="store_true",
+                               help="Verify a two-step identifying code.")
+    optional_args.add_argument("--indices", required=False, action="store_true",
+                               help="The sensors are given as the indices 1..n of the preprocessed graph (e.g., the "
+                                    "groups of a GCNF encoding), rather than as labels.")
+    optional_args.add_argument("--out_file", type=str, required=False, default=None,
+                               help="File to which the verification results (one per k) are written, as JSON.")
+    args = parser.parse_args()
+
+    verifier = CodeVerifier()
+    verifier.build_from_file(args.network, two_step=args.two_step)
+    sensors = [int(sensor) for sensor in args.sensors] if args.indices else verifier.nodes_from_labels(args.sensors)
+    results = [verifier.verify(sensors, k) for k in sorted(args.k)]
+    if args.out_file is not None:
+        with open(args.out_file, 'w') as rfile:
+            rfile.write(json.dumps(results, indent=4) + "\n")
+    log_message("Done!")
+
+
+if __name__ == '__main__':
+    main()